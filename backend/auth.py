@@ -0,0 +1,61 @@
+"""
+Verificación de tokens JWT del panel de administración de Mathi Phone
+Los tokens ya verificados se guardan en un LRU acotado, indexado por la firma y con
+vencimiento en `exp`, así que las escrituras seguidas del admin no vuelven a decodificar;
+los tokens revocados (por `jti`) se rechazan con una consulta O(1) a un diccionario
+"""
+import hmac
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple
+import jwt
+
+
+class VerifiedToken(NamedTuple):
+    token: str
+    claims: Dict[str, Any]
+    expires_at: float  # `exp` en segundos epoch
+
+
+class TokenVerifier:
+    def __init__(self, secret: str, algorithm: str = 'HS256', max_entries: int = 1024):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self._verified: "OrderedDict[str, VerifiedToken]" = OrderedDict()
+        self._revoked: Dict[str, float] = {}  # jti -> exp, para poder descartarlos al vencer
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Claims del token; jwt.InvalidTokenError si la firma, el vencimiento o la revocación fallan"""
+        now = time.time()
+        signature = token.rpartition('.')[2]
+        entry = self._verified.get(signature)
+        # La firma identifica al token, pero se compara completo para no aceptar otro header/payload
+        if entry is not None and hmac.compare_digest(entry.token, token):
+            if entry.expires_at <= now:
+                del self._verified[signature]
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            self._check_revoked(entry.claims)
+            self._verified.move_to_end(signature)
+            return entry.claims
+
+        claims = jwt.decode(token, self.secret, algorithms=[self.algorithm], options={'require': ['exp', 'sub']})
+        self._check_revoked(claims)
+        self._verified[signature] = VerifiedToken(token, claims, float(claims['exp']))
+        while len(self._verified) > self.max_entries:
+            self._verified.popitem(last=False)
+        return claims
+
+    def _check_revoked(self, claims: Dict[str, Any]):
+        if claims.get('jti') in self._revoked:
+            raise jwt.InvalidTokenError("Token has been revoked")
+
+    def revoke(self, jti: str, expires_at: float):
+        """Revocar un token hasta su vencimiento (después ya lo rechaza `exp`)"""
+        self._revoked[jti] = expires_at
+        self._prune_revoked()
+
+    def _prune_revoked(self):
+        now = time.time()
+        for jti in [jti for jti, expires_at in self._revoked.items() if expires_at <= now]:
+            del self._revoked[jti]
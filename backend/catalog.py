@@ -0,0 +1,405 @@
+"""
+Catálogo columnar en memoria para Mathi Phone
+Mantiene los campos filtrables de los productos como columnas NumPy para que
+/api/products filtre con máscaras booleanas en lugar de recorrer diccionarios
+"""
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from product_query import (
+    DEFAULT_SORT, RANGE_FILTERS, SORT_OPTIONS, ProductPage, decode_cursor, encode_cursor, normalize_filters
+)
+from facets import FACET_FIELDS, sorted_counts
+from search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Campos categóricos codificados con diccionario (valor -> código entero)
+CATEGORICAL_FIELDS = ('category', 'model', 'type', 'condition', 'storage', 'color')
+FLOAT_FIELDS = ('price_ars', 'price_usd')
+INT_FIELDS = ('battery_health',)
+
+# Centinelas para valores ausentes: nunca cumplen un filtro de rango
+MISSING_CODE = -1
+MISSING_INT = np.iinfo(np.int32).min
+
+# Filtros de igualdad sobre columnas categóricas
+_EQUALITY_FILTERS = ('category', 'model', 'type', 'condition')
+
+# Columnas con un orden (clave, _id) mantenido: ordenamiento, cursores y filtros de rango
+SORTED_COLUMNS = ('_id', 'price_usd', 'price_ars', 'battery_health', 'name')
+
+# Filas que se examinan por tanda al recorrer un orden buscando una página
+_SCAN_CHUNK = 256
+
+
+class _SortedOrder:
+    """Filas vivas ordenadas por (clave, _id), actualizadas en cada escritura sin reordenar todo"""
+
+    def __init__(self):
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.keys = np.zeros(0)
+        self.oids = np.zeros(0, dtype='S24')
+
+    def rebuild(self, keys: np.ndarray, oids: np.ndarray, alive: np.ndarray):
+        rows = np.flatnonzero(alive)
+        self.rows = rows[np.lexsort((oids[rows], keys[rows]))]
+        self.keys = keys[self.rows]
+        self.oids = oids[self.rows]
+
+    def position(self, key: Any, oid: bytes, after: bool = False) -> int:
+        """Índice de (key, oid) en el orden; con after=True, el primero estrictamente mayor"""
+        lo = np.searchsorted(self.keys, key, side='left')
+        hi = np.searchsorted(self.keys, key, side='right')
+        return int(lo + np.searchsorted(self.oids[lo:hi], oid, side='right' if after else 'left'))
+
+    def insert(self, row: int, key: Any, oid: bytes):
+        index = self.position(key, oid)
+        self.rows = np.insert(self.rows, index, row)
+        self.keys = np.insert(self.keys, index, key)
+        self.oids = np.insert(self.oids, index, oid)
+
+    def discard(self, row: int):
+        found = np.flatnonzero(self.rows == row)
+        if len(found):
+            index = found[0]
+            self.rows = np.delete(self.rows, index)
+            self.keys = np.delete(self.keys, index)
+            self.oids = np.delete(self.oids, index)
+
+    def between(self, low: Any = None, high: Any = None, floor: Any = None, ceiling: Any = None) -> np.ndarray:
+        """Filas con low <= clave <= high, por búsqueda binaria
+
+        floor y ceiling descartan los centinelas de ausentes: MISSING_INT queda al principio
+        del orden y NaN al final.
+        """
+        start = 0 if low is None else np.searchsorted(self.keys, low, side='left')
+        if floor is not None:
+            start = max(start, np.searchsorted(self.keys, floor, side='right'))
+        end = len(self.keys) if high is None else np.searchsorted(self.keys, high, side='right')
+        if ceiling is not None:
+            end = min(end, np.searchsorted(self.keys, ceiling, side='right'))
+        return self.rows[start:end]
+
+
+class CatalogSnapshot:
+    def __init__(self, capacity: int = 1024):
+        self.loaded = False
+        self.version = 0
+        self.search_index = SearchIndex()
+        # Escrituras recibidas durante cada load() en curso, para reaplicarlas sobre lo leído
+        self._writes_during_load: List[List[Tuple[str, Any]]] = []
+        self._reset(capacity)
+
+    def _reset(self, capacity: int):
+        self._size = 0
+        self._docs: List[Optional[Dict[str, Any]]] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._alive = np.zeros(capacity, dtype=bool)
+        # _id de MongoDB en hexadecimal: orden de inserción y desempate de los cursores
+        self._oids = np.zeros(capacity, dtype='S24')
+        self._names = np.full(capacity, '', dtype=object)
+        self._orders = {column: _SortedOrder() for column in SORTED_COLUMNS}
+        self._available = np.full(capacity, MISSING_CODE, dtype=np.int8)
+        self._vocab: Dict[str, Dict[Any, int]] = {field: {} for field in CATEGORICAL_FIELDS}
+        self._codes = {field: np.full(capacity, MISSING_CODE, dtype=np.int32) for field in CATEGORICAL_FIELDS}
+        self._floats = {field: np.full(capacity, np.nan, dtype=np.float64) for field in FLOAT_FIELDS}
+        self._ints = {field: np.full(capacity, MISSING_INT, dtype=np.int32) for field in INT_FIELDS}
+        self._rebuild_orders()
+
+    def __len__(self) -> int:
+        return len(self._row_by_id)
+
+    async def load(self, db) -> int:
+        """Cargar el catálogo completo desde la base de datos
+
+        Los documentos se leen antes de tocar las columnas: una recarga no expone un
+        catálogo a medio cargar a los requests concurrentes. Las escrituras aplicadas
+        mientras se leía se reaplican sobre el resultado, que pudo haberlas leído o no.
+        """
+        writes: List[Tuple[str, Any]] = []
+        self._writes_during_load.append(writes)
+        try:
+            products = [product async for product in db.iter_products(include_oid=True)]
+        finally:
+            self._writes_during_load.remove(writes)
+        self._reset(max(1024, len(products)))
+        self.search_index.clear()
+        for product in products:
+            product = self._write_row(self._append_row(product['id']), product)
+            self.search_index.add(product)
+        self._rebuild_orders()
+        for operation, value in writes:
+            if operation == 'upsert':
+                self.upsert(value)
+            else:
+                self.remove(value)
+        self.loaded = True
+        self.version += 1
+        logger.info(f"📦 Catálogo en memoria cargado: {len(self)} productos")
+        return len(self)
+
+    # Escrituras incrementales
+
+    def upsert(self, product: Dict[str, Any]):
+        """Insertar o reemplazar un producto"""
+        for writes in self._writes_during_load:
+            writes.append(('upsert', product))
+        product_id = product['id']
+        row = self._row_by_id.get(product_id)
+        if row is None:
+            row = self._append_row(product_id)
+        else:
+            self._discard_from_orders(row)
+        product = self._write_row(row, product)
+        self._insert_into_orders(row)
+        self.search_index.add(product)
+        self.version += 1
+
+    def remove(self, product_id: str) -> bool:
+        """Eliminar un producto (la fila queda marcada hasta compactar)"""
+        for writes in self._writes_during_load:
+            writes.append(('remove', product_id))
+        row = self._row_by_id.pop(product_id, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        self._docs[row] = None
+        self._discard_from_orders(row)
+        self.search_index.remove(product_id)
+        self.version += 1
+        if self._size > 1024 and len(self) < self._size // 2:
+            self._compact()
+        return True
+
+    def get(self, product_id: str) -> Optional[Dict[str, Any]]:
+        row = self._row_by_id.get(product_id)
+        return None if row is None else self._docs[row]
+
+    def _append_row(self, product_id: str) -> int:
+        if self._size == len(self._alive):
+            self._grow(max(1024, 2 * self._size))
+        row = self._size
+        self._size += 1
+        self._docs.append(None)
+        self._row_by_id[product_id] = row
+        return row
+
+    def _write_row(self, row: int, product: Dict[str, Any]) -> Dict[str, Any]:
+        """Escribir las columnas de una fila; devuelve el documento guardado, sin `_id`"""
+        if '_id' in product:
+            product = dict(product)
+            self._oids[row] = str(product.pop('_id')).encode()
+        elif not self._oids[row]:
+            self._oids[row] = str(ObjectId()).encode()
+        self._docs[row] = product
+        self._alive[row] = True
+        available = product.get('available')
+        self._available[row] = MISSING_CODE if available is None else int(bool(available))
+        for field in CATEGORICAL_FIELDS:
+            self._codes[field][row] = self._encode(field, product.get(field))
+        for field in FLOAT_FIELDS:
+            self._floats[field][row] = _to_float(product.get(field))
+        for field in INT_FIELDS:
+            self._ints[field][row] = _to_int(product.get(field))
+        self._names[row] = str(product.get('name') or '')
+        return product
+
+    def _encode(self, field: str, value: Any) -> int:
+        if value is None:
+            return MISSING_CODE
+        vocab = self._vocab[field]
+        code = vocab.get(value)
+        if code is None:
+            code = vocab[value] = len(vocab)
+        return code
+
+    def _grow(self, capacity: int):
+        def resized(array, fill):
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self._alive = resized(self._alive, False)
+        self._oids = resized(self._oids, b'')
+        self._names = resized(self._names, '')
+        self._available = resized(self._available, MISSING_CODE)
+        self._codes = {field: resized(array, MISSING_CODE) for field, array in self._codes.items()}
+        self._floats = {field: resized(array, np.nan) for field, array in self._floats.items()}
+        self._ints = {field: resized(array, MISSING_INT) for field, array in self._ints.items()}
+
+    def _compact(self):
+        """Reescribir las columnas sin las filas eliminadas, conservando el orden"""
+        rows = [row for row, doc in enumerate(self._docs) if doc is not None]
+        docs = [dict(self._docs[row], _id=self._oids[row].decode()) for row in rows]
+        self._reset(max(1024, 2 * len(docs)))
+        for product in docs:
+            self._write_row(self._append_row(product['id']), product)
+        self._rebuild_orders()
+
+    # Órdenes mantenidos
+
+    def _sort_keys(self, column: str) -> np.ndarray:
+        n = self._size
+        if column == '_id':
+            return self._oids[:n]
+        if column == 'name':
+            return self._names[:n]
+        if column in FLOAT_FIELDS:
+            return self._floats[column][:n]
+        return self._ints[column][:n]
+
+    def _rebuild_orders(self):
+        for column, order in self._orders.items():
+            order.rebuild(self._sort_keys(column), self._oids[:self._size], self._alive[:self._size])
+
+    def _insert_into_orders(self, row: int):
+        for column, order in self._orders.items():
+            order.insert(row, self._sort_keys(column)[row], self._oids[row])
+
+    def _discard_from_orders(self, row: int):
+        for order in self._orders.values():
+            order.discard(row)
+
+    # Consultas
+
+    def mask(self, filters: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Máscara booleana de las filas que cumplen los filtros"""
+        return self._match(filters)[0]
+
+    def _match(self, filters: Optional[Dict[str, Any]]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Máscara de filas y, si hay búsqueda, la columna de puntajes BM25"""
+        filters = normalize_filters(filters)
+        n = self._size
+        mask = self._alive[:n].copy()
+
+        for field in _EQUALITY_FILTERS:
+            if field in filters:
+                code = self._vocab[field].get(filters[field])
+                if code is None:
+                    return np.zeros(n, dtype=bool), None
+                mask &= self._codes[field][:n] == code
+        if 'available' in filters:
+            mask &= self._available[:n] == int(bool(filters['available']))
+
+        # Rangos por búsqueda binaria sobre el orden mantenido de cada columna
+        bounds: Dict[str, Dict[str, Any]] = {}
+        for param, (field, operator) in RANGE_FILTERS.items():
+            if param in filters:
+                bounds.setdefault(field, {})['low' if operator == '$gte' else 'high'] = filters[param]
+        for field, bound in bounds.items():
+            floor = MISSING_INT if field in INT_FIELDS else None
+            ceiling = np.inf if field in FLOAT_FIELDS else None
+            in_range = np.zeros(n, dtype=bool)
+            in_range[self._orders[field].between(floor=floor, ceiling=ceiling, **bound)] = True
+            mask &= in_range
+
+        scores = None
+        if 'search' in filters:
+            scores = np.zeros(n, dtype=np.float64)
+            for product_id, score in self.search_index.search(filters['search']).items():
+                scores[self._row_by_id[product_id]] = score
+            mask &= scores > 0
+        return mask, scores
+
+    def facets(self, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Conteo por valor de cada faceta sobre la máscara de los filtros"""
+        mask = self.mask(filters)
+        facets = {}
+        for field in FACET_FIELDS:
+            codes = self._codes[field][:self._size][mask]
+            counts = np.bincount(codes[codes != MISSING_CODE], minlength=len(self._vocab[field]))
+            values = list(self._vocab[field])
+            facets[field] = sorted_counts({values[code]: int(counts[code]) for code in np.flatnonzero(counts)})
+        return {'total': int(mask.sum()), 'facets': facets}
+
+    def query(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        count: str = 'exact'
+    ) -> ProductPage:
+        """Obtener una página de productos, el total y el cursor de la página siguiente
+
+        El conteo siempre es exacto: en memoria cuesta lo mismo que estimarlo.
+        """
+        mask, scores = self._match(filters)
+        total = None if count == 'none' else int(mask.sum())
+        wanted = skip + limit + 1 if limit else None
+
+        if sort == 'relevance' and scores is not None:
+            rows = _top_rows(np.flatnonzero(mask), scores, wanted)
+        else:
+            column, direction = SORT_OPTIONS.get(sort, DEFAULT_SORT)
+            order = self._orders[column]
+            start, end = 0, len(order.rows)
+            if cursor:
+                key, oid = decode_cursor(cursor, sort)
+                if column == '_id':
+                    key = oid.encode()
+                if direction > 0:
+                    start = order.position(key, oid.encode(), after=True)
+                else:
+                    end = order.position(key, oid.encode())
+            sequence = order.rows[start:end] if direction > 0 else order.rows[start:end][::-1]
+            rows = _take_matching(sequence, mask, wanted)
+
+        page = rows[skip:skip + limit] if limit else rows[skip:]
+        next_cursor = None
+        if limit and len(rows) > skip + limit and sort != 'relevance':
+            last = page[-1]
+            column = SORT_OPTIONS.get(sort, DEFAULT_SORT)[0]
+            key = None if column == '_id' else _plain(self._sort_keys(column)[last])
+            next_cursor = encode_cursor(sort, key, self._oids[last].decode())
+        return ProductPage([self._docs[row] for row in page], total, next_cursor)
+
+
+def _take_matching(sequence: np.ndarray, mask: np.ndarray, wanted: Optional[int]) -> np.ndarray:
+    """Primeras `wanted` filas de la secuencia que cumplen la máscara, sin recorrerla entera"""
+    if wanted is None:
+        return sequence[mask[sequence]]
+    taken = []
+    found = 0
+    chunk = max(_SCAN_CHUNK, 4 * wanted)
+    for start in range(0, len(sequence), chunk):
+        segment = sequence[start:start + chunk]
+        segment = segment[mask[segment]]
+        taken.append(segment)
+        found += len(segment)
+        if found >= wanted:
+            break
+    return np.concatenate(taken)[:wanted] if taken else sequence[:0]
+
+
+def _top_rows(rows: np.ndarray, scores: np.ndarray, wanted: Optional[int]) -> np.ndarray:
+    """Filas por puntaje descendente; con límite, selección top-k sin ordenar todo el resultado"""
+    if wanted is not None and wanted < len(rows):
+        rows = rows[np.argpartition(-scores[rows], wanted - 1)[:wanted]]
+    return rows[np.lexsort((rows, -scores[rows]))]
+
+
+def _plain(value: Any) -> Any:
+    """Escalar NumPy -> tipo de Python, para serializar la clave del cursor"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_INT
+
+
+# Instancia global del catálogo
+catalog = CatalogSnapshot()
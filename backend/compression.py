@@ -0,0 +1,194 @@
+"""
+Compresión de respuestas para Mathi Phone
+Middleware ASGI que negocia brotli/gzip sin depender de un proxy, y guarda las variantes
+comprimidas de las respuestas GET para no volver a comprimir los mismos bytes
+"""
+import hashlib
+import os
+import zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # Sin brotli se ofrece solo gzip
+    brotli = None
+
+# Codificaciones en orden de preferencia del servidor
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml',
+    'application/x-ndjson', 'image/svg+xml',
+)
+# Los eventos SSE deben llegar al cliente apenas se emiten
+UNCOMPRESSED_TYPES = ('text/event-stream',)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Mejor codificación aceptada por el cliente según Accept-Encoding (q=0 la excluye)"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ENCODINGS:
+        if accepted.get(coding, accepted.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: formato gzip
+    return compressor.compress(body) + compressor.flush()
+
+
+class StreamCompressor:
+    """Compresión incremental para respuestas en varias partes (exportaciones, streams)"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Comprimir y vaciar el buffer, para que cada parte llegue al cliente sin esperar a la siguiente"""
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class VariantCache:
+    """Variantes comprimidas por (hash del cuerpo, codificación), con desalojo LRU por tamaño
+
+    La clave es el contenido, así que una respuesta nueva nunca recibe una variante vieja.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._entries: "OrderedDict[Tuple[bytes, str], bytes]" = OrderedDict()
+
+    def get_or_compress(self, body: bytes, encoding: str) -> bytes:
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = self._entries.get(key)
+        if compressed is not None:
+            self._entries.move_to_end(key)
+            return compressed
+        compressed = compress(body, encoding)
+        if len(compressed) <= self.max_bytes:
+            self._entries[key] = compressed
+            self._size += len(compressed)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return compressed
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, cache: Optional[VariantCache] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = cache if cache is not None else VariantCache()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        cache = self.cache if scope['method'] == 'GET' else None
+        responder = _CompressionResponder(send, encoding, self.minimum_size, cache)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """Retiene el inicio de la respuesta hasta ver el primer cuerpo y decidir si se comprime"""
+
+    def __init__(self, send: Send, encoding: str, minimum_size: int, cache: Optional[VariantCache]):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.cache = cache
+        self.start: Optional[Message] = None
+        self.stream: Optional[StreamCompressor] = None
+        self.passthrough = False
+
+    def _compressible(self, start: Message, headers: MutableHeaders, body: bytes, more_body: bool) -> bool:
+        if start['status'] != 200 or 'content-encoding' in headers:
+            return False
+        content_type = headers.get('content-type', '')
+        if content_type.startswith(UNCOMPRESSED_TYPES) or not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        return more_body or len(body) >= self.minimum_size
+
+    async def send(self, message: Message):
+        if message['type'] == 'http.response.start':
+            self.start = message
+            return
+        if message['type'] != 'http.response.body' or self.passthrough:
+            await self._send(message)
+            return
+        if self.stream is not None:
+            body = self.stream.chunk(message.get('body', b''))
+            if not message.get('more_body', False):
+                body += self.stream.finish()
+            await self._send({**message, 'body': body})
+            return
+
+        start, self.start = self.start, None
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        headers = MutableHeaders(raw=start['headers'])
+        etag = headers.get('etag')
+        if etag and not etag.startswith('W/') and start['status'] in (200, 304):
+            # Los bytes enviados cambian con la codificación: el validador fuerte pasa a débil.
+            # También sin comprimir y en los 304, que no saben si el 200 se comprimió: el
+            # cliente recibe siempre el mismo ETag
+            headers['ETag'] = 'W/' + etag
+            headers.add_vary_header('Accept-Encoding')
+        if not self._compressible(start, headers, body, more_body):
+            self.passthrough = True
+            await self._send(start)
+            await self._send(message)
+            return
+
+        headers['Content-Encoding'] = self.encoding
+        headers.add_vary_header('Accept-Encoding')
+        if more_body:
+            self.stream = StreamCompressor(self.encoding)
+            if 'content-length' in headers:
+                del headers['Content-Length']
+            body = self.stream.chunk(body)
+        else:
+            body = self.cache.get_or_compress(body, self.encoding) if self.cache else compress(body, self.encoding)
+            headers['Content-Length'] = str(len(body))
+        await self._send(start)
+        await self._send({**message, 'body': body})
+
+
+# Instancia global del caché de variantes comprimidas
+variant_cache = VariantCache(int(os.environ.get('COMPRESSION_CACHE_MAX_BYTES', 16 * 1024 * 1024)))
@@ -0,0 +1,184 @@
+"""
+Registro declarativo de índices MongoDB para Mathi Phone
+connect() reconcilia estos índices al iniciar; el CLI permite revisarlos y construirlos a mano
+
+Uso:
+    python db_indexes.py diff
+    python db_indexes.py apply [--rebuild]
+"""
+import argparse
+import asyncio
+from typing import Any, Dict, List, Tuple
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+# Opciones que distinguen a dos índices con el mismo nombre
+_COMPARED_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'weights', 'default_language', 'partialFilterExpression')
+
+# Índices deseados por colección
+INDEXES: Dict[str, List[IndexModel]] = {
+    'products': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel(
+            [('category', ASCENDING), ('model', ASCENDING), ('type', ASCENDING)],
+            name='category_model_type'
+        ),
+        IndexModel(
+            [('condition', ASCENDING), ('battery_health', DESCENDING)],
+            name='condition_battery_health'
+        ),
+        IndexModel(
+            [('available', ASCENDING), ('price_usd', ASCENDING)],
+            name='available_price_usd'
+        ),
+        # Clave natural de la importación de listas de proveedores (product_import.py)
+        IndexModel(
+            [('name', ASCENDING), ('model', ASCENDING), ('storage', ASCENDING), ('color', ASCENDING), ('condition', ASCENDING)],
+            name='natural_key'
+        ),
+        # Órdenes de /api/products, desempatados por _id para los cursores
+        IndexModel([('price_usd', ASCENDING), ('_id', ASCENDING)], name='price_usd_sort'),
+        IndexModel([('battery_health', ASCENDING), ('_id', ASCENDING)], name='battery_health_sort'),
+        IndexModel([('name', ASCENDING), ('_id', ASCENDING)], name='name_sort'),
+        IndexModel(
+            [('name', TEXT), ('color', TEXT), ('chip', TEXT), ('features', TEXT), ('description', TEXT)],
+            name='product_text',
+            weights={'name': 10, 'chip': 5, 'color': 3, 'features': 3, 'description': 1},
+            default_language='spanish'
+        ),
+    ],
+    # Historial de tasas (rate_history.TIERS): los TTL implementan la retención de cada resolución
+    'exchange_rates_raw': [
+        IndexModel([('ts', ASCENDING)], name='ts_ttl', expireAfterSeconds=24 * 3600),
+    ],
+    'exchange_rates_5m': [
+        IndexModel([('bucket', ASCENDING)], name='bucket_ttl', unique=True, expireAfterSeconds=30 * 24 * 3600),
+    ],
+    'exchange_rates_1h': [
+        IndexModel([('bucket', ASCENDING)], name='bucket_unique', unique=True),
+    ],
+    # Leases de leader.py: MongoDB borra los vencidos (la vigencia se valida igual con expires_at)
+    'leases': [
+        IndexModel([('expires_at', ASCENDING)], name='expires_ttl', expireAfterSeconds=0),
+    ],
+}
+
+
+def _normalize_key(key: Any) -> List[Tuple[str, Any]]:
+    """Representación comparable de la clave de un índice"""
+    items = key.items() if isinstance(key, dict) else key
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in items]
+
+
+def _wanted_spec(model: IndexModel) -> Dict[str, Any]:
+    """Especificación comparable de un índice deseado"""
+    document = model.document
+    spec = {option: document[option] for option in _COMPARED_OPTIONS if option in document}
+    key = _normalize_key(document['key'])
+    if any(direction == TEXT for _, direction in key):
+        # MongoDB guarda los índices de texto como _fts/_ftsx y los pesos aparte
+        spec.setdefault('weights', {field: 1 for field, direction in key if direction == TEXT})
+        spec.setdefault('default_language', 'english')
+        key = [(field, direction) for field, direction in key if direction != TEXT]
+        key = [('_fts', 'text'), ('_ftsx', 1)] + key
+    spec['key'] = key
+    return spec
+
+
+def _live_spec(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Especificación comparable de un índice existente (index_information)"""
+    spec = {option: info[option] for option in _COMPARED_OPTIONS if option in info}
+    if 'weights' in spec:
+        spec['weights'] = dict(spec['weights'])
+    spec['key'] = _normalize_key(info['key'])
+    return spec
+
+
+def diff_indexes(wanted: List[IndexModel], live: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Comparar los índices deseados con los existentes de una colección"""
+    result = {'missing': [], 'changed': [], 'extra': [], 'ok': []}
+    wanted_names = set()
+    for model in wanted:
+        name = model.document['name']
+        wanted_names.add(name)
+        if name not in live:
+            result['missing'].append(name)
+        elif _live_spec(live[name]) != _wanted_spec(model):
+            result['changed'].append(name)
+        else:
+            result['ok'].append(name)
+    result['extra'] = [name for name in live if name != '_id_' and name not in wanted_names]
+    return result
+
+
+def _in_background(model: IndexModel) -> IndexModel:
+    """Copia del índice que se construye sin bloquear la colección"""
+    options = dict(model.document)
+    key = options.pop('key')
+    options['background'] = True
+    return IndexModel(list(key.items()), **options)
+
+
+async def plan(database) -> Dict[str, Dict[str, List[str]]]:
+    """Diferencias por colección entre el registro y la base de datos"""
+    changes = {}
+    for collection_name, wanted in INDEXES.items():
+        live = await database[collection_name].index_information()
+        changes[collection_name] = diff_indexes(wanted, live)
+    return changes
+
+
+async def reconcile_indexes(database, rebuild: bool = False) -> Dict[str, Dict[str, List[str]]]:
+    """Crear en segundo plano los índices que faltan
+
+    Los índices con otra definición solo se reconstruyen con rebuild=True, para no
+    bloquear el arranque de la API con un drop inesperado.
+    """
+    changes = await plan(database)
+    for collection_name, diff in changes.items():
+        collection = database[collection_name]
+        by_name = {model.document['name']: model for model in INDEXES[collection_name]}
+
+        to_create = list(diff['missing'])
+        if rebuild:
+            for name in diff['changed']:
+                await collection.drop_index(name)
+            to_create += diff['changed']
+        elif diff['changed']:
+            print(f"⚠️ Indexes with a different definition on {collection_name}: {', '.join(diff['changed'])}")
+
+        for name in to_create:
+            model = by_name[name]
+            try:
+                await collection.create_indexes([_in_background(model)])
+                print(f"✅ Created index {collection_name}.{name}")
+            except OperationFailure as e:
+                # Ej.: ids duplicados que impiden construir el índice único
+                print(f"❌ Could not create index {collection_name}.{name}: {e}")
+    return changes
+
+
+async def _main(args):
+    from mongodb_database import db
+
+    await db.connect(ensure_indexes=False)
+    try:
+        if args.command == 'diff':
+            changes = await plan(db.db)
+        else:
+            changes = await reconcile_indexes(db.db, rebuild=args.rebuild)
+        for collection_name, diff in changes.items():
+            print(f"\n📚 {collection_name}")
+            for status in ('ok', 'missing', 'changed', 'extra'):
+                for name in diff[status]:
+                    print(f"   {status:<8} {name}")
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gestionar los índices MongoDB de Mathi Phone")
+    parser.add_argument('command', choices=['diff', 'apply'])
+    parser.add_argument('--rebuild', action='store_true', help="Reconstruir los índices con otra definición")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,145 @@
+"""
+Eventos en vivo (Server-Sent Events) para Mathi Phone
+Un broker en memoria reparte cada evento, codificado una sola vez, a las colas acotadas
+de los clientes conectados; un buffer circular permite retomar con Last-Event-ID.
+Cada worker numera sus eventos por su cuenta, así que el ID lleva el origen ("<origen>-<n>"):
+un cliente que se reconecta a otro worker recibe un resync en lugar de un tramo equivocado.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Deque, List, NamedTuple, Optional, Set, Tuple
+
+# (origen, número) de un Last-Event-ID
+EventId = Tuple[str, int]
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    frame: bytes  # evento ya serializado en formato SSE
+
+
+def format_event(origin: str, event_id: int, event_type: str, data: Any) -> bytes:
+    payload = data.decode() if isinstance(data, bytes) else json.dumps(data, default=str, separators=(',', ':'))
+    return f"id: {origin}-{event_id}\nevent: {event_type}\ndata: {payload}\n\n".encode()
+
+
+class Subscription:
+    def __init__(self, max_pending: int):
+        self.queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue(max_pending)
+
+    def push(self, event: Event) -> bool:
+        """Encolar sin esperar; False si el cliente no da abasto"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def close(self):
+        """Vaciar la cola y cerrar el stream: el cliente se reconecta y retoma desde el buffer"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventBroker:
+    def __init__(self, replay_size: int = 1000, max_pending: int = 256, origin: Optional[str] = None):
+        self.max_pending = max_pending
+        self.origin = origin or uuid.uuid4().hex[:8]
+        self._replay: Deque[Event] = deque(maxlen=replay_size)
+        self._subscribers: Set[Subscription] = set()
+        # IDs basados en el reloj: siguen creciendo después de un reinicio
+        self._last_id = int(time.time() * 1000)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def publish(self, event_type: str, data: Any) -> Event:
+        self._last_id += 1
+        event = Event(self._last_id, event_type, format_event(self.origin, self._last_id, event_type, data))
+        self._replay.append(event)
+        for subscription in list(self._subscribers):
+            if not subscription.push(event):
+                self.unsubscribe(subscription)
+                subscription.close()
+        return event
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.max_pending)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def replay_since(self, last_event_id: EventId) -> Optional[List[Event]]:
+        """Eventos posteriores a last_event_id, o None si el buffer ya no los cubre o el ID es de otro worker"""
+        origin, last_event_id = last_event_id
+        if origin != self.origin:
+            return None
+        if last_event_id >= self._last_id:
+            return []
+        if not self._replay or last_event_id < self._replay[0].id - 1:
+            return None
+        return [event for event in self._replay if event.id > last_event_id]
+
+
+def parse_event_id(value: Optional[str]) -> Optional[EventId]:
+    """"<origen>-<n>"; un ID numérico de la versión anterior no coincide con ningún origen (resync)"""
+    if not value:
+        return None
+    origin, _, number = value.rpartition('-')
+    try:
+        return origin, int(number)
+    except ValueError:
+        return None
+
+
+async def event_stream(
+    broker: EventBroker,
+    last_event_id: Optional[EventId] = None,
+    heartbeat: float = 15.0,
+    retry_ms: int = 3000
+) -> AsyncIterator[bytes]:
+    """Stream SSE de un cliente: backlog desde Last-Event-ID, eventos nuevos y heartbeats"""
+    subscription = broker.subscribe()
+    last_sent = last_event_id[1] if last_event_id and last_event_id[0] == broker.origin else 0
+    try:
+        yield f"retry: {retry_ms}\n\n".encode()
+        if last_event_id is not None:
+            backlog = broker.replay_since(last_event_id)
+            if backlog is None:
+                # Se perdieron eventos o el ID es de otro worker: el cliente debe recargar su estado completo
+                last_sent = broker.last_id
+                reason = 'replay buffer exceeded' if last_event_id[0] == broker.origin else 'unknown event id'
+                yield format_event(broker.origin, last_sent, 'resync', {'reason': reason})
+            else:
+                for event in backlog:
+                    last_sent = event.id
+                    yield event.frame
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+            if event is None:
+                return
+            if event.id > last_sent:  # ya enviado como parte del backlog
+                last_sent = event.id
+                yield event.frame
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# Instancia global del broker de eventos
+event_broker = EventBroker(int(os.environ.get('SSE_REPLAY_SIZE', 1000)))
@@ -1,82 +1,182 @@
 """
 Servicio de tasas de cambio automáticas para Mathi Phone
 Actualiza BTC, ETH, USDT, ARS automáticamente cada 5 minutos
+
+Los proveedores se consultan en paralelo con un cliente HTTP asíncrono (sin bloquear el
+event loop), con reintentos con backoff exponencial y jitter, y un circuit breaker por
+proveedor que conserva las últimas tasas buenas mientras el proveedor está caído.
 """
 import asyncio
 import logging
-import requests
+import random
+import time
+import httpx
 from datetime import datetime, timezone
-from typing import Dict, Any
-from mongodb_database import db
+from typing import Any, Callable, Dict, Optional
+from events import event_broker
+from invalidation import invalidation_bus
+from repository import db
+from rates_cache import rates_cache
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Tasas usadas solo si nunca hubo una respuesta válida ni tasas guardadas
+FALLBACK_RATES = {
+    "USD": 1.0,
+    "ARS": 1000.0,
+    "USDT": 1.0,
+    "BTC": 1/50000,
+    "ETH": 1/3000
+}
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Backoff exponencial con jitter completo: uniforme entre 0 y base * 2^intento"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Abre el circuito tras `failure_threshold` fallas seguidas; pasado `reset_timeout`
+    deja pasar un intento de prueba (semiabierto) que lo cierra o lo vuelve a abrir"""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        return self.state != 'open'
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half-open' or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class RateProvider:
+    def __init__(self, name: str, url: str, parse: Callable[[Any], Dict[str, float]], timeout: float = 5.0):
+        self.name = name
+        self.url = url
+        self.parse = parse
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self.last_good: Optional[Dict[str, float]] = None
+
+
+def _parse_crypto(data: Any) -> Dict[str, float]:
+    return {
+        "BTC": 1 / data['bitcoin']['usd'],  # BTC en USD
+        "ETH": 1 / data['ethereum']['usd'],  # ETH en USD
+        "USDT": data['tether']['usd']        # USDT en USD
+    }
+
+
+def _parse_ars(data: Any) -> Dict[str, float]:
+    return {"ARS": data['rates']['ARS']}
+
+
 class ExchangeRatesService:
     def __init__(self):
         self.update_interval = 300  # 5 minutos en segundos
         self.running = False
+        self.max_attempts = 3
+        self.crypto_provider = RateProvider(
+            'coingecko',
+            "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin,ethereum,tether&vs_currencies=usd",
+            _parse_crypto
+        )
+        self.ars_provider = RateProvider('exchangerate-api', "https://api.exchangerate-api.com/v4/latest/USD", _parse_ars)
+        self._client: Optional[httpx.AsyncClient] = None
     
-    async def fetch_crypto_rates(self) -> Dict[str, float]:
-        """Obtener tasas de criptomonedas desde CoinGecko API"""
-        try:
-            response = requests.get(
-                "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin,ethereum,tether&vs_currencies=usd",
-                timeout=10
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente HTTP compartido: reutiliza conexiones entre actualizaciones"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=4),
+                headers={'User-Agent': 'mathi-phone-rates/1.0'}
             )
-            data = response.json()
-            
-            return {
-                "BTC": 1 / data.get('bitcoin', {}).get('usd', 50000),  # BTC en USD
-                "ETH": 1 / data.get('ethereum', {}).get('usd', 3000),  # ETH en USD
-                "USDT": data.get('tether', {}).get('usd', 1.0)        # USDT en USD
-            }
-        except Exception as e:
-            logger.error(f"Error fetching crypto rates: {e}")
-            return {
-                "BTC": 1/50000,
-                "ETH": 1/3000,
-                "USDT": 1.0
-            }
+        return self._client
     
-    async def fetch_ars_rate(self) -> float:
-        """Obtener tasa ARS/USD desde ExchangeRate-API"""
+    async def _get_json(self, provider: RateProvider) -> Any:
+        """GET con reintentos; el timeout aplica a cada intento"""
+        for attempt in range(self.max_attempts):
+            try:
+                response = await self.client.get(provider.url, timeout=provider.timeout)
+                response.raise_for_status()
+                return response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"Retrying {provider.name} in {delay:.2f}s after: {e!r}")
+                await asyncio.sleep(delay)
+    
+    async def fetch_provider(self, provider: RateProvider) -> Optional[Dict[str, float]]:
+        """Tasas de un proveedor, o las últimas buenas si falla o su circuito está abierto"""
+        if not provider.breaker.allow():
+            logger.warning(f"Circuit open for {provider.name}, using last known rates")
+            return provider.last_good
         try:
-            response = requests.get(
-                "https://api.exchangerate-api.com/v4/latest/USD",
-                timeout=10
-            )
-            data = response.json()
-            return data['rates'].get('ARS', 1000.0)
+            rates = provider.parse(await self._get_json(provider))
         except Exception as e:
-            logger.error(f"Error fetching ARS rate: {e}")
-            return 1000.0
+            provider.breaker.record_failure()
+            logger.error(f"Error fetching rates from {provider.name}: {e!r}")
+            return provider.last_good
+        provider.breaker.record_success()
+        provider.last_good = rates
+        return rates
+    
+    async def fetch_crypto_rates(self) -> Optional[Dict[str, float]]:
+        """Obtener tasas de criptomonedas desde CoinGecko API"""
+        return await self.fetch_provider(self.crypto_provider)
+    
+    async def fetch_ars_rate(self) -> Optional[float]:
+        """Obtener tasa ARS/USD desde ExchangeRate-API"""
+        rates = await self.fetch_provider(self.ars_provider)
+        return rates["ARS"] if rates else None
     
     async def update_exchange_rates(self) -> bool:
         """Actualizar tasas en la base de datos"""
         try:
-            # Obtener tasas actuales
-            crypto_rates = await self.fetch_crypto_rates()
-            ars_rate = await self.fetch_ars_rate()
+            # Ambos proveedores en paralelo
+            crypto_rates, ars_rate = await asyncio.gather(self.fetch_crypto_rates(), self.fetch_ars_rate())
+            if crypto_rates is None and ars_rate is None:
+                logger.warning("No exchange rate provider available, keeping stored rates")
+                return False
             
-            # Combinar todas las tasas
-            rates_data = {
-                "USD": 1.0,
-                "ARS": ars_rate,
-                "USDT": crypto_rates["USDT"],
-                "BTC": crypto_rates["BTC"],
-                "ETH": crypto_rates["ETH"]
-            }
+            # Un proveedor sin datos conserva las tasas guardadas
+            current = await rates_cache.get(db) or {}
+            rates_data = {**FALLBACK_RATES, **current, "USD": 1.0, **(crypto_rates or {})}
+            if ars_rate is not None:
+                rates_data["ARS"] = ars_rate
             
             # Actualizar en MongoDB
             success = await db.update_exchange_rates(rates_data)
             
             if success:
+                rates_cache.set(rates_data)
+                invalidation_bus.publish('rates')
+                event_broker.publish('rates.updated', {'rates': rates_data, 'timestamp': datetime.now(timezone.utc)})
                 logger.info(f"✅ Precios estimados: BTC={rates_data['BTC']:.8f}, ETH={rates_data['ETH']:.6f}, ARS={rates_data['ARS']:.2f}")
             
             return success
-            
+        
         except Exception as e:
             logger.error(f"Error updating exchange rates: {e}")
             return False
@@ -99,6 +199,12 @@ class ExchangeRatesService:
         """Detener el servicio"""
         self.running = False
         logger.info("⏹️ Servicio de tasas automáticas detenido")
+    
+    async def aclose(self):
+        """Cerrar el cliente HTTP"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
 # Instancia global
 exchange_service = ExchangeRatesService()
@@ -110,8 +216,11 @@ if __name__ == "__main__":
         await db.connect()
         
         # Iniciar servicio
-        await exchange_service.start_auto_update()
-    
+        try:
+            await exchange_service.start_auto_update()
+        finally:
+            await exchange_service.aclose()
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
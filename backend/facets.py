@@ -0,0 +1,52 @@
+"""
+Conteos por faceta para la barra de filtros de la tienda
+Los resultados se cachean por conjunto de filtros normalizado y se invalidan con cada escritura
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from product_query import normalize_filters
+
+# Campos con conteo por valor en /api/products/facets
+FACET_FIELDS = ('category', 'model', 'type', 'condition', 'storage', 'color')
+
+
+def filters_key(filters: Optional[Dict[str, Any]]) -> Tuple:
+    """Clave canónica de un conjunto de filtros (sin vacíos ni orden de parámetros)"""
+    return tuple(sorted(normalize_filters(filters).items()))
+
+
+def sorted_counts(counts: Dict[Any, int]) -> Dict[Any, int]:
+    """Valores de mayor a menor cantidad"""
+    return dict(sorted(counts.items(), key=lambda item: (-item[1], str(item[0]))))
+
+
+class FacetCache:
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+
+    def get(self, filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        key = filters_key(filters)
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+        return result
+
+    def put(self, filters: Optional[Dict[str, Any]], result: Dict[str, Any], generation: Optional[int] = None):
+        """Guardar conteos calculados durante `generation` (por defecto, la actual)"""
+        if generation is not None and generation != self.generation:
+            return  # una escritura ocurrió mientras se calculaban
+        key = filters_key(filters)
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self):
+        self.generation += 1
+        self._entries.clear()
+
+
+# Instancia global del caché de facetas
+facet_cache = FacetCache()
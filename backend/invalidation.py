@@ -0,0 +1,284 @@
+"""
+Bus de invalidación de cachés entre workers de Mathi Phone
+Cada worker guarda cachés en memoria (catálogo, tasas, respuestas); cuando uno atiende una
+escritura publica un mensaje versionado y los demás lo reciben por el transporte
+configurado y actualizan sus cachés, sin consultar MongoDB en cada request:
+- inprocess: entrega directa entre buses del mismo proceso (pruebas)
+- mongo: colección capped con cursor tailable (producción, varios hosts)
+- unix: datagramas entre sockets Unix de un directorio (varios workers en un mismo host)
+"""
+import asyncio
+import inspect
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Union
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from repository import DATABASE_BACKEND, db
+
+logger = logging.getLogger(__name__)
+
+
+class Invalidation(NamedTuple):
+    topic: str  # 'product', 'rates', ...
+    key: Optional[str]  # None = todo el tópico
+    action: Optional[str]  # 'created', 'updated', 'deleted' o None
+    version: int  # creciente por worker de origen
+    origin: str
+    data: Optional[Dict[str, Any]] = None  # datos que el receptor no puede releer (p. ej. el exp de un token revocado)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Invalidation":
+        return cls(data['topic'], data.get('key'), data.get('action'), int(data['version']), data['origin'], data.get('data'))
+
+
+Handler = Callable[[Invalidation], Union[None, Awaitable[None]]]
+Deliver = Callable[[Invalidation], None]
+
+# Buses del mismo proceso que comparten el transporte inprocess por defecto
+_LOCAL_HUB: List["InProcessTransport"] = []
+
+
+class InProcessTransport:
+    def __init__(self, hub: Optional[List["InProcessTransport"]] = None):
+        self.hub = _LOCAL_HUB if hub is None else hub
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver, reset: Callable[[], None]):
+        self._deliver = deliver
+        self.hub.append(self)
+
+    async def send(self, message: Invalidation):
+        for peer in list(self.hub):
+            peer._deliver(message)
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+
+class MongoCappedTransport:
+    def __init__(self, database, collection: str = 'invalidations', size_bytes: int = 1024 * 1024,
+                 max_await_ms: int = 500, reconnect_delay: float = 1.0):
+        self.database = database
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self.max_await_ms = max_await_ms
+        self.reconnect_delay = reconnect_delay
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self):
+        return self.database.db[self.collection_name]
+
+    async def _ensure_collection(self):
+        if not await self.database.db.list_collection_names(filter={'name': self.collection_name}):
+            try:
+                await self.database.db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+            except CollectionInvalid:
+                pass  # otro worker la creó primero
+        # Un cursor tailable sobre una colección vacía muere enseguida
+        if await self.collection.find_one() is None:
+            await self.collection.insert_one({'topic': 'noop', 'version': 0, 'origin': ''})
+
+    async def start(self, deliver: Deliver, reset: Callable[[], None]):
+        await self._ensure_collection()
+        last = await self.collection.find_one(sort=[('$natural', -1)])
+        self._task = asyncio.create_task(self._tail(deliver, reset, last['_id']), name='invalidation-tail')
+
+    async def _tail(self, deliver: Deliver, reset: Callable[[], None], skip_until):
+        # Sin filtro por _id: los ObjectId de distintos procesos no siguen el orden de inserción.
+        # Al arrancar se saltea lo anterior al último mensaje; al reconectar se relee todo y el
+        # bus descarta por versión lo que ya aplicó
+        while True:
+            try:
+                cursor = self.collection.find(cursor_type=CursorType.TAILABLE_AWAIT).max_await_time_ms(self.max_await_ms)
+                while cursor.alive:
+                    async for document in cursor:
+                        if skip_until is not None:
+                            if document['_id'] == skip_until:
+                                skip_until = None
+                            continue
+                        if document['topic'] != 'noop':
+                            deliver(Invalidation.from_dict(document))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Invalidation cursor lost: {e}")
+                # Pudo perderse algún mensaje: los cachés se descartan completos
+                reset()
+            skip_until = None
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def send(self, message: Invalidation):
+        await self.collection.insert_one(message._asdict())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class UnixSocketTransport:
+    def __init__(self, directory: str, send_timeout: float = 1.0):
+        self.directory = directory
+        self.send_timeout = send_timeout
+        self.path = os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        self._sock: Optional[socket.socket] = None
+
+    async def start(self, deliver: Deliver, reset: Callable[[], None]):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self._sock.fileno(), self._on_readable, deliver)
+
+    def _on_readable(self, deliver: Deliver):
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except BlockingIOError:
+                return
+            deliver(Invalidation.from_dict(json.loads(data)))
+
+    async def send(self, message: Invalidation):
+        data = json.dumps(message._asdict(), separators=(',', ':')).encode()
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if peer == self.path or not name.endswith('.sock'):
+                continue
+            # La cola de datagramas de Linux es corta: ante una ráfaga se espera a que el otro worker lea
+            deadline = time.monotonic() + self.send_timeout
+            while True:
+                try:
+                    self._sock.sendto(data, peer)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Socket de un worker que ya no existe
+                    try:
+                        os.unlink(peer)
+                    except FileNotFoundError:
+                        pass
+                except BlockingIOError:
+                    if time.monotonic() < deadline:
+                        await asyncio.sleep(0.001)
+                        continue
+                    logger.warning(f"Invalidation dropped for {name}: receiver queue full")
+                break
+
+    async def stop(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class InvalidationBus:
+    def __init__(self, transport, origin: Optional[str] = None, send_attempts: int = 3):
+        self.transport = transport
+        self.origin = origin or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.send_attempts = send_attempts
+        self.running = False
+        self._handlers: Dict[str, List[Handler]] = {}
+        # Versiones basadas en el reloj, como los IDs de eventos SSE
+        self._version = int(time.time() * 1000)
+        self._seen: Dict[str, int] = {}  # última versión aplicada por worker de origen
+        self._outbox: "asyncio.Queue[Invalidation]" = asyncio.Queue()
+        self._inbox: "asyncio.Queue[Invalidation]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    def subscribe(self, topic: str, handler: Handler):
+        """Registrar un handler (sync o async) para los mensajes de otros workers sobre `topic`"""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, key: Optional[str] = None, action: Optional[str] = None,
+                data: Optional[Dict[str, Any]] = None) -> Optional[Invalidation]:
+        """Avisar a los demás workers; no bloquea (el envío sale en orden desde una cola)"""
+        if not self.running:
+            return None
+        self._version += 1
+        message = Invalidation(topic, key, action, self._version, self.origin, data)
+        self._outbox.put_nowait(message)
+        return message
+
+    def _receive(self, message: Invalidation):
+        if message.origin == self.origin or message.version <= self._seen.get(message.origin, 0):
+            return  # propio, duplicado o repetido tras reconectar
+        self._seen[message.origin] = message.version
+        self._inbox.put_nowait(message)
+
+    def _reset(self):
+        """Invalidar todos los tópicos completos (p. ej. tras perder mensajes)"""
+        for topic in self._handlers:
+            self._inbox.put_nowait(Invalidation(topic, None, None, 0, ''))
+
+    async def _send_loop(self):
+        while True:
+            message = await self._outbox.get()
+            for attempt in range(self.send_attempts):
+                try:
+                    await self.transport.send(message)
+                    break
+                except Exception as e:
+                    logger.error(f"Error sending invalidation {message.topic}:{message.key}: {e}")
+                    await asyncio.sleep(0.1 * 2 ** attempt)
+
+    async def _dispatch_loop(self):
+        # Un mensaje a la vez: dos escrituras del mismo producto se aplican en orden
+        while True:
+            message = await self._inbox.get()
+            for handler in self._handlers.get(message.topic, []):
+                try:
+                    result = handler(message)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Error applying invalidation {message.topic}:{message.key}: {e}")
+
+    async def start(self):
+        await self.transport.start(self._receive, self._reset)
+        self.running = True
+        self._tasks = [
+            asyncio.create_task(self._send_loop(), name='invalidation-send'),
+            asyncio.create_task(self._dispatch_loop(), name='invalidation-dispatch'),
+        ]
+
+    async def stop(self, flush_timeout: float = 2.0):
+        self.running = False
+        # Dar tiempo a que salgan los mensajes pendientes antes de cortar
+        deadline = time.monotonic() + flush_timeout
+        while not self._outbox.empty() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.transport.stop()
+
+
+def transport_from_env(database):
+    """INVALIDATION_TRANSPORT=mongo, unix (INVALIDATION_SOCKET_DIR) o inprocess
+
+    Por defecto mongo, salvo con el backend SQLite (un solo host), que usa sockets Unix;
+    mongo necesita DATABASE_BACKEND=mongo (la colección capped vive en esa base).
+    """
+    kind = os.environ.get('INVALIDATION_TRANSPORT', 'mongo' if DATABASE_BACKEND == 'mongo' else 'unix')
+    if kind == 'mongo' and DATABASE_BACKEND != 'mongo':
+        raise ValueError(f"INVALIDATION_TRANSPORT=mongo requires DATABASE_BACKEND=mongo (got {DATABASE_BACKEND})")
+    if kind == 'inprocess':
+        return InProcessTransport()
+    if kind == 'unix':
+        return UnixSocketTransport(os.environ.get('INVALIDATION_SOCKET_DIR', '/tmp/mathi-phone-invalidation'))
+    return MongoCappedTransport(database)
+
+
+# Instancia global: una por proceso
+invalidation_bus = InvalidationBus(transport_from_env(db))
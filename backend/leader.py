@@ -0,0 +1,133 @@
+"""
+Elección de líder para las tareas periódicas de Mathi Phone
+Cada worker (proceso o instancia) compite por un lease con vencimiento guardado en la base
+de datos (MongoDB o SQLite); solo el que lo tiene corre los jobs y lo renueva con heartbeats.
+Si el líder muere, el lease vence y otro worker lo toma en el siguiente intento. Un líder
+que no logra renovar a tiempo (base caída o lenta) corta sus jobs cuando vence su lease,
+antes de que otro worker pueda tomarlo.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    def __init__(self, name: str = 'background-jobs', ttl: float = 30.0, renew_interval: float = 10.0):
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.running = False
+        self._jobs: Dict[str, Callable[[], Awaitable[None]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._loop: Optional[asyncio.Task] = None
+        self._watchdog: Optional[asyncio.Task] = None
+        self._lease_deadline = 0.0  # reloj monotónico local: hasta cuándo vale el último lease
+
+    def add_job(self, name: str, job: Callable[[], Awaitable[None]]):
+        """Registrar una tarea de larga duración que solo debe correr en el líder"""
+        self._jobs[name] = job
+
+    async def try_acquire(self, database) -> bool:
+        """Tomar o renovar el lease; False si otro worker lo tiene vigente
+
+        Siendo líder, la renovación no puede esperar más allá del lease vigente
+        (asyncio.TimeoutError); si no, se acota al intervalo entre intentos.
+        """
+        started = time.monotonic()
+        timeout = max(0.0, self._lease_deadline - started) if self.is_leader else self.renew_interval
+        if await asyncio.wait_for(database.acquire_lease(self.name, self.owner, self.ttl), timeout=timeout):
+            self._lease_deadline = started + self.ttl
+            return True
+        return False
+
+    async def release(self, database):
+        """Soltar el lease al apagar para que otro worker lo tome sin esperar al vencimiento"""
+        await database.release_lease(self.name, self.owner)
+
+    def _start_jobs(self):
+        for name, job in self._jobs.items():
+            if name not in self._tasks or self._tasks[name].done():
+                self._tasks[name] = asyncio.create_task(job(), name=name)
+
+    async def _stop_jobs(self):
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _step_down(self):
+        self.is_leader = False
+        await self._stop_jobs()
+
+    async def _watch_lease(self):
+        """Cortar los jobs apenas vence el lease sin renovar, sin esperar al próximo heartbeat"""
+        while True:
+            remaining = self._lease_deadline - time.monotonic()
+            if self.is_leader and remaining <= 0:
+                logger.warning(f"{self.owner} lease for {self.name} expired without renewal, stopping jobs")
+                await self._step_down()
+                continue
+            await asyncio.sleep(min(remaining, self.renew_interval) if self.is_leader else self.renew_interval)
+
+    async def run(self, database):
+        """Bucle de heartbeats: asumir o ceder el liderazgo según el resultado de cada renovación"""
+        self.running = True
+        self._watchdog = asyncio.create_task(self._watch_lease(), name=f"leader-watchdog:{self.name}")
+        while self.running:
+            try:
+                leader = await self.try_acquire(database)
+            except Exception as e:
+                logger.error(f"Error renewing leader lease: {str(e) or type(e).__name__}")
+                # Sin poder renovar, el liderazgo solo vale hasta que vence el último lease
+                leader = self.is_leader and time.monotonic() < self._lease_deadline
+
+            if leader and not self.is_leader:
+                logger.info(f"👑 {self.owner} is now the leader for {self.name}")
+                self.is_leader = True
+                self._start_jobs()
+            elif leader:
+                self._start_jobs()  # reiniciar jobs que hayan terminado con error
+            elif self.is_leader:
+                logger.warning(f"{self.owner} lost the leader lease for {self.name}")
+                await self._step_down()
+
+            await asyncio.sleep(self.renew_interval)
+
+    def start(self, database):
+        """Lanzar el bucle de heartbeats en segundo plano"""
+        if self._loop is None or self._loop.done():
+            self._loop = asyncio.create_task(self.run(database), name=f"leader:{self.name}")
+
+    async def stop(self, database):
+        self.running = False
+        if self._loop is not None:
+            self._loop.cancel()
+            await asyncio.gather(self._loop, return_exceptions=True)
+            self._loop = None
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            await asyncio.gather(self._watchdog, return_exceptions=True)
+            self._watchdog = None
+        await self._stop_jobs()
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await self.release(database)
+            except Exception as e:
+                logger.error(f"Error releasing leader lease: {e}")
+
+
+# Instancia global: una por proceso
+leader_election = LeaderElection(
+    ttl=float(os.environ.get('LEADER_LEASE_TTL', 30)),
+    renew_interval=float(os.environ.get('LEADER_RENEW_INTERVAL', 10))
+)
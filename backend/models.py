@@ -0,0 +1,79 @@
+"""
+Modelos de productos de Mathi Phone
+Separados de server.py para que los procesos de importación puedan validar filas sin
+levantar la app
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field
+
+
+# Product Models
+class Product(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    model: str  # 11, 12, 13, 14, 15, 16, 17, se
+    type: str  # pro-max, pro, plus, normal, mini, se
+    storage: str  # 64GB, 128GB, 256GB, 512GB, 1TB
+    color: str
+    condition: str = "sealed"
+    battery_health: int = 100
+    price_ars: float
+    price_usd: float
+    price_currency: str = "USD"  # USD or ARS
+    screen_size: str
+    chip: str
+    camera: str
+    features: List[str]
+    available: bool = True
+    warranty_months: int = 0
+    description: str = ""
+    image_url: str = ""
+    category: str = "iphone"  # iphone, macbook, watch, airpods, ipad, accesorio
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ProductCreate(BaseModel):
+    name: str
+    model: str
+    type: str
+    storage: str
+    color: str
+    condition: str = "sealed"
+    battery_health: int = 100
+    price_ars: float
+    price_usd: float
+    price_currency: str = "USD"
+    screen_size: str
+    chip: str
+    camera: str
+    features: List[str]
+    available: bool = True
+    warranty_months: int = 0
+    description: str = ""
+    image_url: str = ""
+    category: str = "iphone"
+
+class ProductUpdate(BaseModel):
+    name: Optional[str] = None
+    model: Optional[str] = None
+    type: Optional[str] = None
+    storage: Optional[str] = None
+    color: Optional[str] = None
+    condition: Optional[str] = None
+    battery_health: Optional[int] = None
+    price_ars: Optional[float] = None
+    price_usd: Optional[float] = None
+    price_currency: Optional[str] = None
+    screen_size: Optional[str] = None
+    chip: Optional[str] = None
+    camera: Optional[str] = None
+    features: Optional[List[str]] = None
+    available: Optional[bool] = None
+    warranty_months: Optional[int] = None
+    description: Optional[str] = None
+    image_url: Optional[str] = None
+    category: Optional[str] = None
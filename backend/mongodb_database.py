@@ -1,13 +1,23 @@
 """
 Base de datos MongoDB real para Mathi Phone
 """
+import asyncio
 import os
-from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Dict, Any, Optional, Sequence, Tuple
+import uuid
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import DuplicateKeyError
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from dotenv import load_dotenv
 from pathlib import Path
+from db_indexes import reconcile_indexes
+from facets import FACET_FIELDS, sorted_counts
+from rate_history import MAX_HISTORY_POINTS, TIERS, bucket_start, history_point, rollup_update
+from product_query import (
+    DEFAULT_SORT, PRODUCT_PROJECTION, SORT_OPTIONS, ProductPage,
+    build_cursor_query, build_product_query, build_product_sort, build_projection, decode_cursor, encode_cursor
+)
 
 # Cargar variables de entorno
 ROOT_DIR = Path(".")
@@ -21,8 +31,8 @@ class MongoDBDatabase:
         self.exchange_rates_collection = None
         self.status_checks_collection = None
     
-    async def connect(self):
-        """Conectar a MongoDB"""
+    async def connect(self, ensure_indexes: bool = True):
+        """Conectar a MongoDB y reconciliar los índices declarados en db_indexes"""
         try:
             mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
             db_name = os.environ.get('DB_NAME', 'mathi_phone')
@@ -37,6 +47,13 @@ class MongoDBDatabase:
             await self.client.admin.command('ping')
             print(f"✅ Connected to MongoDB at {mongo_url}")
             
+            if ensure_indexes:
+                try:
+                    await reconcile_indexes(self.db)
+                except Exception as e:
+                    # Sin índices la API sigue funcionando, solo más lenta
+                    print(f"⚠️ Could not reconcile indexes: {e}")
+            
         except Exception as e:
             print(f"❌ Failed to connect to MongoDB: {e}")
             raise
@@ -46,64 +63,159 @@ class MongoDBDatabase:
         if self.client:
             self.client.close()
     
-    async def get_products(self, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
-        """Obtener todos los productos con filtros opcionales"""
+    async def get_products(
+        self,
+        filters: Dict[str, Any] = None,
+        skip: int = 0,
+        limit: int = 0,
+        projection: Dict[str, Any] = None,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        include_oid: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Obtener una página de productos con filtros opcionales
+
+        `projection` es de inclusión ({campo: 1}); include_oid=True conserva `_id`,
+        necesario para emitir cursores.
+        """
         try:
-            query = {}
-            if filters:
-                if filters.get('category'):
-                    query['category'] = filters['category']
-                if filters.get('model'):
-                    query['model'] = filters['model']
-                if filters.get('type'):
-                    query['type'] = filters['type']
-                if filters.get('condition'):
-                    query['condition'] = filters['condition']
-                if filters.get('min_battery'):
-                    query['battery_health'] = {'$gte': filters['min_battery']}
-                if filters.get('max_price_ars'):
-                    query['price_ars'] = {'$lte': filters['max_price_ars']}
-                if filters.get('max_price_usd'):
-                    query['price_usd'] = {'$lte': filters['max_price_usd']}
-                if filters.get('available') is not None:
-                    query['available'] = filters['available']
-                if filters.get('search'):
-                    search_term = filters['search'].lower()
-                    query['$or'] = [
-                        {'name': {'$regex': search_term, '$options': 'i'}},
-                        {'color': {'$regex': search_term, '$options': 'i'}},
-                        {'chip': {'$regex': search_term, '$options': 'i'}},
-                        {'description': {'$regex': search_term, '$options': 'i'}}
-                    ]
-            
-            cursor = self.products_collection.find(query)
-            products = []
-            async for product in cursor:
-                # Convert ObjectId to string for JSON serialization
-                if '_id' in product:
-                    product['_id'] = str(product['_id'])
-                products.append(product)
-            
-            return products
+            query = build_product_query(filters)
+            if cursor:
+                query = {'$and': [query, build_cursor_query(sort, cursor)]}
+            if not include_oid:
+                projection = {**(projection or {}), **PRODUCT_PROJECTION}
+            find_cursor = self.products_collection.find(query, projection)
+            find_cursor = find_cursor.sort(build_product_sort(sort, filters))
+            if skip:
+                find_cursor = find_cursor.skip(skip)
+            if limit:
+                find_cursor = find_cursor.limit(limit)
+            return await find_cursor.to_list(length=limit or None)
             
         except Exception as e:
             print(f"❌ Error getting products: {e}")
             return []
     
-    async def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
-        """Obtener un producto por ID"""
+    async def count_products(self, filters: Dict[str, Any] = None, estimated: bool = False) -> int:
+        """Contar los productos que cumplen los filtros
+
+        estimated=True usa los metadatos de la colección e ignora los filtros.
+        """
         try:
-            product = await self.products_collection.find_one({'id': product_id})
-            if product:
-                if '_id' in product:
-                    product['_id'] = str(product['_id'])
-                return product
-            return None
+            if estimated:
+                return await self.products_collection.estimated_document_count()
+            return await self.products_collection.count_documents(build_product_query(filters))
+            
+        except Exception as e:
+            print(f"❌ Error counting products: {e}")
+            return 0
+    
+    async def find_products(
+        self,
+        filters: Dict[str, Any] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        count: str = 'exact',
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> ProductPage:
+        """Obtener una página de productos, el total y el cursor de la página siguiente
+
+        `fields` limita los campos leídos de MongoDB (None = documento completo).
+        """
+        if cursor:
+            decode_cursor(cursor, sort)  # ValueError antes de consultar si el cursor es inválido
+        page = self.get_products(
+            filters, skip=skip, limit=limit + 1 if limit else 0, projection=build_projection(fields, sort),
+            sort=sort, cursor=cursor, include_oid=True
+        )
+        if count == 'none':
+            products, total = await page, None
+        else:
+            products, total = await asyncio.gather(page, self.count_products(filters, estimated=count == 'estimated'))
+        
+        next_cursor = None
+        if limit and len(products) > limit:
+            products = products[:limit]
+            if sort != 'relevance':
+                field = SORT_OPTIONS.get(sort, DEFAULT_SORT)[0]
+                next_cursor = encode_cursor(sort, products[-1].get(field) if field != '_id' else None, products[-1]['_id'])
+        for product in products:
+            product.pop('_id', None)
+        return ProductPage(products, total, next_cursor)
+    
+    async def get_product_facets(self, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Conteo por valor de cada faceta en una sola agregación $facet"""
+        try:
+            pipeline = [
+                {'$match': build_product_query(filters)},
+                {'$facet': {
+                    'total': [{'$count': 'count'}],
+                    **{
+                        field: [{'$match': {field: {'$ne': None}}}, {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}}]
+                        for field in FACET_FIELDS
+                    }
+                }}
+            ]
+            result = (await self.products_collection.aggregate(pipeline).to_list(length=1))[0]
+            return {
+                'total': result['total'][0]['count'] if result['total'] else 0,
+                'facets': {
+                    field: sorted_counts({bucket['_id']: bucket['count'] for bucket in result[field]})
+                    for field in FACET_FIELDS
+                }
+            }
+            
+        except Exception as e:
+            print(f"❌ Error getting product facets: {e}")
+            return {'total': 0, 'facets': {field: {} for field in FACET_FIELDS}}
+    
+    async def iter_products(
+        self,
+        filters: Dict[str, Any] = None,
+        batch_size: int = 1000,
+        include_oid: bool = False,
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Recorrer los productos en orden de inserción y en lotes, sin cargar toda la colección"""
+        projection = build_projection(fields)
+        if not include_oid:
+            projection = {**(projection or {}), **PRODUCT_PROJECTION}
+        find_cursor = self.products_collection.find(build_product_query(filters), projection, batch_size=batch_size)
+        async for product in find_cursor.sort('_id', 1):
+            yield product
+    
+    async def get_product(
+        self,
+        product_id: str,
+        fields: Optional[Tuple[str, ...]] = None,
+        include_oid: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """Obtener un producto por ID, opcionalmente solo con `fields`; include_oid=True conserva `_id`"""
+        try:
+            projection = build_projection(fields)
+            if not include_oid:
+                projection = {**(projection or {}), **PRODUCT_PROJECTION}
+            return await self.products_collection.find_one({'id': product_id}, projection)
             
         except Exception as e:
             print(f"❌ Error getting product {product_id}: {e}")
             return None
     
+    async def get_products_by_ids(self, product_ids: List[str], fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Dict[str, Any]]:
+        """Obtener varios productos por ID en una sola consulta $in, indexados por ID"""
+        try:
+            projection = {**(build_projection(fields) or {}), **PRODUCT_PROJECTION}
+            if fields is not None:
+                projection['id'] = 1
+            find_cursor = self.products_collection.find({'id': {'$in': list(set(product_ids))}}, projection)
+            return {product['id']: product async for product in find_cursor}
+            
+        except Exception as e:
+            print(f"❌ Error getting products by id: {e}")
+            return {}
+    
     async def create_product(self, product_data: Dict[str, Any]) -> Dict[str, Any]:
         """Crear un nuevo producto"""
         try:
@@ -123,8 +235,9 @@ class MongoDBDatabase:
             return None
             
         except DuplicateKeyError:
-            print(f"❌ Product with ID {product_data.get('id')} already exists")
-            return None
+            # Rechazado por el índice único id_unique
+            print(f"❌ Product with ID {new_product['id']} already exists")
+            raise
         except Exception as e:
             print(f"❌ Error creating product: {e}")
             return None
@@ -159,6 +272,118 @@ class MongoDBDatabase:
             print(f"❌ Error deleting product {product_id}: {e}")
             return False
     
+    async def bulk_write_products(
+        self,
+        operations: List[Dict[str, Any]],
+        ordered: bool = True,
+        batch_size: int = 500
+    ) -> List[Dict[str, Any]]:
+        """Aplicar operaciones insert/update/delete en lotes de bulk_write
+
+        Cada operación es {'op': 'insert', 'product': {...}}, {'op': 'update', 'id': ..., 'changes': {...}}
+        o {'op': 'delete', 'id': ...}. Devuelve un resultado por operación, en el mismo orden.
+        Con ordered=True la primera falla detiene el resto, que queda como 'skipped'.
+        """
+        now = datetime.now(timezone.utc)
+        results: List[Dict[str, Any]] = []
+        pending: List[Tuple[int, Any]] = []
+        
+        # Una lectura para saber qué IDs existen: update/delete de IDs ausentes no se envían
+        targets = [operation['id'] for operation in operations if operation['op'] != 'insert']
+        existing = set()
+        if targets:
+            find_cursor = self.products_collection.find({'id': {'$in': list(set(targets))}}, {'_id': 0, 'id': 1})
+            existing = {product['id'] async for product in find_cursor}
+        
+        for index, operation in enumerate(operations):
+            op = operation['op']
+            if op == 'insert':
+                product = {'id': str(uuid.uuid4()), 'created_at': now, 'updated_at': now, **operation['product']}
+                product_id = product['id']
+                request = InsertOne(product)
+                existing.add(product_id)
+            elif operation['id'] not in existing:
+                results.append({'index': index, 'op': op, 'id': operation['id'], 'status': 'not_found'})
+                continue
+            elif op == 'update':
+                product_id = operation['id']
+                request = UpdateOne({'id': product_id}, {'$set': {**operation['changes'], 'updated_at': now}})
+            else:
+                product_id = operation['id']
+                request = DeleteOne({'id': product_id})
+                existing.discard(product_id)
+            results.append({'index': index, 'op': op, 'id': product_id, 'status': 'ok'})
+            pending.append((len(results) - 1, request))
+        
+        stopped = False
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            if stopped:
+                for position, _ in batch:
+                    results[position]['status'] = 'skipped'
+                continue
+            try:
+                await self.products_collection.bulk_write([request for _, request in batch], ordered=ordered)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                for error in errors:
+                    result = results[batch[error['index']][0]]
+                    result['status'] = 'error'
+                    result['error'] = error.get('errmsg', 'Write failed')
+                if ordered:
+                    # En modo ordenado MongoDB no ejecuta nada después de la primera falla
+                    first_failed = min((error['index'] for error in errors), default=len(batch))
+                    for position, _ in batch[first_failed + 1:]:
+                        results[position]['status'] = 'skipped'
+                    stopped = True
+            except Exception as e:
+                print(f"❌ Error in products bulk write: {e}")
+                for position, _ in batch:
+                    results[position]['status'] = 'error'
+                    results[position]['error'] = str(e)
+                stopped = stopped or ordered
+        
+        return results
+    
+    async def upsert_products_by_key(
+        self,
+        products: List[Dict[str, Any]],
+        key_fields: Sequence[str],
+        defaults: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Upsert por clave natural en un solo bulk_write desordenado
+
+        Cada producto trae solo los campos a escribir; `defaults` completa los demás únicamente
+        al insertar. Filas repetidas del mismo lote se colapsan en la última. Devuelve los
+        conteos de insertados, actualizados y duplicados, y los mensajes de las escrituras fallidas.
+        """
+        defaults = defaults or {}
+        now = datetime.now(timezone.utc)
+        by_key = {tuple(product.get(field) for field in key_fields): product for product in products}
+        requests = [
+            UpdateOne(
+                dict(zip(key_fields, key)),
+                {
+                    '$set': {**product, 'updated_at': now},
+                    '$setOnInsert': {
+                        **{field: value for field, value in defaults.items() if field not in product},
+                        'id': str(uuid.uuid4()),
+                        'created_at': now
+                    }
+                },
+                upsert=True
+            )
+            for key, product in by_key.items()
+        ]
+        summary = {'inserted': 0, 'updated': 0, 'duplicates': len(products) - len(by_key), 'errors': []}
+        try:
+            result = await self.products_collection.bulk_write(requests, ordered=False)
+            summary['inserted'], summary['updated'] = result.upserted_count, result.matched_count
+        except BulkWriteError as e:
+            summary['inserted'], summary['updated'] = e.details.get('nUpserted', 0), e.details.get('nMatched', 0)
+            summary['errors'] = [error.get('errmsg', 'Write failed') for error in e.details.get('writeErrors', [])]
+        return summary
+    
     async def get_exchange_rates(self) -> Optional[Dict[str, Any]]:
         """Obtener tasas de cambio actuales"""
         try:
@@ -188,12 +413,76 @@ class MongoDBDatabase:
                 upsert=True
             )
             
+            await self.append_rate_history(rates_data, update_data['last_updated'])
             return result.acknowledged
             
         except Exception as e:
             print(f"❌ Error updating exchange rates: {e}")
             return False
     
+    async def append_rate_history(self, rates_data: Dict[str, Any], moment: datetime):
+        """Guardar una muestra cruda y acumularla en los buckets de 5 minutos y 1 hora"""
+        try:
+            rates = {currency: float(value) for currency, value in rates_data.items()}
+            writes = []
+            for tier in TIERS.values():
+                collection = self.db[tier.collection]
+                if tier.bucket is None:
+                    writes.append(collection.insert_one({'ts': moment, 'rates': rates}))
+                else:
+                    writes.append(collection.update_one({'bucket': bucket_start(moment, tier.bucket)}, rollup_update(rates), upsert=True))
+            await asyncio.gather(*writes)
+            
+        except Exception as e:
+            print(f"❌ Error appending exchange rate history: {e}")
+    
+    async def get_rate_history(self, currency: str, start: datetime, end: datetime, resolution: str) -> List[Dict[str, Any]]:
+        """Serie de una moneda entre start y end leyendo solo la resolución indicada"""
+        try:
+            tier = TIERS[resolution]
+            time_field = 'ts' if tier.bucket is None else 'bucket'
+            if tier.bucket is not None:
+                start = bucket_start(start, tier.bucket)  # incluir el bucket que contiene a start
+            find_cursor = self.db[tier.collection].find(
+                {time_field: {'$gte': start, '$lte': end}, f'rates.{currency}': {'$exists': True}},
+                {'_id': 0, time_field: 1, f'rates.{currency}': 1}
+            ).sort(time_field, -1).limit(MAX_HISTORY_POINTS)
+            documents = await find_cursor.to_list(length=MAX_HISTORY_POINTS)
+            # Si se alcanza el tope quedan los puntos más recientes
+            return [history_point(document, currency) for document in reversed(documents)]
+            
+        except Exception as e:
+            print(f"❌ Error getting exchange rate history: {e}")
+            return []
+    
+    async def add_status_check(self, status_check: Dict[str, Any]):
+        await self.status_checks_collection.insert_one(dict(status_check))
+    
+    async def get_status_checks(self, limit: int = 1000) -> List[Dict[str, Any]]:
+        return await self.status_checks_collection.find({}, {"_id": 0}).to_list(limit)
+    
+    async def get_users(self) -> List[Dict[str, Any]]:
+        """Usuarios del panel; los errores se propagan para no reemplazar el directorio por uno vacío"""
+        return await self.db.users.find({}, {"_id": 0}).to_list(length=None)
+    
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Tomar o renovar el lease `name`; False si otro dueño lo tiene vigente"""
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await self.db.leases.find_one_and_update(
+                {'_id': name, '$or': [{'owner': owner}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=ttl), 'renewed_at': now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # El lease existe y es de otro: el upsert intentó insertar el mismo _id
+            return False
+        return bool(lease) and lease.get('owner') == owner
+    
+    async def release_lease(self, name: str, owner: str):
+        await self.db.leases.delete_one({'_id': name, 'owner': owner})
+    
     @property
     def status_checks(self):
         """Propiedad para compatibilidad con código existente"""
@@ -0,0 +1,84 @@
+"""
+Serialización rápida de documentos de la base de datos para Mathi Phone
+Convierte documentos confiables directamente a bytes JSON con la forma de un modelo
+Pydantic, sin validarlos fila por fila. La validación queda solo en la entrada.
+"""
+import typing
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Type
+from pydantic import BaseModel
+from pydantic_core import CoreSchema, SchemaSerializer, core_schema
+
+_SCALAR_SCHEMAS = {
+    str: core_schema.str_schema,
+    int: core_schema.int_schema,
+    float: core_schema.float_schema,
+    bool: core_schema.bool_schema,
+    datetime: core_schema.datetime_schema,
+}
+
+
+def _schema_for(annotation: Any) -> CoreSchema:
+    """Esquema de serialización (no de validación) para la anotación de un campo"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        inner = _schema_for(args[0]) if len(args) == 1 else core_schema.any_schema()
+        return core_schema.nullable_schema(inner)
+    if origin in (list, List):
+        (item,) = typing.get_args(annotation) or (Any,)
+        return core_schema.list_schema(_schema_for(item))
+    factory = _SCALAR_SCHEMAS.get(annotation)
+    return factory() if factory else core_schema.any_schema()
+
+
+class ModelEncoder:
+    """Encoder precompilado (pydantic-core) para los campos de un modelo
+
+    Los documentos se serializan tal como vienen de la base de datos: los campos que no
+    son del modelo (como `_id`) se descartan, los faltantes toman el valor por defecto
+    del modelo y las fechas guardadas como texto se emiten sin reformatear.
+    Con `fields` solo se emiten esos campos del modelo.
+    """
+
+    def __init__(self, model: Type[BaseModel], fields: Optional[Sequence[str]] = None):
+        self.model = model
+        model_fields = {
+            name: info for name, info in model.model_fields.items()
+            if fields is None or name in fields
+        }
+        fields = {
+            name: core_schema.typed_dict_field(_schema_for(info.annotation), required=False)
+            for name, info in model_fields.items()
+        }
+        row_schema = core_schema.typed_dict_schema(fields, extra_behavior='ignore')
+        self._row_serializer = SchemaSerializer(row_schema)
+        self._list_serializer = SchemaSerializer(core_schema.list_schema(core_schema.nullable_schema(row_schema)))
+        self._names = frozenset(fields)
+        self._defaults = {
+            name: info.get_default(call_default_factory=False)
+            for name, info in model_fields.items()
+            if not info.is_required() and info.default_factory is None
+        }
+        self._factories = {
+            name: info.default_factory
+            for name, info in model_fields.items()
+            if info.default_factory is not None
+        }
+
+    def _complete(self, doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Completar los campos faltantes con los defaults del modelo (caso poco común)"""
+        if doc is None or doc.keys() >= self._names:
+            return doc
+        completed = {**self._defaults, **doc}
+        for name, factory in self._factories.items():
+            if name not in completed:
+                completed[name] = factory()
+        return completed
+
+    def encode(self, doc: Dict[str, Any]) -> bytes:
+        return self._row_serializer.to_json(self._complete(doc), warnings=False)
+
+    def encode_many(self, docs: Iterable[Optional[Dict[str, Any]]]) -> bytes:
+        """Lista JSON de documentos; los None se emiten como null"""
+        return self._list_serializer.to_json([self._complete(doc) for doc in docs], warnings=False)
@@ -0,0 +1,69 @@
+"""
+Exportación del catálogo de Mathi Phone en NDJSON o CSV
+Generadores asíncronos que codifican los productos a medida que llegan del cursor,
+en bloques acotados, para que la memoria no dependa del tamaño del catálogo
+"""
+import csv
+import io
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Sequence
+from product_encoder import ModelEncoder
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# Separador de los valores de listas (features) dentro de una celda CSV
+CSV_LIST_SEPARATOR = '|'
+
+
+def csv_value(value: Any) -> Any:
+    """Valor de una celda CSV: listas unidas con |, booleanos en minúscula, fechas ISO"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return CSV_LIST_SEPARATOR.join(str(item) for item in value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def export_ndjson(
+    products: AsyncIterator[Dict[str, Any]],
+    encoder: ModelEncoder,
+    chunk_size: int = 500
+) -> AsyncIterator[bytes]:
+    """Un objeto JSON por línea"""
+    lines: List[bytes] = []
+    async for product in products:
+        lines.append(encoder.encode(product))
+        if len(lines) >= chunk_size:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+async def export_csv(
+    products: AsyncIterator[Dict[str, Any]],
+    columns: Sequence[str],
+    chunk_size: int = 500
+) -> AsyncIterator[bytes]:
+    """CSV con encabezado; las columnas ausentes en un documento quedan vacías"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = 0
+    async for product in products:
+        writer.writerow([csv_value(product.get(column)) for column in columns])
+        rows += 1
+        if rows >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
@@ -0,0 +1,205 @@
+"""
+Importación de listas de precios de proveedores (CSV o NDJSON) para Mathi Phone
+Lee el archivo en streaming, valida las filas contra ProductCreate en un pool de procesos
+y hace upsert por clave natural en lotes de bulk_write, sin cargar el archivo en memoria
+
+Uso:
+    python product_import.py lista.csv [--format csv|ndjson] [--batch-size 1000] [--workers 4]
+
+IMPORT_WORKERS fija la cantidad de procesos del pool de validación (por defecto, los CPUs).
+"""
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple, Union
+from pydantic import ValidationError
+from models import ProductCreate
+from product_export import CSV_LIST_SEPARATOR
+
+# Un producto se identifica por estos campos al importar: la misma combinación se actualiza
+NATURAL_KEY = ('name', 'model', 'storage', 'color', 'condition')
+
+# Valores por defecto de ProductCreate: solo se escriben al insertar, nunca pisan un producto existente
+PRODUCT_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in ProductCreate.model_fields.items() if not field.is_required()
+}
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+LIST_FIELDS = ('features',)
+
+# Tope de errores detallados en el resumen (el conteo de rechazados es siempre exacto)
+MAX_REPORTED_ERRORS = 100
+
+Row = Tuple[int, Union[str, Dict[str, Any]]]
+
+# Pool de validación compartido por todas las importaciones del proceso: se crea con la primera
+# y se cierra con shutdown_pool() al apagar
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 0)) or os.cpu_count() or 1
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    suffix = Path(filename or '').suffix.lower()
+    if suffix == '.csv':
+        return 'csv'
+    if suffix in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return None
+
+
+def read_rows(stream: TextIO, format: str) -> Iterator[Row]:
+    """(número de línea, fila) de a una; las líneas NDJSON se decodifican en los procesos"""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            yield line_number, line
+
+
+def _normalize(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Celdas vacías como ausentes (para usar los defaults) y listas separadas por |"""
+    clean = {}
+    for field, value in row.items():
+        if field is None:
+            continue  # columnas de más en una fila CSV
+        if isinstance(value, str):
+            value = value.strip()
+            if field in LIST_FIELDS:
+                value = [item.strip() for item in value.split(CSV_LIST_SEPARATOR) if item.strip()]
+            elif value == '':
+                continue
+        clean[field] = value
+    return clean
+
+
+def validate_rows(rows: List[Row]) -> Tuple[List[Dict[str, Any]], List[Tuple[int, str]]]:
+    """Validar un lote de filas contra ProductCreate (corre en los procesos del pool)"""
+    valid, rejected = [], []
+    for line_number, row in rows:
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+            if not isinstance(row, dict):
+                raise ValueError("Row is not an object")
+            product = ProductCreate(**_normalize(row))
+            # Solo las columnas del archivo (más la clave natural completa): una lista con
+            # precios no debe devolver el resto de los campos a sus valores por defecto
+            data = product.model_dump(exclude_unset=True)
+            for field in NATURAL_KEY:
+                data.setdefault(field, getattr(product, field))
+            valid.append(data)
+        except ValidationError as e:
+            rejected.append((line_number, '; '.join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            )))
+        except ValueError as e:
+            rejected.append((line_number, str(e)))
+    return valid, rejected
+
+
+def _take(rows: Iterator[Row], count: int) -> List[Row]:
+    return list(islice(rows, count))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: los procesos no heredan el event loop ni las conexiones de Motor
+        _pool = ProcessPoolExecutor(max_workers=IMPORT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+async def shutdown_pool():
+    """Cerrar el pool de validación esperando a sus procesos fuera del event loop"""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await asyncio.to_thread(pool.shutdown, wait=True)
+
+
+async def import_products(
+    database,
+    stream: TextIO,
+    format: str,
+    batch_size: int = 1000
+) -> Dict[str, Any]:
+    """Importar un archivo completo y devolver el resumen de filas insertadas/actualizadas/rechazadas
+
+    Hay como máximo 2 lotes por proceso en vuelo, así que la memoria depende del tamaño de
+    lote y no del archivo.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    rows = read_rows(stream, format)
+    summary = {'rows': 0, 'inserted': 0, 'updated': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+
+    async def write(valid: List[Dict[str, Any]], rejected: List[Tuple[int, str]]):
+        summary['rows'] += len(valid) + len(rejected)
+        summary['rejected'] += len(rejected)
+        for line_number, error in rejected:
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append({'line': line_number, 'error': error})
+        if valid:
+            result = await database.upsert_products_by_key(valid, NATURAL_KEY, PRODUCT_DEFAULTS)
+            summary['inserted'] += result['inserted']
+            summary['updated'] += result['updated']
+            summary['duplicates'] += result['duplicates']
+            summary['rejected'] += len(result['errors'])
+            for error in result['errors'][:MAX_REPORTED_ERRORS - len(summary['errors'])]:
+                summary['errors'].append({'line': None, 'error': error})
+
+    pending = deque()
+    exhausted = False
+    while not exhausted or pending:
+        if not exhausted:
+            chunk = await loop.run_in_executor(None, _take, rows, batch_size)
+            if chunk:
+                pending.append(loop.run_in_executor(pool, validate_rows, chunk))
+            else:
+                exhausted = True
+        # Los lotes se escriben en el orden del archivo: una fila posterior gana
+        if pending and (exhausted or len(pending) >= IMPORT_WORKERS * 2):
+            await write(*await pending.popleft())
+
+    return summary
+
+
+async def _main(args):
+    global IMPORT_WORKERS
+    from repository import db
+
+    IMPORT_WORKERS = args.workers or IMPORT_WORKERS
+    format = args.format or detect_format(args.path)
+    if format is None:
+        raise SystemExit("❌ No se pudo deducir el formato; usá --format csv|ndjson")
+    await db.connect(ensure_indexes=True)
+    try:
+        with open(args.path, encoding='utf-8-sig', newline='') as stream:
+            summary = await import_products(db, stream, format, batch_size=args.batch_size)
+        print(f"📦 {summary['rows']} filas: {summary['inserted']} insertadas, {summary['updated']} actualizadas, "
+              f"{summary['duplicates']} duplicadas, {summary['rejected']} rechazadas")
+        for error in summary['errors']:
+            print(f"   línea {error['line']}: {error['error']}")
+    finally:
+        await shutdown_pool()
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importar una lista de productos CSV o NDJSON")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=IMPORT_FORMATS)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    asyncio.run(_main(parser.parse_args()))
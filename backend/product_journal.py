@@ -0,0 +1,277 @@
+"""
+Journal de escrituras del servidor con persistencia en archivo JSON de Mathi Phone
+Cada alta, edición o baja se agrega como una línea NDJSON a un segmento del journal en lugar
+de reescribir todo el catálogo; las escrituras que llegan juntas comparten un solo fsync
+(group commit). Cada COMPACT_EVERY registros se escribe en segundo plano un snapshot nuevo
+(archivo temporal + rename atómico) y se borran los segmentos que ya contiene. Al arrancar
+se carga el snapshot y se reaplican los registros posteriores del journal.
+
+    <snapshot>                 {"seq": N, "products": [...]}  (también acepta la lista vieja)
+    <journal_dir>/00000001.ndjson
+        {"seq": N+1, "op": "put", "id": "...", "product": {...}}
+        {"seq": N+2, "op": "delete", "id": "..."}
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+SEGMENT_SUFFIX = '.ndjson'
+
+
+class JournalRecord:
+    __slots__ = ('seq', 'op', 'product_id', 'product', 'line', 'future')
+
+    def __init__(self, seq: int, op: str, product_id: str, product: Optional[Dict[str, Any]], future: asyncio.Future):
+        self.seq = seq
+        self.op = op
+        self.product_id = product_id
+        self.product = product
+        record = {'seq': seq, 'op': op, 'id': product_id}
+        if product is not None:
+            record['product'] = product
+        self.line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        self.future = future
+
+
+class ProductJournal:
+    def __init__(self, snapshot_path: str, journal_dir: str, compact_every: int = 1000, max_batch: int = 1000):
+        self.snapshot_path = snapshot_path
+        self.journal_dir = journal_dir
+        self.compact_every = compact_every
+        self.max_batch = max_batch
+        # Productos ya serializados (JSON) por ID, en el estado del último registro escrito
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._seq = 0  # último número asignado
+        self._committed_seq = 0  # último número escrito y sincronizado
+        self._since_snapshot = 0
+        self._segment = 0
+        self._file = None
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        # Un solo hilo para escribir: los registros llegan al disco en orden
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal-writer')
+        self._commit_task: Optional[asyncio.Task] = None
+        self._compaction: Optional[asyncio.Task] = None
+
+    # Arranque
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Snapshot + journal en orden de inserción; debe llamarse antes de start()"""
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # La versión anterior guardaba solo la lista de productos
+            if isinstance(data, list):
+                products = data
+            else:
+                snapshot_seq = data.get('seq', 0)
+                products = data.get('products', [])
+            self._state = {product['id']: product for product in products}
+        self._seq = self._committed_seq = snapshot_seq
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+        segments = self._segments()
+        for index, segment in enumerate(segments):
+            last_segment = index == len(segments) - 1
+            self._replay(os.path.join(self.journal_dir, segment), snapshot_seq, last_segment)
+        self._segment = int(segments[-1][:-len(SEGMENT_SUFFIX)]) if segments else 0
+        return list(self._state.values())
+
+    def _segments(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.journal_dir) if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _replay(self, path: str, snapshot_seq: int, last_segment: bool):
+        with open(path, 'rb') as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Una caída a mitad de un append deja la última línea cortada: esa escritura
+                # nunca se confirmó y se descarta. En otro lugar es corrupción real.
+                if last_segment and number == len(lines):
+                    print(f"⚠️ Discarding incomplete journal record at {path}:{number}")
+                    self._truncate(path, sum(len(previous) for previous in lines[:-1]))
+                    return
+                raise
+            if record['seq'] <= snapshot_seq:
+                continue  # ya incluido en el snapshot (compactación interrumpida)
+            if record['op'] == 'put':
+                self._state[record['id']] = record['product']
+            else:
+                self._state.pop(record['id'], None)
+            self._seq = self._committed_seq = max(self._seq, record['seq'])
+            self._since_snapshot += 1
+
+    @staticmethod
+    def _truncate(path: str, size: int):
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def start(self):
+        # Cada arranque escribe en un segmento nuevo: nunca se agrega detrás de una línea cortada
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._open_segment, self._segment + 1)
+        self._commit_task = asyncio.create_task(self._commit_loop(), name='journal-commit')
+
+    async def stop(self):
+        """Esperar las escrituras pendientes y la compactación en curso, y cerrar el segmento"""
+        if self._commit_task is not None:
+            await self._queue.join()
+            # La compactación en curso todavía necesita al loop de commit para rotar
+            if self._compaction is not None:
+                await asyncio.gather(self._compaction, return_exceptions=True)
+            self._commit_task.cancel()
+            await asyncio.gather(self._commit_task, return_exceptions=True)
+            self._commit_task = None
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._close_segment)
+        self._writer.shutdown(wait=True)
+
+    # Escrituras
+
+    def _enqueue(self, op: str, product_id: str, product: Optional[Dict[str, Any]]) -> asyncio.Future:
+        self._seq += 1
+        record = JournalRecord(self._seq, op, product_id, product, asyncio.get_running_loop().create_future())
+        self._queue.put_nowait(record)
+        return record.future
+
+    async def put(self, product_id: str, product: Dict[str, Any]):
+        """Registrar el producto completo (serializable a JSON); vuelve cuando está en disco"""
+        await self._enqueue('put', product_id, product)
+
+    async def delete(self, product_id: str):
+        await self._enqueue('delete', product_id, None)
+
+    async def write_many(self, changes: List[Tuple[str, str, Optional[Dict[str, Any]]]]):
+        """Varios (op, id, product) con un solo group commit: cuesta lo que miden los cambios"""
+        futures = [self._enqueue(op, product_id, product) for op, product_id, product in changes]
+        await asyncio.gather(*futures)
+
+    async def _commit_loop(self):
+        loop = asyncio.get_running_loop()
+        pending = None
+        while True:
+            item = pending if pending is not None else await self._queue.get()
+            pending = None
+            if isinstance(item, asyncio.Future):
+                await self._rotate_for_snapshot(item)
+                continue
+            batch = [item]
+            # Lo que se encoló mientras se sincronizaba el lote anterior sale en el mismo fsync
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if isinstance(item, asyncio.Future):
+                    pending = item
+                    break
+                batch.append(item)
+            try:
+                await loop.run_in_executor(self._writer, self._write, b''.join(record.line for record in batch))
+            except Exception as e:
+                print(f"❌ Error writing product journal: {e}")
+                for record in batch:
+                    if not record.future.done():
+                        record.future.set_exception(e)
+            else:
+                for record in batch:
+                    if record.op == 'put':
+                        self._state[record.product_id] = record.product
+                    else:
+                        self._state.pop(record.product_id, None)
+                    self._committed_seq = record.seq
+                    if not record.future.done():
+                        record.future.set_result(None)
+                self._since_snapshot += len(batch)
+                if self._since_snapshot >= self.compact_every and self._compaction is None:
+                    self._compaction = asyncio.create_task(self._compact(), name='journal-compact')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _rotate_for_snapshot(self, request: asyncio.Future):
+        # Entre dos lotes: todo lo escrito en los segmentos viejos ya está en _state
+        try:
+            first_kept = await asyncio.get_running_loop().run_in_executor(self._writer, self._rotate)
+        except Exception as e:
+            request.set_exception(e)
+        else:
+            self._since_snapshot = 0
+            request.set_result((first_kept, self._committed_seq, list(self._state.values())))
+        finally:
+            self._queue.task_done()
+
+    # Hilo de escritura
+
+    def _open_segment(self, segment: int):
+        self._segment = segment
+        path = os.path.join(self.journal_dir, f"{segment:08d}{SEGMENT_SUFFIX}")
+        self._file = open(path, 'ab', buffering=0)
+        self._fsync_directory(self.journal_dir)
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, data: bytes):
+        position = self._file.tell()
+        try:
+            self._file.write(data)
+            os.fsync(self._file.fileno())
+        except Exception:
+            # Sin restos de un lote fallido delante de los siguientes
+            self._file.truncate(position)
+            raise
+
+    def _rotate(self) -> int:
+        """Pasar a un segmento nuevo; devuelve el primero que no entra en el snapshot"""
+        previous = self._file
+        self._open_segment(self._segment + 1)
+        previous.close()
+        return self._segment
+
+    @staticmethod
+    def _fsync_directory(path: str):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # Compactación
+
+    async def compact(self):
+        """Escribir un snapshot con lo confirmado hasta ahora y borrar los segmentos viejos"""
+        if self._compaction is None:
+            self._compaction = asyncio.create_task(self._compact(), name='journal-compact')
+        await asyncio.shield(self._compaction)
+
+    async def _compact(self):
+        loop = asyncio.get_running_loop()
+        try:
+            # La rotación va por la misma cola que las escrituras, así el corte queda en orden
+            request = loop.create_future()
+            self._queue.put_nowait(request)
+            first_kept, seq, products = await request
+            # El snapshot se serializa en otro hilo; el journal sigue aceptando escrituras
+            await asyncio.to_thread(self._write_snapshot, seq, products, first_kept)
+            print(f"✅ Product journal compacted: {len(products)} products at seq {seq}")
+        except Exception as e:
+            print(f"❌ Error compacting product journal: {e}")
+        finally:
+            self._compaction = None
+
+    def _write_snapshot(self, seq: int, products: List[Dict[str, Any]], first_kept: int):
+        temporary = f"{self.snapshot_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'seq': seq, 'products': products}, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        self._fsync_directory(os.path.dirname(os.path.abspath(self.snapshot_path)))
+        # Recién con el snapshot en disco se pueden borrar los segmentos que cubre
+        for name in self._segments():
+            if int(name[:-len(SEGMENT_SUFFIX)]) < first_kept:
+                os.unlink(os.path.join(self.journal_dir, name))
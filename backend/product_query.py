@@ -0,0 +1,229 @@
+"""
+Capa de consultas de productos para Mathi Phone
+Traduce los filtros de /api/products a una única consulta MongoDB
+"""
+import base64
+import json
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from search_index import FIELD_WEIGHTS, parse_query, stem
+
+# Nunca enviamos el ObjectId interno al cliente
+PRODUCT_PROJECTION = {'_id': 0}
+
+# Filtros de igualdad exacta: parámetro -> campo del documento
+EQUALITY_FILTERS = {
+    'category': 'category',
+    'model': 'model',
+    'type': 'type',
+    'condition': 'condition',
+    'available': 'available',
+}
+
+# Filtros de rango: parámetro -> (campo del documento, operador)
+RANGE_FILTERS = {
+    'min_battery': ('battery_health', '$gte'),
+    'max_battery': ('battery_health', '$lte'),
+    'min_price_ars': ('price_ars', '$gte'),
+    'max_price_ars': ('price_ars', '$lte'),
+    'min_price_usd': ('price_usd', '$gte'),
+    'max_price_usd': ('price_usd', '$lte'),
+}
+
+# Órdenes de /api/products: parámetro sort -> (campo, dirección)
+# El _id crece con la fecha de alta, así que -created_at es el orden de inserción invertido
+SORT_OPTIONS = {
+    'price_usd': ('price_usd', 1),
+    '-price_usd': ('price_usd', -1),
+    'battery_health': ('battery_health', 1),
+    '-created_at': ('_id', -1),
+    'name': ('name', 1),
+}
+DEFAULT_SORT = ('_id', 1)
+
+# Conjuntos de campos predefinidos para `fields=`; admin es el documento completo
+CARD_FIELDS = (
+    'id', 'name', 'category', 'model', 'type', 'storage', 'color', 'condition',
+    'battery_health', 'price_ars', 'price_usd', 'price_currency', 'image_url', 'available',
+)
+FIELD_SETS = {
+    'card': CARD_FIELDS,
+    'detail': CARD_FIELDS + ('screen_size', 'chip', 'camera', 'features', 'warranty_months', 'description'),
+    'admin': None,
+}
+
+
+class ProductPage(NamedTuple):
+    items: List[Dict[str, Any]]
+    total: Optional[int]
+    next_cursor: Optional[str]
+
+
+def _is_set(value: Any) -> bool:
+    """Un filtro vacío ('' o None) equivale a no filtrar"""
+    return value is not None and value != ''
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Quitar los filtros vacíos y parámetros desconocidos"""
+    if not filters:
+        return {}
+    known = set(EQUALITY_FILTERS) | set(RANGE_FILTERS) | {'search'}
+    return {key: value for key, value in filters.items() if key in known and _is_set(value)}
+
+
+def parse_fields(fields: Optional[str], known: Sequence[str]) -> Optional[Tuple[str, ...]]:
+    """Campos pedidos en `fields=` (nombres o conjuntos predefinidos, separados por coma)
+
+    Devuelve los campos en el orden de `known`, siempre con `id`, o None si se pidió todo.
+    ValueError si algún nombre no es un campo ni un conjunto conocido.
+    """
+    if not _is_set(fields):
+        return None
+    selected = {'id'}
+    for name in (part.strip() for part in fields.split(',')):
+        if not name:
+            continue
+        if name in FIELD_SETS:
+            if FIELD_SETS[name] is None:
+                return None
+            selected.update(FIELD_SETS[name])
+        elif name in known:
+            selected.add(name)
+        else:
+            raise ValueError(f"Unknown field: {name}")
+    return tuple(field for field in known if field in selected)
+
+
+def build_projection(fields: Optional[Sequence[str]], sort: Optional[str] = None) -> Optional[Dict[str, int]]:
+    """Proyección MongoDB de inclusión para `fields` (más el campo de orden, que usan los cursores)"""
+    if fields is None:
+        return None
+    projection = dict.fromkeys(fields, 1)
+    field = SORT_OPTIONS.get(sort, DEFAULT_SORT)[0]
+    if field != '_id':
+        projection[field] = 1
+    return projection
+
+
+def build_product_query(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Construir el documento de consulta MongoDB para los filtros dados"""
+    filters = normalize_filters(filters)
+    query: Dict[str, Any] = {}
+
+    for param, field in EQUALITY_FILTERS.items():
+        if param in filters:
+            query[field] = filters[param]
+
+    for param, (field, operator) in RANGE_FILTERS.items():
+        if param in filters:
+            query.setdefault(field, {})[operator] = filters[param]
+
+    if 'search' in filters:
+        query.update(build_search_query(filters['search']))
+
+    return query
+
+
+# Letras que el índice de texto pliega (acentos, diéresis, eñe) como clases de regex
+_FOLDED_CLASSES = {
+    letter: '[' + variants + variants.upper() + ']'
+    for letter, variants in {'a': 'aáàâäã', 'e': 'eéèêë', 'i': 'iíìîï', 'o': 'oóòôöõ', 'u': 'uúùûü', 'n': 'nñ', 'c': 'cç'}.items()
+}
+
+
+def _word_prefix_pattern(prefix: str) -> str:
+    """Regex de una palabra que empieza con `prefix` (ya plegado), con o sin acentos"""
+    letters = ''.join(_FOLDED_CLASSES.get(char, re.escape(char)) for char in prefix)
+    return f"(?:^|[^0-9A-Za-zÀ-ÿ]){letters}"
+
+
+def build_search_query(search: str) -> Dict[str, Any]:
+    """Búsqueda con la semántica de parse_query, como el catálogo en memoria y FTS5
+
+    Los términos completos van entre comillas en $text (índice product_text), que así exige
+    todos; el último se busca como comienzo de palabra en los campos de texto, porque $text
+    no tiene prefijos. Su stem es prefijo del token, así que también cubre la forma completa.
+    Junto a las frases, el último va también sin comillas en $text: no filtra (MongoDB exige
+    solo las frases) pero suma al textScore, así la relevancia pesa todos los términos.
+    """
+    terms, last = parse_query(search)
+    if last is None:
+        return {'_id': {'$in': []}}
+    query: Dict[str, Any] = {}
+    if terms:
+        phrases = ' '.join(f'"{term}"' for term in dict.fromkeys(terms))
+        query['$text'] = {'$search': f'{phrases} {last}'}
+    pattern = _word_prefix_pattern(stem(last))
+    query['$or'] = [{field: {'$regex': pattern, '$options': 'i'}} for field in FIELD_WEIGHTS]
+    return query
+
+
+def has_text_score(filters: Optional[Dict[str, Any]]) -> bool:
+    """Si la consulta usa $text (y por lo tanto puede ordenarse por textScore)
+
+    Con un solo término no hay $text: sin comillas exigiría la palabra completa y dejaría
+    afuera los prefijos, así que sort=relevance queda en orden de inserción en MongoDB.
+    """
+    search = normalize_filters(filters).get('search')
+    return bool(search and parse_query(search)[0])
+
+
+def build_product_sort(sort: Optional[str], filters: Optional[Dict[str, Any]]) -> List[Tuple[str, Any]]:
+    """Especificación de orden MongoDB para el parámetro `sort`
+
+    Sin orden explícito se usa el de inserción (_id), que además desempata los cursores.
+    """
+    if sort == 'relevance' and has_text_score(filters):
+        return [('score', {'$meta': 'textScore'})]
+    field, direction = SORT_OPTIONS.get(sort, DEFAULT_SORT)
+    if field == '_id':
+        return [('_id', direction)]
+    return [(field, direction), ('_id', direction)]
+
+
+# Cursores opacos: (orden, clave de orden, último _id) codificados en base64 URL-safe
+
+def encode_cursor(sort: Optional[str], key: Any, oid: Any) -> str:
+    payload = json.dumps([sort, key, str(oid)], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(token: str, sort: Optional[str]) -> Tuple[Any, str]:
+    """Devolver (clave de orden, _id) del cursor; ValueError si es inválido o de otro orden"""
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_sort, key, oid = json.loads(payload)
+        ObjectId(oid)
+    except (ValueError, TypeError, InvalidId):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor was issued for a different sort order")
+    return key, oid
+
+
+def build_cursor_query(sort: Optional[str], cursor: str) -> Dict[str, Any]:
+    """Condición de búsqueda por rango para continuar después del cursor
+
+    MongoDB ordena los null y los campos ausentes antes que cualquier valor, y $gt/$lt nunca
+    los alcanzan: un producto sin la clave (p. ej. sin precio) se trata aparte.
+    """
+    key, oid = decode_cursor(cursor, sort)
+    field, direction = SORT_OPTIONS.get(sort, DEFAULT_SORT)
+    operator = '$gt' if direction > 0 else '$lt'
+    if field == '_id':
+        return {'_id': {operator: ObjectId(oid)}}
+    if key is None:
+        if direction > 0:
+            return {'$or': [{field: {'$ne': None}}, {field: None, '_id': {'$gt': ObjectId(oid)}}]}
+        return {field: None, '_id': {'$lt': ObjectId(oid)}}
+    clauses = [
+        {field: {operator: key}},
+        {field: key, '_id': {operator: ObjectId(oid)}},
+    ]
+    # En orden descendente los null quedan al final
+    if direction < 0:
+        clauses.append({field: None})
+    return {'$or': clauses}
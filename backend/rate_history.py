@@ -0,0 +1,73 @@
+"""
+Historial de tasas de cambio para Mathi Phone
+Cada actualización se guarda en crudo y se acumula en buckets de 5 minutos y de 1 hora;
+los índices TTL de db_indexes descartan lo crudo a las 24 h y los buckets de 5 minutos
+a los 30 días, así que cada consulta lee solo la resolución que necesita
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, NamedTuple, Optional
+
+
+class Tier(NamedTuple):
+    collection: str
+    bucket: Optional[timedelta]  # None = puntos crudos
+    retention: Optional[timedelta]  # None = sin vencimiento
+
+
+# Resoluciones de más fina a más gruesa
+TIERS = {
+    'raw': Tier('exchange_rates_raw', None, timedelta(hours=24)),
+    '5m': Tier('exchange_rates_5m', timedelta(minutes=5), timedelta(days=30)),
+    '1h': Tier('exchange_rates_1h', timedelta(hours=1), None),
+}
+
+# Tope de puntos por consulta a /api/exchange-rates/history (30 días de buckets de 5 minutos)
+MAX_HISTORY_POINTS = 10000
+
+
+def as_utc(moment: datetime) -> datetime:
+    """MongoDB devuelve fechas naive en UTC; los parámetros pueden venir sin zona"""
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+
+def bucket_start(moment: datetime, size: timedelta) -> datetime:
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return epoch + ((as_utc(moment) - epoch) // size) * size
+
+
+def choose_resolution(start: datetime, now: Optional[datetime] = None) -> str:
+    """La resolución más fina que todavía conserva todo el rango pedido"""
+    now = now or datetime.now(timezone.utc)
+    return next(
+        name for name, tier in TIERS.items()
+        if tier.retention is None or as_utc(start) >= now - tier.retention
+    )
+
+
+def rollup_update(rates: Dict[str, float]) -> Dict[str, Any]:
+    """Operación de upsert que agrega una muestra al bucket: min, max, suma, cantidad y cierre"""
+    return {
+        '$min': {f'rates.{currency}.min': value for currency, value in rates.items()},
+        '$max': {f'rates.{currency}.max': value for currency, value in rates.items()},
+        '$inc': {
+            **{f'rates.{currency}.sum': value for currency, value in rates.items()},
+            **{f'rates.{currency}.count': 1 for currency in rates},
+        },
+        '$set': {f'rates.{currency}.close': value for currency, value in rates.items()},
+    }
+
+
+def history_point(document: Dict[str, Any], currency: str) -> Optional[Dict[str, Any]]:
+    """Punto de la respuesta: valor (cierre del bucket) y, si es agregado, mínimo, máximo y promedio"""
+    value = document.get('rates', {}).get(currency)
+    if value is None:
+        return None
+    if 'bucket' not in document:
+        return {'t': as_utc(document['ts']), 'value': value}
+    return {
+        't': as_utc(document['bucket']),
+        'value': value['close'],
+        'min': value['min'],
+        'max': value['max'],
+        'avg': value['sum'] / value['count'],
+    }
@@ -0,0 +1,67 @@
+"""
+Caché en memoria de las tasas de cambio para Mathi Phone
+ExchangeRatesService y POST /api/exchange-rates empujan cada actualización; pasado el TTL
+(otro worker pudo haber actualizado MongoDB) se sigue sirviendo el valor anterior
+mientras se recarga en segundo plano
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RatesCache:
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self.rates: Optional[Dict[str, Any]] = None
+        self._updated_at = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self._updated_at > self.ttl
+
+    def set(self, rates: Dict[str, Any]):
+        """Guardar tasas recién escritas en MongoDB"""
+        self.rates = dict(rates)
+        self._updated_at = time.monotonic()
+
+    async def get(self, database) -> Optional[Dict[str, Any]]:
+        """Tasas actuales; solo el primer pedido espera a MongoDB"""
+        if not self.stale:
+            return self.rates
+        if self.rates is None:
+            await self._start_refresh(database)
+        else:
+            self._start_refresh(database)  # stale-while-revalidate
+        return self.rates
+
+    async def refresh(self, database) -> Optional[Dict[str, Any]]:
+        """Recargar ya desde MongoDB (otro worker avisó que las tasas cambiaron)"""
+        await self._start_refresh(database)
+        return self.rates
+
+    def _start_refresh(self, database) -> asyncio.Task:
+        """Una sola recarga a la vez, compartida por todos los requests que la necesiten"""
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._reload(database))
+        return self._refresh
+
+    async def _reload(self, database):
+        try:
+            document = await database.get_exchange_rates()
+        except Exception as e:
+            logger.error(f"Error reloading exchange rates cache: {e}")
+            return
+        if document and 'rates' in document:
+            self.set(document['rates'])
+        else:
+            # Sin documento todavía: no volver a consultar hasta el próximo TTL
+            self._updated_at = time.monotonic()
+
+
+# Instancia global del caché de tasas
+rates_cache = RatesCache(float(os.environ.get('RATES_CACHE_TTL', 60)))
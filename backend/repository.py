@@ -0,0 +1,167 @@
+"""
+Interfaz de almacenamiento de Mathi Phone
+server.py y sus servicios (tasas, usuarios, leader, importación) usan la base de datos solo
+a través de ProductRepository; DATABASE_BACKEND elige la implementación: mongo
+(MongoDBDatabase, por defecto) o sqlite (SQLiteDatabase, archivo en SQLITE_PATH). Quedan
+fuera los servidores independientes (simple_server*.py, con su propio almacenamiento en
+memoria o en archivo) y database.MockDatabase, que es sincrónica. La misma interfaz sirve
+para comparar los backends:
+
+    DATABASE_BACKEND=sqlite python repository.py --iterations 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Protocol, Sequence, Tuple, runtime_checkable
+from dotenv import load_dotenv
+from mongodb_database import db as mongo_db
+from product_query import ProductPage
+from sqlite_database import SQLiteDatabase
+
+BACKENDS = ('mongo', 'sqlite')
+
+
+@runtime_checkable
+class ProductRepository(Protocol):
+    """Operaciones que todo backend implementa con la misma semántica
+
+    create_product lanza pymongo.errors.DuplicateKeyError si el ID ya existe; los demás
+    métodos registran el error y devuelven un valor vacío, como MongoDBDatabase.
+    """
+
+    async def connect(self, ensure_indexes: bool = True): ...
+
+    async def disconnect(self): ...
+
+    # Productos
+    async def find_products(
+        self,
+        filters: Dict[str, Any] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        count: str = 'exact',
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> ProductPage: ...
+
+    async def count_products(self, filters: Dict[str, Any] = None, estimated: bool = False) -> int: ...
+
+    async def get_product_facets(self, filters: Dict[str, Any] = None) -> Dict[str, Any]: ...
+
+    def iter_products(
+        self,
+        filters: Dict[str, Any] = None,
+        batch_size: int = 1000,
+        include_oid: bool = False,
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> AsyncIterator[Dict[str, Any]]: ...
+
+    async def get_product(
+        self,
+        product_id: str,
+        fields: Optional[Tuple[str, ...]] = None,
+        include_oid: bool = False
+    ) -> Optional[Dict[str, Any]]: ...
+
+    async def get_products_by_ids(self, product_ids: List[str], fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Dict[str, Any]]: ...
+
+    async def create_product(self, product_data: Dict[str, Any]) -> Dict[str, Any]: ...
+
+    async def update_product(self, product_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]: ...
+
+    async def delete_product(self, product_id: str) -> bool: ...
+
+    async def bulk_write_products(
+        self,
+        operations: List[Dict[str, Any]],
+        ordered: bool = True,
+        batch_size: int = 500
+    ) -> List[Dict[str, Any]]: ...
+
+    async def upsert_products_by_key(
+        self,
+        products: List[Dict[str, Any]],
+        key_fields: Sequence[str],
+        defaults: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]: ...
+
+    # Tasas de cambio
+    async def get_exchange_rates(self) -> Optional[Dict[str, Any]]: ...
+
+    async def update_exchange_rates(self, rates_data: Dict[str, Any]) -> bool: ...
+
+    async def get_rate_history(self, currency: str, start: datetime, end: datetime, resolution: str) -> List[Dict[str, Any]]: ...
+
+    # Usuarios de user_directory.DatabaseSource; los errores se propagan
+    async def get_users(self) -> List[Dict[str, Any]]: ...
+
+    # Status checks y leases de leader.py
+    async def add_status_check(self, status_check: Dict[str, Any]): ...
+
+    async def get_status_checks(self, limit: int = 1000) -> List[Dict[str, Any]]: ...
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool: ...
+
+    async def release_lease(self, name: str, owner: str): ...
+
+
+def create_database(backend: str) -> ProductRepository:
+    """Backend configurado; mongo reutiliza la instancia global de mongodb_database"""
+    if backend == 'sqlite':
+        return SQLiteDatabase(read_workers=int(os.environ.get('SQLITE_READ_WORKERS', 4)))
+    if backend == 'mongo':
+        return mongo_db
+    raise ValueError(f"Unknown DATABASE_BACKEND: {backend} (expected one of {', '.join(BACKENDS)})")
+
+
+load_dotenv(Path(__file__).parent / '.env')
+DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND', 'mongo')
+
+# Instancia global de la base de datos configurada
+db = create_database(DATABASE_BACKEND)
+
+
+async def _timed(iterations: int, operation) -> Dict[str, float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await operation()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {'p50': statistics.median(samples), 'p95': samples[int(len(samples) * 0.95) - 1], 'mean': statistics.fmean(samples)}
+
+
+async def _benchmark(args):
+    """Medir las consultas más frecuentes de la API contra el backend configurado (solo lecturas)"""
+    await db.connect(ensure_indexes=False)
+    try:
+        sample = [product['id'] async for product in db.iter_products(fields=('id',))][:50]
+        if not sample:
+            raise SystemExit("❌ La base no tiene productos; cargalos antes con seed_products.py o product_import.py")
+        operations = {
+            'list page': lambda: db.find_products(limit=24, count='exact'),
+            'list filtered': lambda: db.find_products({'category': 'iphone', 'min_battery': 85}, limit=24, sort='price_usd'),
+            'list card fields': lambda: db.find_products(limit=24, fields=('id', 'name', 'price_usd')),
+            'search': lambda: db.find_products({'search': 'pro negro'}, limit=24, sort='relevance'),
+            'facets': lambda: db.get_product_facets({'category': 'iphone'}),
+            'get product': lambda: db.get_product(sample[0]),
+            'batch get 50': lambda: db.get_products_by_ids(sample),
+            'exchange rates': db.get_exchange_rates,
+        }
+        print(f"📊 {DATABASE_BACKEND}: {await db.count_products(estimated=True)} productos, {args.iterations} iteraciones")
+        for name, operation in operations.items():
+            timings = await _timed(args.iterations, operation)
+            print(f"   {name:<18} p50 {timings['p50']:7.2f} ms   p95 {timings['p95']:7.2f} ms   media {timings['mean']:7.2f} ms")
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de lecturas del backend configurado en DATABASE_BACKEND")
+    parser.add_argument('--iterations', type=int, default=100)
+    asyncio.run(_benchmark(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+Caché de respuestas de catálogo para Mathi Phone
+Guarda los bytes ya serializados por consulta canónica, con desalojo LRU por tamaño,
+invalidación por generación del catálogo y ETags fuertes para responder 304
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlencode
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    generation: int
+
+
+def canonical_key(request: Request) -> str:
+    """Ruta + query string ordenada y sin parámetros vacíos"""
+    params = sorted((key, value) for key, value in request.query_params.multi_items() if value != '')
+    return f"{request.url.path}?{urlencode(params)}"
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Comparación débil de If-None-Match, como indica RFC 9110 para GET"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return etag.removeprefix('W/') in candidates
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self._size = 0
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+
+    def bump(self):
+        """Nueva generación del catálogo: todas las entradas anteriores quedan vencidas"""
+        self.generation += 1
+        self._entries.clear()
+        self._size = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None or entry.generation != self.generation:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, body: bytes, headers: Optional[Dict[str, str]] = None, generation: Optional[int] = None) -> CachedResponse:
+        """Guardar una respuesta calculada durante `generation` (por defecto, la actual)"""
+        entry = CachedResponse(body, make_etag(body), headers or {}, self.generation if generation is None else generation)
+        if entry.generation != self.generation or len(body) > self.max_bytes:
+            # Una escritura ocurrió mientras se calculaba, o no entra: se sirve sin guardar
+            return entry
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous.body)
+        self._entries[key] = entry
+        self._size += len(body)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted.body)
+        return entry
+
+
+def cached_response(request: Request, entry: CachedResponse) -> Response:
+    """Respuesta completa o 304 Not Modified si el cliente ya tiene esta versión"""
+    headers = {**entry.headers, 'ETag': entry.etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type='application/json', headers=headers)
+
+
+# Instancia global del caché de respuestas
+response_cache = ResponseCache(int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
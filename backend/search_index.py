@@ -0,0 +1,180 @@
+"""
+Índice invertido de búsqueda para Mathi Phone
+Tokenización en español con plegado de acentos ("Batería" == "bateria"),
+stemming liviano, ranking BM25 y actualizaciones incrementales
+"""
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Campos indexados y su peso en la frecuencia de términos
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'chip': 2.0,
+    'color': 2.0,
+    'features': 1.5,
+    'description': 1.0,
+}
+
+# Parámetros BM25
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = frozenset("""
+a al con de del el en es la las lo los o para por que se sin su sus un una unos unas y
+""".split())
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin acentos ni diéresis"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(token: str) -> str:
+    """Stemming liviano para español: plurales, -mente y género
+
+    Los tokens con dígitos (modelos, capacidades, chips) no se tocan.
+    """
+    if len(token) <= 4 or any(char.isdigit() for char in token):
+        return token
+    if token.endswith('mente') and len(token) > 8:
+        token = token[:-5]
+    elif token.endswith('ciones'):
+        token = token[:-6] + 'cion'
+    elif token.endswith('es') and len(token) > 5 and token[-3] not in 'aeiou':
+        token = token[:-2]
+    elif token.endswith('s') and token[-2] in 'aeiou':
+        token = token[:-1]
+    if len(token) > 4 and token[-1] in 'aoe':
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens plegados, sin stopwords"""
+    return [token for token in _TOKEN_RE.findall(fold(text)) if token not in STOPWORDS]
+
+
+def analyze(text: str) -> List[str]:
+    """Términos indexables de un texto"""
+    return [stem(token) for token in tokenize(text)]
+
+
+def parse_query(query: str) -> Tuple[List[str], Optional[str]]:
+    """Términos de una búsqueda, con la misma semántica en todos los backends
+
+    Todos los términos son obligatorios: los anteriores al último se comparan por stem (sin
+    stopwords) y el último, plegado, vale completo o como prefijo para buscar mientras se
+    escribe. Devuelve (stems, último token), o ([], None) si la consulta no tiene tokens.
+    """
+    tokens = _TOKEN_RE.findall(fold(query))
+    if not tokens:
+        return [], None
+    *head, last = tokens
+    return [stem(token) for token in head if token not in STOPWORDS], last
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._doc_len: Dict[str, float] = {}
+        self._total_len = 0.0
+        self._sorted_terms: List[str] = []
+        self._terms_dirty = False
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def clear(self):
+        self.__init__()
+
+    def add(self, product: Dict[str, Any]):
+        """Indexar (o reindexar) un producto"""
+        product_id = product['id']
+        self.remove(product_id)
+
+        frequencies: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in analyze(_field_text(product.get(field))):
+                frequencies[term] = frequencies.get(term, 0.0) + weight
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms_dirty = True
+            postings[product_id] = frequency
+
+        doc_len = sum(frequencies.values())
+        self._doc_terms[product_id] = set(frequencies)
+        self._doc_len[product_id] = doc_len
+        self._total_len += doc_len
+
+    def remove(self, product_id: str):
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[product_id]
+            if not postings:
+                del self._postings[term]
+                self._terms_dirty = True
+        self._total_len -= self._doc_len.pop(product_id)
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        if self._terms_dirty:
+            self._sorted_terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect_left(self._sorted_terms, prefix)
+        end = bisect_left(self._sorted_terms, prefix + '\uffff')
+        return self._sorted_terms[start:end]
+
+    def search(self, query: str) -> Dict[str, float]:
+        """Productos que contienen todos los términos de la consulta (parse_query), con su puntaje BM25"""
+        terms, last = parse_query(query)
+        if last is None:
+            return {}
+        groups = [{term} for term in terms]
+        groups.append({stem(last), *self._prefix_terms(last)})
+
+        n_docs = len(self._doc_len)
+        avg_len = self._total_len / n_docs if n_docs else 0.0
+        scores: Dict[str, float] = {}
+        for index, terms in enumerate(groups):
+            group_scores = self._score_terms(terms, n_docs, avg_len)
+            if index == 0:
+                scores = group_scores
+            else:
+                scores = {doc: score + group_scores[doc] for doc, score in scores.items() if doc in group_scores}
+            if not scores:
+                break
+        return scores
+
+    def _score_terms(self, terms: Iterable[str], n_docs: int, avg_len: float) -> Dict[str, float]:
+        """Puntaje BM25 por producto del mejor término de un grupo de alternativas"""
+        scores: Dict[str, float] = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, frequency in postings.items():
+                norm = K1 * (1 - B + B * self._doc_len[doc] / avg_len)
+                score = idf * frequency * (K1 + 1) / (frequency + norm)
+                if score > scores.get(doc, 0.0):
+                    scores[doc] = score
+        return scores
+
+
+def _field_text(value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(item) for item in value)
+    return str(value)
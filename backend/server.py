@@ -1,15 +1,20 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, Depends, File, HTTPException, Query, UploadFile
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+import io
 import os
 import logging
 from pathlib import Path
+from functools import lru_cache
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import Annotated, List, Optional, Dict, Any, Tuple, Union, Literal
 import jwt
 from datetime import datetime, timedelta, timezone
 import requests
@@ -17,8 +22,24 @@ import uuid
 from datetime import datetime, timezone
 import asyncio
 import requests
-from mongodb_database import db
+from repository import db
+from auth import TokenVerifier
 from exchange_rates_service import exchange_service
+from catalog import catalog
+from events import event_broker, event_stream, parse_event_id
+from facets import facet_cache
+from invalidation import Invalidation, invalidation_bus
+from leader import leader_election
+from models import Product, ProductCreate, ProductUpdate
+from product_encoder import ModelEncoder
+from product_export import EXPORT_FORMATS, export_csv, export_ndjson
+from product_import import IMPORT_FORMATS, detect_format, import_products, shutdown_pool
+from compression import CompressionMiddleware, variant_cache
+from rate_history import TIERS, as_utc, choose_resolution
+from rates_cache import rates_cache
+from response_cache import cached_response, canonical_key, response_cache
+from product_query import FIELD_SETS, SORT_OPTIONS, parse_fields
+from user_directory import user_directory
 
 
 ROOT_DIR = Path(__file__).parent
@@ -28,6 +49,15 @@ load_dotenv(ROOT_DIR / '.env')
 print("🔄 Connecting to MongoDB...")
 client = None
 
+# Catálogo columnar en memoria para los listados (CATALOG_SNAPSHOT=0 consulta siempre MongoDB)
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT', '1') != '0'
+
+# Segundos entre heartbeats de /api/events
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+
+# Valores aceptados por el parámetro sort de /api/products
+SORT_PATTERN = "^(relevance|" + "|".join(SORT_OPTIONS) + ")$"
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -38,13 +68,32 @@ api_router = APIRouter(prefix="/api")
 async def startup_event():
     """Initialize database connection and start exchange rate service"""
     await db.connect()
-    # Iniciar servicio de tasas automáticas en background
-    asyncio.create_task(exchange_service.start_auto_update())
+    # Escuchar invalidaciones de los demás workers antes de cargar los cachés
+    try:
+        await invalidation_bus.start()
+    except Exception as e:
+        logger.error(f"Error starting invalidation bus: {e}")
+    if CATALOG_SNAPSHOT:
+        try:
+            await catalog.load(db)
+        except Exception as e:
+            # Sin catálogo en memoria los listados se resuelven en MongoDB
+            logger.error(f"Error loading catalog snapshot: {e}")
+    # Tareas periódicas: solo en el worker que tenga el lease de líder en la base de datos
+    leader_election.add_job('exchange-rates', exchange_service.start_auto_update)
+    leader_election.start(db)
+    # Directorio de usuarios en memoria, refrescado en segundo plano en cada worker
+    user_directory.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close database connection and stop exchange rate service"""
     exchange_service.stop()
+    await user_directory.stop()
+    await leader_election.stop(db)
+    await exchange_service.aclose()
+    await invalidation_bus.stop()
+    await shutdown_pool()
     await db.disconnect()
 
 
@@ -60,74 +109,56 @@ class StatusCheckCreate(BaseModel):
     client_name: str
 
 
-# Product Models
-class Product(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    model: str  # 11, 12, 13, 14, 15, 16, 17, se
-    type: str  # pro-max, pro, plus, normal, mini, se
-    storage: str  # 64GB, 128GB, 256GB, 512GB, 1TB
-    color: str
-    condition: str = "sealed"
-    battery_health: int = 100
-    price_ars: float
-    price_usd: float
-    price_currency: str = "USD"  # USD or ARS
-    screen_size: str
-    chip: str
-    camera: str
-    features: List[str]
-    available: bool = True
-    warranty_months: int = 0
-    description: str = ""
-    image_url: str = ""
-    category: str = "iphone"  # iphone, macbook, watch, airpods, ipad, accesorio
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class ProductCreate(BaseModel):
-    name: str
-    model: str
-    type: str
-    storage: str
-    color: str
-    condition: str = "sealed"
-    battery_health: int = 100
-    price_ars: float
-    price_usd: float
-    price_currency: str = "USD"
-    screen_size: str
-    chip: str
-    camera: str
-    features: List[str]
-    available: bool = True
-    warranty_months: int = 0
-    description: str = ""
-    image_url: str = ""
-    category: str = "iphone"
-
-class ProductUpdate(BaseModel):
-    name: Optional[str] = None
-    model: Optional[str] = None
-    type: Optional[str] = None
-    storage: Optional[str] = None
-    color: Optional[str] = None
-    condition: Optional[str] = None
-    battery_health: Optional[int] = None
-    price_ars: Optional[float] = None
-    price_usd: Optional[float] = None
-    price_currency: Optional[str] = None
-    screen_size: Optional[str] = None
-    chip: Optional[str] = None
-    camera: Optional[str] = None
-    features: Optional[List[str]] = None
-    available: Optional[bool] = None
-    warranty_months: Optional[int] = None
-    description: Optional[str] = None
-    image_url: Optional[str] = None
-    category: Optional[str] = None
+# Las respuestas de productos salen de documentos confiables de la base de datos:
+# se serializan directo a JSON con la forma de Product, sin validarlos de nuevo
+product_encoder = ModelEncoder(Product)
+
+@lru_cache(maxsize=64)
+def product_encoder_for(fields: Optional[Tuple[str, ...]]) -> ModelEncoder:
+    """Encoder recortado a los campos de `fields=` (None = Product completo)"""
+    return ModelEncoder(Product, fields) if fields else product_encoder
+
+def product_fields(
+    fields: Optional[str] = Query(None, description="Comma-separated fields or a preset: " + ", ".join(FIELD_SETS))
+) -> Optional[Tuple[str, ...]]:
+    """Campos pedidos con `fields=`, en el orden del modelo Product"""
+    try:
+        return parse_fields(fields, tuple(Product.model_fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def product_response(product: Dict[str, Any]) -> Response:
+    return Response(content=product_encoder.encode(product), media_type='application/json')
+
+# Documentos por lote del cursor de /api/products/export
+EXPORT_BATCH_SIZE = 500
+
+# Máximo de IDs por llamada a /api/products/batch-get
+BATCH_GET_MAX_IDS = 500
+
+class ProductBatchGet(BaseModel):
+    ids: List[str] = Field(..., max_length=BATCH_GET_MAX_IDS)
+
+# Operaciones de /api/products/bulk
+BULK_MAX_OPERATIONS = 5000
+
+class BulkInsert(BaseModel):
+    op: Literal['insert']
+    product: ProductCreate
+
+class BulkUpdate(BaseModel):
+    op: Literal['update']
+    id: str
+    changes: ProductUpdate
+
+class BulkDelete(BaseModel):
+    op: Literal['delete']
+    id: str
+
+class ProductBulkRequest(BaseModel):
+    operations: List[Annotated[Union[BulkInsert, BulkUpdate, BulkDelete], Field(discriminator='op')]] = Field(..., max_length=BULK_MAX_OPERATIONS)
+    ordered: bool = True
+    batch_size: int = Field(500, ge=1, le=1000)
 
 class LoginRequest(BaseModel):
     username: str
@@ -142,7 +173,18 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "mathi-phone-secret-key-2024")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 24 hours
 
-USERS_URL = "https://raw.githubusercontent.com/kysrn-ww/mog/main/users.json"
+# Tokens ya verificados en memoria: las escrituras seguidas del admin no vuelven a decodificar
+token_verifier = TokenVerifier(SECRET_KEY, ALGORITHM, max_entries=int(os.environ.get('TOKEN_CACHE_SIZE', 1024)))
+bearer_scheme = HTTPBearer(auto_error=False)
+
+async def require_admin(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)) -> Dict[str, Any]:
+    """Claims del token Bearer del panel de administración; 401 si falta o no es válido"""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return token_verifier.verify(credentials.credentials)
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}", headers={"WWW-Authenticate": "Bearer"})
 
 
 # Exchange Rate Models
@@ -168,12 +210,12 @@ async def create_status_check(input: StatusCheckCreate):
     doc = status_obj.model_dump()
     doc['timestamp'] = doc['timestamp'].isoformat()
     
-    _ = await db.status_checks.insert_one(doc)
+    await db.add_status_check(doc)
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
-    status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
+    status_checks = await db.get_status_checks(1000)
     
     for check in status_checks:
         if isinstance(check['timestamp'], str):
@@ -183,18 +225,86 @@ async def get_status_checks():
 
 
 # Product Routes
-@api_router.post("/products", response_model=Product)
+def _apply_product_change(product_id: str, product: Optional[Dict[str, Any]] = None, created: bool = False):
+    """Propagar una escritura de producto a las estructuras en memoria y a los clientes SSE"""
+    response_cache.bump()
+    facet_cache.invalidate()
+    if catalog.loaded:
+        if product is None:
+            catalog.remove(product_id)
+        else:
+            catalog.upsert(product)
+    if product is None:
+        event_broker.publish('product.deleted', {'id': product_id})
+    else:
+        event_broker.publish('product.created' if created else 'product.updated', product_encoder.encode(product))
+
+async def _reload_catalog():
+    """Invalidar los cachés y recargar el catálogo completo"""
+    response_cache.bump()
+    facet_cache.invalidate()
+    if catalog.loaded:
+        await catalog.load(db)
+        # Mientras load() esperaba, los requests leían las filas viejas y las cacheaban
+        # con la generación nueva
+        response_cache.bump()
+        facet_cache.invalidate()
+    event_broker.publish('catalog.reloaded', {})
+
+def _catalog_changed(product_id: str, product: Optional[Dict[str, Any]] = None, created: bool = False):
+    """Aplicar una escritura de producto en este worker y avisar a los demás"""
+    _apply_product_change(product_id, product, created)
+    action = 'deleted' if product is None else 'created' if created else 'updated'
+    invalidation_bus.publish('product', product_id, action)
+
+async def _catalog_reloaded():
+    """Propagar una escritura masiva: recargar el catálogo en lugar de aplicar fila por fila"""
+    await _reload_catalog()
+    invalidation_bus.publish('product')
+
+async def _on_product_invalidated(message: Invalidation):
+    """Escritura de producto atendida por otro worker: releer solo lo que cambió
+
+    Con su `_id`, para que la fila del catálogo conserve el orden de inserción y los
+    cursores que emiten todos los workers coincidan.
+    """
+    if message.key is None:
+        await _reload_catalog()
+        return
+    product = None if message.action == 'deleted' else await db.get_product(message.key, include_oid=True)
+    _apply_product_change(message.key, product, created=message.action == 'created')
+
+async def _on_rates_invalidated(message: Invalidation):
+    rates = await rates_cache.refresh(db)
+    if rates:
+        event_broker.publish('rates.updated', {'rates': rates, 'timestamp': datetime.now(timezone.utc)})
+
+def _on_token_revoked(message: Invalidation):
+    """Logout atendido por otro worker; un reset (key None) no trae qué revocar"""
+    if message.key is not None:
+        token_verifier.revoke(message.key, message.data['exp'])
+
+invalidation_bus.subscribe('product', _on_product_invalidated)
+invalidation_bus.subscribe('rates', _on_rates_invalidated)
+invalidation_bus.subscribe('auth', _on_token_revoked)
+
+@api_router.post("/products", response_model=Product, dependencies=[Depends(require_admin)])
 async def create_product(product: ProductCreate):
     """Create a new product"""
     product_data = product.model_dump()
     product_data['created_at'] = datetime.now(timezone.utc)
     product_data['updated_at'] = datetime.now(timezone.utc)
     
-    # Usar base de datos simulada
-    new_product = await db.create_product(product_data)
-    return Product(**new_product)
-
-@api_router.put("/products/{product_id}", response_model=Product)
+    try:
+        new_product = await db.create_product(product_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Product already exists")
+    if not new_product:
+        raise HTTPException(status_code=500, detail="Failed to create product")
+    _catalog_changed(new_product['id'], new_product, created=True)
+    return product_response(new_product)
+
+@api_router.put("/products/{product_id}", response_model=Product, dependencies=[Depends(require_admin)])
 async def update_product(product_id: str, product_update: ProductUpdate):
     """Update a product"""
     print(f"Updating product {product_id} with data: {product_update.model_dump()}")
@@ -207,9 +317,10 @@ async def update_product(product_id: str, product_update: ProductUpdate):
     if not updated_product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    return Product(**updated_product)
+    _catalog_changed(product_id, updated_product)
+    return product_response(updated_product)
 
-@api_router.delete("/products/{product_id}")
+@api_router.delete("/products/{product_id}", dependencies=[Depends(require_admin)])
 async def delete_product(product_id: str):
     """Delete a product"""
     try:
@@ -219,6 +330,7 @@ async def delete_product(product_id: str):
         success = await db.delete_product(product_id)
         if not success:
             raise HTTPException(status_code=404, detail="Product not found")
+        _catalog_changed(product_id)
         
         result = {"message": f"Product {product_id} deleted successfully"}
         print(f"Returning result: {result}")
@@ -227,67 +339,179 @@ async def delete_product(product_id: str):
         print(f"Error in delete_product: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products(
+@api_router.post("/products/bulk", dependencies=[Depends(require_admin)])
+async def bulk_products(bulk: ProductBulkRequest):
+    """Insert, update and delete many products with batched bulk_write calls"""
+    operations = []
+    for operation in bulk.operations:
+        if operation.op == 'insert':
+            operations.append({'op': 'insert', 'product': operation.product.model_dump()})
+        elif operation.op == 'update':
+            # Solo los campos enviados: los omitidos no se pisan con null
+            operations.append({'op': 'update', 'id': operation.id, 'changes': operation.changes.model_dump(exclude_unset=True)})
+        else:
+            operations.append({'op': 'delete', 'id': operation.id})
+    
+    results = await db.bulk_write_products(operations, ordered=bulk.ordered, batch_size=bulk.batch_size)
+    
+    summary = {'ok': 0, 'not_found': 0, 'error': 0, 'skipped': 0}
+    for result in results:
+        summary[result['status']] += 1
+    # Una sola recarga, un evento y un mensaje al bus, no uno por operación: miles de
+    # catalog.upsert, eventos SSE (que desbordan las colas de los clientes) y relecturas
+    # en los demás workers
+    if summary['ok']:
+        await _catalog_reloaded()
+    return {'ordered': bulk.ordered, 'summary': summary, 'results': results}
+
+@api_router.post("/products/import", dependencies=[Depends(require_admin)])
+async def import_products_file(
+    file: UploadFile = File(..., description="Supplier price list in CSV or NDJSON"),
+    format: Optional[str] = Query(None, pattern="^(" + "|".join(IMPORT_FORMATS) + ")$", description="csv or ndjson (default: from the file extension)")
+):
+    """Upsert products from an uploaded CSV/NDJSON file by name+model+storage+color+condition"""
+    format = format or detect_format(file.filename)
+    if format is None:
+        raise HTTPException(status_code=400, detail="Unknown file format, pass format=csv or format=ndjson")
+    
+    stream = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+    try:
+        summary = await import_products(db, stream, format)
+    finally:
+        stream.detach()
+    await _catalog_reloaded()
+    return summary
+
+def product_filters(
     category: Optional[str] = Query(None, description="Filter by category: iphone, macbook, watch, airpods, ipad, accesorio"),
     model: Optional[str] = Query(None, description="Filter by model"),
     type: Optional[str] = Query(None, description="Filter by type: pro-max, pro, plus, normal, mini, se"),
     condition: Optional[str] = Query(None, description="Filter by condition: sealed, like-new, excellent, good"),
     min_battery: Optional[int] = Query(None, ge=0, le=100, description="Minimum battery health"),
+    max_battery: Optional[int] = Query(None, ge=0, le=100, description="Maximum battery health"),
+    min_price_ars: Optional[float] = Query(None, ge=0, description="Minimum price in ARS"),
     max_price_ars: Optional[float] = Query(None, ge=0, description="Maximum price in ARS"),
+    min_price_usd: Optional[float] = Query(None, ge=0, description="Minimum price in USD"),
     max_price_usd: Optional[float] = Query(None, ge=0, description="Maximum price in USD"),
     available: Optional[bool] = Query(None, description="Filter by availability"),
-    search: Optional[str] = Query(None, description="Search in name, color, chip, features"),
+    search: Optional[str] = Query(None, description="Search in name, color, chip, features, description"),
+) -> Dict[str, Any]:
+    """Filtros de catálogo compartidos por los endpoints de listado"""
+    return {
+        'category': category,
+        'model': model,
+        'type': type,
+        'condition': condition,
+        'min_battery': min_battery,
+        'max_battery': max_battery,
+        'min_price_ars': min_price_ars,
+        'max_price_ars': max_price_ars,
+        'min_price_usd': min_price_usd,
+        'max_price_usd': max_price_usd,
+        'available': available,
+        'search': search,
+    }
+
+@api_router.get("/products", response_model=List[Product])
+async def get_products(
+    request: Request,
+    filters: Dict[str, Any] = Depends(product_filters),
+    fields: Optional[Tuple[str, ...]] = Depends(product_fields),
+    sort: Optional[str] = Query(None, pattern=SORT_PATTERN, description="Sort order: relevance (requires search), price_usd, -price_usd, battery_health, -created_at, name"),
     limit: int = Query(50, ge=1, le=100, description="Number of products to return"),
-    offset: int = Query(0, ge=0, description="Number of products to skip")
+    offset: int = Query(0, ge=0, description="Number of products to skip"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor, replaces offset"),
+    count: str = Query('exact', pattern="^(exact|estimated|none)$", description="X-Total-Count mode: exact, estimated or none")
 ):
     """Get all products with optional filtering"""
     
-    # Usar base de datos simulada
-    products = await db.get_products()
+    cache_key = canonical_key(request)
+    cached = response_cache.get(cache_key)
+    if cached:
+        return cached_response(request, cached)
+    generation = response_cache.generation
     
-    # Apply filters
-    if category:
-        products = [p for p in products if p.get('category') == category]
-    if model:
-        products = [p for p in products if p.get('model') == model]
-    if type:
-        products = [p for p in products if p.get('type') == type]
-    if condition:
-        products = [p for p in products if p.get('condition') == condition]
-    if min_battery is not None:
-        products = [p for p in products if p.get('battery_health', 0) >= min_battery]
-    if max_price_ars is not None:
-        products = [p for p in products if p.get('price_ars', float('inf')) <= max_price_ars]
-    if max_price_usd is not None:
-        products = [p for p in products if p.get('price_usd', float('inf')) <= max_price_usd]
-    if available is not None:
-        products = [p for p in products if p.get('available') == available]
-    if search:
-        search_lower = search.lower()
-        products = [p for p in products if 
-                   search_lower in p.get('name', '').lower() or
-                   search_lower in p.get('color', '').lower() or
-                   search_lower in p.get('chip', '').lower() or
-                   any(search_lower in feature.lower() for feature in p.get('features', []))]
+    if cursor and offset:
+        raise HTTPException(status_code=400, detail="Use either cursor or offset, not both")
+    if cursor and sort == 'relevance':
+        raise HTTPException(status_code=400, detail="Cursor pagination is not available for sort=relevance")
+    
+    try:
+        if catalog.loaded:
+            page = catalog.query(filters, skip=offset, limit=limit, sort=sort, cursor=cursor, count=count)
+        else:
+            # Filtrado, paginación y conteo se resuelven en MongoDB
+            page = await db.find_products(filters, skip=offset, limit=limit, sort=sort, cursor=cursor, count=count, fields=fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Apply pagination
-    total = len(products)
-    products = products[offset:offset + limit]
+    headers = {}
+    if page.total is not None:
+        headers['X-Total-Count'] = str(page.total)
+    if page.next_cursor:
+        headers['X-Next-Cursor'] = page.next_cursor
     
-    return products
+    body = product_encoder_for(fields).encode_many(page.items)
+    return cached_response(request, response_cache.put(cache_key, body, headers, generation))
+
+@api_router.get("/products/export")
+async def export_products(
+    filters: Dict[str, Any] = Depends(product_filters),
+    fields: Optional[Tuple[str, ...]] = Depends(product_fields),
+    format: str = Query('ndjson', pattern="^(ndjson|csv)$", description="Export format: ndjson or csv")
+):
+    """Stream the filtered catalog as NDJSON or CSV straight from a MongoDB cursor"""
+    products = db.iter_products(filters, batch_size=EXPORT_BATCH_SIZE, fields=fields)
+    if format == 'csv':
+        body = export_csv(products, fields or tuple(Product.model_fields))
+    else:
+        body = export_ndjson(products, product_encoder_for(fields))
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[format],
+        headers={'Content-Disposition': f'attachment; filename="products.{format}"'}
+    )
+
+@api_router.get("/products/facets")
+async def get_product_facets(filters: Dict[str, Any] = Depends(product_filters)):
+    """Count products per category/model/type/condition/storage/color for the given filters"""
+    facets = facet_cache.get(filters)
+    if facets is None:
+        generation = facet_cache.generation
+        if catalog.loaded:
+            facets = catalog.facets(filters)
+        else:
+            facets = await db.get_product_facets(filters)
+        facet_cache.put(filters, facets, generation)
+    return facets
+
+@api_router.post("/products/batch-get", response_model=List[Optional[Product]])
+async def batch_get_products(batch: ProductBatchGet, fields: Optional[Tuple[str, ...]] = Depends(product_fields)):
+    """Get several products by ID in request order, with null for IDs that were not found"""
+    if catalog.loaded:
+        products = [catalog.get(product_id) for product_id in batch.ids]
+    else:
+        found = await db.get_products_by_ids(batch.ids, fields) if batch.ids else {}
+        products = [found.get(product_id) for product_id in batch.ids]
+    return Response(content=product_encoder_for(fields).encode_many(products), media_type='application/json')
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
+async def get_product(product_id: str, request: Request, fields: Optional[Tuple[str, ...]] = Depends(product_fields)):
     """Get a specific product by ID"""
     
-    # Usar base de datos simulada
-    product = await db.get_product(product_id)
+    cache_key = canonical_key(request)
+    cached = response_cache.get(cache_key)
+    if cached:
+        return cached_response(request, cached)
+    generation = response_cache.generation
+    
+    product = catalog.get(product_id) if catalog.loaded else await db.get_product(product_id, fields)
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    return Product(**product)
+    body = product_encoder_for(fields).encode(product)
+    return cached_response(request, response_cache.put(cache_key, body, generation=generation))
 
 @api_router.put("/products/{product_id}", response_model=Product)
 async def update_product_duplicate(product_id: str, product_update: ProductUpdate):
@@ -300,16 +524,27 @@ async def delete_product_duplicate(product_id: str):
     pass
 
 
+# Live events (SSE)
+@api_router.get("/events", include_in_schema=False)
+async def stream_events(request: Request, last_event_id: Optional[str] = Query(None, description="Resume after this event id (same as the Last-Event-ID header)")):
+    """Server-Sent Events: rates.updated, product.created/updated/deleted, catalog.reloaded"""
+    resume_from = parse_event_id(request.headers.get('last-event-id') or last_event_id)
+    return StreamingResponse(
+        event_stream(event_broker, resume_from, heartbeat=SSE_HEARTBEAT_SECONDS),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 # Exchange Rates Route
 @api_router.get("/exchange-rates", response_model=ExchangeRates)
 async def get_exchange_rates():
-    """Get current exchange rates from MongoDB database"""
+    """Get current exchange rates (in-memory cache backed by MongoDB)"""
     try:
-        # Obtener tasas desde MongoDB
-        rates_data = await db.get_exchange_rates()
+        # Las tasas se sirven desde memoria; MongoDB solo se consulta al vencer el TTL
+        rates = await rates_cache.get(db)
         
-        if rates_data and 'rates' in rates_data:
-            rates = rates_data['rates']
+        if rates:
             return ExchangeRates(
                 usd=rates.get('USD', 1.0),
                 ars=rates.get('ARS', 1000.0),
@@ -338,30 +573,44 @@ async def get_exchange_rates():
             eth=1/3000
         )
 
+@api_router.get("/exchange-rates/history")
+async def get_exchange_rate_history(
+    currency: str = Query('ARS', pattern="^[A-Za-z]{3,5}$", description="Currency code, e.g. ARS"),
+    start: Optional[datetime] = Query(None, alias="from", description="Start of the range (ISO 8601, default: 24h before `to`)"),
+    end: Optional[datetime] = Query(None, alias="to", description="End of the range (ISO 8601, default: now)"),
+    resolution: Optional[str] = Query(None, pattern="^(" + "|".join(TIERS) + ")$", description="raw, 5m or 1h (default: finest available for the range)")
+):
+    """Exchange rate time series for one currency"""
+    now = datetime.now(timezone.utc)
+    end = as_utc(end) if end else now
+    start = as_utc(start) if start else end - timedelta(hours=24)
+    if start > end:
+        raise HTTPException(status_code=400, detail="`from` must be before `to`")
+    
+    resolution = resolution or choose_resolution(start, now)
+    currency = currency.upper()
+    points = await db.get_rate_history(currency, start, end, resolution)
+    return {'currency': currency, 'resolution': resolution, 'from': start, 'to': end, 'points': points}
+
 @api_router.post("/login", response_model=Token)
 async def login(request: LoginRequest):
     try:
-        response = requests.get(USERS_URL)
-        response.raise_for_status()
-        users = response.json()
-        
-        user = next((u for u in users if u["username"] == request.username and u["password"] == request.password), None)
-        
-        if not user:
-            raise HTTPException(status_code=401, detail="Credenciales inválidas")
+        user = await user_directory.authenticate(request.username, request.password)
+    except RuntimeError:
+        # Nunca se pudo cargar el directorio (fuente caída desde el arranque)
+        raise HTTPException(status_code=503, detail="Directorio de usuarios no disponible")
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Credenciales inválidas")
+    
+    if not user.get("isActive", True):
+        raise HTTPException(status_code=403, detail="Usuario inactivo")
         
-        if not user.get("isActive", True):
-            raise HTTPException(status_code=403, detail="Usuario inactivo")
-            
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user["username"]}, expires_delta=access_token_expires
-        )
-        return {"access_token": access_token, "token_type": "bearer"}
-    except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
-        raise HTTPException(status_code=500, detail=str(e))
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user["username"]}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -369,11 +618,21 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # jti: identificador para poder revocar el token en /api/logout
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-@api_router.post("/exchange-rates")
+@api_router.post("/logout")
+async def logout(claims: Dict[str, Any] = Depends(require_admin)):
+    """Revocar el token actual hasta su vencimiento"""
+    if claims.get("jti"):
+        token_verifier.revoke(claims["jti"], claims["exp"])
+        # Los demás workers tienen su propio verificador
+        invalidation_bus.publish('auth', claims["jti"], 'revoked', {'exp': claims["exp"]})
+    return {"message": "Logged out"}
+
+@api_router.post("/exchange-rates", dependencies=[Depends(require_admin)])
 async def update_exchange_rates(rates: Dict[str, float]):
     """Update exchange rates in MongoDB database"""
     try:
@@ -381,6 +640,9 @@ async def update_exchange_rates(rates: Dict[str, float]):
         success = await db.update_exchange_rates(rates)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to update exchange rates")
+        rates_cache.set(rates)
+        invalidation_bus.publish('rates')
+        event_broker.publish('rates.updated', {'rates': rates, 'timestamp': datetime.now(timezone.utc)})
         return {"message": "Exchange rates updated successfully"}
     except Exception as e:
         logger.error(f"Error updating exchange rates: {e}")
@@ -399,8 +661,12 @@ app.add_middleware(
     ],
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag"],
 )
 
+# Compresión brotli/gzip en la app: en Render uvicorn atiende sin nginx adelante
+app.add_middleware(CompressionMiddleware, cache=variant_cache)
+
 # Include the router in the main app
 app.include_router(api_router)
 
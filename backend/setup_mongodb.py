@@ -37,6 +37,7 @@ async def setup():
     from exchange_rates_service import exchange_service
     
     success = await exchange_service.update_exchange_rates()
+    await exchange_service.aclose()
     if success:
         print("✅ Tasas de cambio actualizadas")
     else:
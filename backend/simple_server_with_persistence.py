@@ -1,12 +1,13 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Literal, Optional
+import asyncio
 import uuid
-import json
 import os
 from datetime import datetime, timezone
+from product_journal import ProductJournal
 
 # Simple data models
 class Product(BaseModel):
@@ -69,82 +70,88 @@ class ProductUpdate(BaseModel):
     description: Optional[str] = None
     image_url: Optional[str] = None
 
-# File-based persistence
+class BulkOperation(BaseModel):
+    op: Literal['insert', 'update', 'delete']
+    id: Optional[str] = None
+    product: Optional[ProductCreate] = None
+    changes: Optional[ProductUpdate] = None
+
+class ProductBulkRequest(BaseModel):
+    operations: List[BulkOperation] = Field(..., max_length=5000)
+
+# File-based persistence: snapshot + append-only journal (see product_journal.py)
 DATA_FILE = "products_data.json"
+JOURNAL_DIR = "products_data_journal"
+JOURNAL_COMPACT_EVERY = int(os.environ.get("JOURNAL_COMPACT_EVERY", 1000))
 UPLOAD_DIR = "uploads"
 
 # Ensure directories exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+journal = ProductJournal(DATA_FILE, JOURNAL_DIR, compact_every=JOURNAL_COMPACT_EVERY)
+
 def load_products():
-    """Load products from JSON file"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Convert string dates back to datetime objects
-                for product in data:
-                    product['created_at'] = datetime.fromisoformat(product['created_at'])
-                    product['updated_at'] = datetime.fromisoformat(product['updated_at'])
-                return data
-        except Exception as e:
-            print(f"Error loading products: {e}")
-    return []
-
-def save_products():
-    """Save products to JSON file"""
+    """Load products from the snapshot and replay the journal on top of it"""
+    products = {}
     try:
-        # Convert datetime objects to strings for JSON serialization
-        products_data = []
-        for product in products_db:
-            product_dict = product.model_dump()
-            product_dict['created_at'] = product.created_at.isoformat()
-            product_dict['updated_at'] = product.updated_at.isoformat()
-            products_data.append(product_dict)
-        
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(products_data, f, indent=2, ensure_ascii=False)
-        return True
+        for data in journal.load():
+            product = Product(**data)
+            products[product.id] = product
     except Exception as e:
-        print(f"Error saving products: {e}")
-        return False
+        # Starting empty would let the next compaction overwrite the snapshot
+        print(f"Error loading products: {e}")
+        raise
+    return products
 
-# In-memory database
-products_db = []
+async def save_product(product: Product):
+    """Append the product to the journal; returns once it is on disk"""
+    await journal.put(product.id, product.model_dump(mode='json'))
 
-# Load existing products
+# In-memory database, keyed by product ID
 products_db = load_products()
 
-# If no products exist, create initial product
-if not products_db:
-    initial_product = Product(
-        id=str(uuid.uuid4()),
-        name="iPhone 16 Pro Max",
-        model="16",
-        type="pro-max",
-        storage="256GB",
-        color="Plateado",
-        condition="excellent",
-        battery_health=90,
-        price_ars=1500000,
-        price_usd=1500,
-        screen_size="6.7\" Super Retina XDR",
-        chip="A18 Pro",
-        camera="48MP Principal + 12MP Ultra Gran Angular + 12MP Teleobjetivo",
-        features=["5G", "ProMotion 120Hz", "Dynamic Island", "Action Button", "Titanium"],
-        available=True,
-        warranty_months=6,
-        description="iPhone 16 Pro Max en color plateado con 90% de batería. Excelente estado, cámara profesional y chip A18 Pro de última generación.",
-        image_url="https://store.storeimages.cdn-apple.com/4982/as-images.apple.com/is/iphone-16-pro-max-finish-select-202409-6-7inch-silver?wid=5120&hei=2880",
-        created_at=datetime.now(timezone.utc),
-        updated_at=datetime.now(timezone.utc)
-    )
-    products_db.append(initial_product)
-    save_products()
+# Held from reading products_db until the journal write is applied, so concurrent
+# writes on the same product can't interleave across the await
+write_lock = asyncio.Lock()
 
 # Create FastAPI app
 app = FastAPI()
 
+@app.on_event("startup")
+async def startup_event():
+    await journal.start()
+    # If no products exist, create initial product
+    if not products_db:
+        initial_product = Product(
+            id=str(uuid.uuid4()),
+            name="iPhone 16 Pro Max",
+            model="16",
+            type="pro-max",
+            storage="256GB",
+            color="Plateado",
+            condition="excellent",
+            battery_health=90,
+            price_ars=1500000,
+            price_usd=1500,
+            screen_size="6.7\" Super Retina XDR",
+            chip="A18 Pro",
+            camera="48MP Principal + 12MP Ultra Gran Angular + 12MP Teleobjetivo",
+            features=["5G", "ProMotion 120Hz", "Dynamic Island", "Action Button", "Titanium"],
+            available=True,
+            warranty_months=6,
+            description="iPhone 16 Pro Max en color plateado con 90% de batería. Excelente estado, cámara profesional y chip A18 Pro de última generación.",
+            image_url="https://store.storeimages.cdn-apple.com/4982/as-images.apple.com/is/iphone-16-pro-max-finish-select-202409-6-7inch-silver?wid=5120&hei=2880",
+            created_at=datetime.now(timezone.utc),
+            updated_at=datetime.now(timezone.utc)
+        )
+        products_db[initial_product.id] = initial_product
+        await save_product(initial_product)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Flush pending journal writes
+    await journal.stop()
+
 # Serve uploaded files
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
@@ -165,16 +172,13 @@ async def root():
 # Get all products
 @app.get("/api/products", response_model=List[Product])
 async def get_products():
-    return products_db
+    return list(products_db.values())
 
 # Get product by ID
 @app.get("/api/products/{product_id}", response_model=Product)
 async def get_product(product_id: str):
-    for product in products_db:
-        # Handle both dict and Product objects
-        current_product_id = product.id if hasattr(product, 'id') else product.get('id')
-        if current_product_id == product_id:
-            return product
+    if product_id in products_db:
+        return products_db[product_id]
     raise HTTPException(status_code=404, detail="Product not found")
 
 # Upload image endpoint
@@ -211,43 +215,87 @@ async def create_product(product: ProductCreate):
         created_at=datetime.now(timezone.utc),
         updated_at=datetime.now(timezone.utc)
     )
-    products_db.append(new_product)
-    save_products()  # Auto-save
+    async with write_lock:
+        await save_product(new_product)  # Auto-save
+        products_db[new_product.id] = new_product
     return new_product
 
+def apply_update(product: Product, product_update: ProductUpdate) -> Product:
+    """Validated copy of the product; the stored one changes only after the journal write"""
+    update_data = product_update.model_dump(exclude_unset=True)
+    update_data['updated_at'] = datetime.now(timezone.utc)
+    # model_copy doesn't validate: an explicit null would be journaled and break the next startup
+    return Product.model_validate({**product.model_dump(), **update_data})
+
 # Update product
 @app.put("/api/products/{product_id}", response_model=Product)
 async def update_product(product_id: str, product_update: ProductUpdate):
-    for i, product in enumerate(products_db):
-        # Handle both dict and Product objects
-        current_product_id = product.id if hasattr(product, 'id') else product.get('id')
-        if current_product_id == product_id:
-            update_data = product_update.model_dump(exclude_unset=True)
-            for key, value in update_data.items():
-                if hasattr(product, key):
-                    setattr(products_db[i], key, value)
-                else:
-                    products_db[i][key] = value
-            # Update timestamp
-            if hasattr(products_db[i], 'updated_at'):
-                products_db[i].updated_at = datetime.now(timezone.utc)
-            else:
-                products_db[i]['updated_at'] = datetime.now(timezone.utc)
-            save_products()  # Auto-save
-            return products_db[i]
-    raise HTTPException(status_code=404, detail="Product not found")
+    async with write_lock:
+        if product_id not in products_db:
+            raise HTTPException(status_code=404, detail="Product not found")
+        try:
+            updated_product = apply_update(products_db[product_id], product_update)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+        await save_product(updated_product)  # Auto-save
+        products_db[product_id] = updated_product
+    return updated_product
 
 # Delete product
 @app.delete("/api/products/{product_id}")
 async def delete_product(product_id: str):
-    for i, product in enumerate(products_db):
-        # Handle both dict and Product objects
-        current_product_id = product.id if hasattr(product, 'id') else product.get('id')
-        if current_product_id == product_id:
-            del products_db[i]
-            save_products()  # Auto-save
-            return {"message": f"Product {product_id} deleted successfully"}
-    raise HTTPException(status_code=404, detail="Product not found")
+    async with write_lock:
+        if product_id not in products_db:
+            raise HTTPException(status_code=404, detail="Product not found")
+        await journal.delete(product_id)  # Auto-save
+        products_db.pop(product_id, None)
+    return {"message": f"Product {product_id} deleted successfully"}
+
+# Bulk insert/update/delete: one journal record per operation, written with a single fsync
+@app.post("/api/products/bulk")
+async def bulk_products(bulk: ProductBulkRequest):
+    async with write_lock:
+        return await apply_bulk(bulk)
+
+async def apply_bulk(bulk: ProductBulkRequest):
+    changes = {}  # product ID -> Product, or None when deleted
+    results = []
+    now = datetime.now(timezone.utc)
+    for operation in bulk.operations:
+        if operation.op == 'insert':
+            product = Product(id=str(uuid.uuid4()), **(operation.product or ProductCreate()).model_dump(), created_at=now, updated_at=now)
+            changes[product.id] = product
+            results.append({'op': 'insert', 'id': product.id, 'status': 'ok'})
+            continue
+        # Later operations see the effect of earlier ones in the same request
+        current = changes[operation.id] if operation.id in changes else products_db.get(operation.id)
+        if current is None:
+            results.append({'op': operation.op, 'id': operation.id, 'status': 'not_found'})
+        elif operation.op == 'update':
+            try:
+                changes[operation.id] = apply_update(current, operation.changes or ProductUpdate())
+            except ValidationError as e:
+                results.append({'op': 'update', 'id': operation.id, 'status': 'invalid', 'error': str(e)})
+                continue
+            results.append({'op': 'update', 'id': operation.id, 'status': 'ok'})
+        else:
+            changes[operation.id] = None
+            results.append({'op': 'delete', 'id': operation.id, 'status': 'ok'})
+
+    await journal.write_many([
+        ('put', product_id, product.model_dump(mode='json')) if product is not None else ('delete', product_id, None)
+        for product_id, product in changes.items()
+    ])
+    for product_id, product in changes.items():
+        if product is None:
+            products_db.pop(product_id, None)
+        else:
+            products_db[product_id] = product
+
+    summary = {'ok': 0, 'not_found': 0, 'invalid': 0}
+    for result in results:
+        summary[result['status']] += 1
+    return {'summary': summary, 'results': results}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,747 @@
+"""
+Base de datos SQLite para Mathi Phone
+Alternativa a MongoDB para tiendas chicas y CI: cada producto se guarda como documento JSON
+con columnas generadas e indexadas para filtros, órdenes y facetas, y búsqueda con FTS5.
+Modo WAL: las lecturas corren en paralelo en un pool de threads (una conexión por thread)
+y las escrituras en un único thread escritor, sin esperas por bloqueos
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from facets import FACET_FIELDS, sorted_counts
+from rate_history import MAX_HISTORY_POINTS, TIERS, as_utc, bucket_start, history_point
+from product_query import (
+    DEFAULT_SORT, EQUALITY_FILTERS, RANGE_FILTERS, SORT_OPTIONS, ProductPage, decode_cursor, encode_cursor, normalize_filters
+)
+from search_index import FIELD_WEIGHTS, parse_query, stem, tokenize
+
+# Campos del documento expuestos como columnas generadas: filtros, órdenes, facetas y clave natural
+INDEXED_FIELDS = (
+    'id', 'name', 'category', 'model', 'type', 'storage', 'color', 'condition',
+    'available', 'battery_health', 'price_ars', 'price_usd',
+)
+DATETIME_FIELDS = ('created_at', 'updated_at')
+
+_GENERATED_COLUMNS = ', '.join(
+    f"\"{field}\" GENERATED ALWAYS AS (json_extract(doc, '$.{field}')) VIRTUAL" for field in INDEXED_FIELDS
+)
+
+SCHEMA = [
+    # oid: ObjectId en hexadecimal, orden de inserción y desempate de cursores como _id en MongoDB
+    f"""CREATE TABLE IF NOT EXISTS products (oid TEXT NOT NULL UNIQUE, doc TEXT NOT NULL, {_GENERATED_COLUMNS})""",
+    # Texto ya plegado y con stemming (search_index), con los pesos de FIELD_WEIGHTS en bm25
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5({', '.join(FIELD_WEIGHTS)}, tokenize='unicode61')""",
+    """CREATE TABLE IF NOT EXISTS exchange_rates (
+        singleton INTEGER PRIMARY KEY CHECK (singleton = 1),
+        rates TEXT NOT NULL,
+        last_updated TEXT NOT NULL,
+        source TEXT
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS {TIERS['raw'].collection} (ts TEXT NOT NULL, currency TEXT NOT NULL, value REAL NOT NULL)""",
+    *(
+        f"""CREATE TABLE IF NOT EXISTS {tier.collection} (
+            bucket TEXT NOT NULL, currency TEXT NOT NULL,
+            "min" REAL, "max" REAL, "sum" REAL, "count" INTEGER, "close" REAL,
+            PRIMARY KEY (currency, bucket)
+        )"""
+        for tier in TIERS.values() if tier.bucket is not None
+    ),
+    """CREATE TABLE IF NOT EXISTS status_checks (doc TEXT NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, doc TEXT NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, renewed_at REAL NOT NULL)""",
+]
+
+# Mismos índices que db_indexes declara para MongoDB, con el oid como desempate de los cursores
+INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS id_unique ON products ("id")',
+    'CREATE INDEX IF NOT EXISTS category ON products (category, oid)',
+    'CREATE INDEX IF NOT EXISTS model_type ON products (model, type)',
+    'CREATE INDEX IF NOT EXISTS condition ON products (condition)',
+    'CREATE INDEX IF NOT EXISTS available ON products (available)',
+    'CREATE INDEX IF NOT EXISTS natural_key ON products (name, model, storage, color, condition)',
+    'CREATE INDEX IF NOT EXISTS price_usd_sort ON products (price_usd, oid)',
+    'CREATE INDEX IF NOT EXISTS price_ars_sort ON products (price_ars, oid)',
+    'CREATE INDEX IF NOT EXISTS battery_health_sort ON products (battery_health, oid)',
+    'CREATE INDEX IF NOT EXISTS name_sort ON products (name, oid)',
+    f"CREATE INDEX IF NOT EXISTS raw_currency_ts ON {TIERS['raw'].collection} (currency, ts)",
+    f"CREATE INDEX IF NOT EXISTS raw_ts ON {TIERS['raw'].collection} (ts)",
+    *(f"CREATE INDEX IF NOT EXISTS {tier.collection}_bucket ON {tier.collection} (bucket)" for tier in TIERS.values() if tier.bucket is not None),
+]
+
+
+def _timestamp(moment: datetime) -> str:
+    """Fecha UTC de ancho fijo: el orden de texto coincide con el cronológico"""
+    return as_utc(moment).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _parse_timestamp(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+
+
+def _dumps(document: Dict[str, Any]) -> str:
+    return json.dumps(
+        {key: value for key, value in document.items() if key != '_id'},
+        default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value),
+        ensure_ascii=False,
+        separators=(',', ':')
+    )
+
+
+def _loads(text: str) -> Dict[str, Any]:
+    document = json.loads(text)
+    for field in DATETIME_FIELDS:
+        if isinstance(document.get(field), str):
+            try:
+                document[field] = datetime.fromisoformat(document[field])
+            except ValueError:
+                pass
+    return document
+
+
+def _project(document: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return document
+    return {field: document[field] for field in fields if field in document}
+
+
+def _sql_value(value: Any) -> Any:
+    """json_extract devuelve los booleanos como 1/0"""
+    return int(value) if isinstance(value, bool) else value
+
+
+def _column(field: str) -> str:
+    return f'p."{field}"' if field in INDEXED_FIELDS else f"json_extract(p.doc, '$.{field}')"
+
+
+def _fts_text(product: Dict[str, Any]) -> List[str]:
+    """Texto de cada campo buscable con la misma tokenización que el catálogo en memoria"""
+    texts = []
+    for field in FIELD_WEIGHTS:
+        value = product.get(field)
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(str(item) for item in value)
+        texts.append(' '.join(stem(token) for token in tokenize(str(value))) if value else '')
+    return texts
+
+
+def match_query(search: str) -> Optional[str]:
+    """Consulta FTS5 con todos los términos y el último también como prefijo (parse_query),
+    o None si no queda ninguno"""
+    terms, last = parse_query(search)
+    if last is None:
+        return None
+    clauses = [f'"{term}"' for term in dict.fromkeys(terms)]
+    clauses.append(f'("{stem(last)}" OR "{last}"*)')
+    return ' AND '.join(clauses)
+
+
+def _where(filters: Optional[Dict[str, Any]]) -> Tuple[str, List[str], List[Any]]:
+    """JOIN, condiciones y parámetros SQL para los filtros de /api/products"""
+    filters = normalize_filters(filters)
+    join, clauses, params = '', [], []
+    for param, field in EQUALITY_FILTERS.items():
+        if param in filters:
+            clauses.append(f'{_column(field)} = ?')
+            params.append(_sql_value(filters[param]))
+    for param, (field, operator) in RANGE_FILTERS.items():
+        if param in filters:
+            clauses.append(f"{_column(field)} {'>=' if operator == '$gte' else '<='} ?")
+            params.append(filters[param])
+    if 'search' in filters:
+        query = match_query(filters['search'])
+        if query is None:
+            clauses.append('0')
+        else:
+            join = 'JOIN products_fts ON products_fts.rowid = p.rowid'
+            clauses.append('products_fts MATCH ?')
+            params.append(query)
+    return join, clauses, params
+
+
+def _cursor_clause(sort: Optional[str], cursor: str) -> Tuple[str, List[Any]]:
+    """Condición por rango para continuar después del cursor, en el orden de SQLite (NULL primero)"""
+    key, oid = decode_cursor(cursor, sort)
+    field, direction = SORT_OPTIONS.get(sort, DEFAULT_SORT)
+    operator = '>' if direction > 0 else '<'
+    if field == '_id':
+        return f'p.oid {operator} ?', [oid]
+    column = _column(field)
+    if key is None:
+        if direction > 0:
+            return f'({column} IS NOT NULL OR p.oid > ?)', [oid]
+        return f'({column} IS NULL AND p.oid < ?)', [oid]
+    clause = f'({column} {operator} ? OR ({column} = ? AND p.oid {operator} ?)'
+    # En orden descendente los NULL quedan al final
+    clause += f' OR {column} IS NULL)' if direction < 0 else ')'
+    return clause, [key, key, oid]
+
+
+def _order_by(sort: Optional[str], join: str) -> str:
+    if sort == 'relevance' and join:
+        return f"bm25(products_fts, {', '.join(str(weight) for weight in FIELD_WEIGHTS.values())}), p.oid"
+    field, direction = SORT_OPTIONS.get(sort, DEFAULT_SORT)
+    keyword = 'ASC' if direction > 0 else 'DESC'
+    if field == '_id':
+        return f'p.oid {keyword}'
+    return f'{_column(field)} {keyword}, p.oid {keyword}'
+
+
+class SQLiteDatabase:
+    def __init__(self, path: Optional[str] = None, read_workers: int = 4):
+        self.path = path or os.environ.get('SQLITE_PATH', 'mathi_phone.db')
+        self.read_workers = read_workers
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._readers: Optional[ThreadPoolExecutor] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+
+    # Conexiones y ejecución en threads
+
+    def _connection(self) -> sqlite3.Connection:
+        """Conexión del thread actual (cada thread del pool abre la suya una sola vez)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA busy_timeout=5000')
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    async def _read(self, function: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, lambda: function(self._connection(), *args))
+
+    async def _write(self, function: Callable, *args) -> Any:
+        """Ejecutar `function` en una transacción del thread escritor"""
+        def run():
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(connection, *args)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            return result
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, run)
+
+    async def connect(self, ensure_indexes: bool = True):
+        """Abrir la base (se crea si no existe) con su esquema e índices"""
+        try:
+            self._readers = ThreadPoolExecutor(max_workers=self.read_workers, thread_name_prefix='sqlite-read')
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-write')
+            statements = SCHEMA + (INDEXES if ensure_indexes else [])
+            await self._write(lambda connection: [connection.execute(statement) for statement in statements])
+            print(f"✅ Connected to SQLite at {self.path}")
+
+        except Exception as e:
+            print(f"❌ Failed to open SQLite database: {e}")
+            raise
+
+    async def disconnect(self):
+        """Cerrar las conexiones y los pools de threads"""
+        for executor in (self._readers, self._writer):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._readers = self._writer = None
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # Productos: lecturas
+
+    @staticmethod
+    def _row_to_product(oid: str, doc: str, include_oid: bool) -> Dict[str, Any]:
+        product = _loads(doc)
+        if include_oid:
+            product['_id'] = ObjectId(oid)
+        return product
+
+    def _select(
+        self,
+        connection: sqlite3.Connection,
+        filters: Optional[Dict[str, Any]],
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 0,
+        after_oid: Optional[str] = None
+    ) -> List[Tuple[str, str]]:
+        join, clauses, params = _where(filters)
+        if cursor:
+            clause, cursor_params = _cursor_clause(sort, cursor)
+            clauses.append(clause)
+            params.extend(cursor_params)
+        if after_oid:
+            clauses.append('p.oid > ?')
+            params.append(after_oid)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        sql = (
+            f"SELECT p.oid, p.doc FROM products p {join} {where} "
+            f"ORDER BY {_order_by(sort, join)} LIMIT ? OFFSET ?"
+        )
+        return connection.execute(sql, [*params, limit or -1, skip]).fetchall()
+
+    def _count(self, connection: sqlite3.Connection, filters: Optional[Dict[str, Any]], estimated: bool = False) -> int:
+        if estimated:
+            return connection.execute('SELECT count(*) FROM products').fetchone()[0]
+        join, clauses, params = _where(filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return connection.execute(f'SELECT count(*) FROM products p {join} {where}', params).fetchone()[0]
+
+    async def get_products(
+        self,
+        filters: Dict[str, Any] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        include_oid: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Obtener una página de productos con filtros opcionales"""
+        try:
+            rows = await self._read(self._select, filters, sort, cursor, skip, limit)
+            return [self._row_to_product(oid, doc, include_oid) for oid, doc in rows]
+
+        except Exception as e:
+            print(f"❌ Error getting products: {e}")
+            return []
+
+    async def count_products(self, filters: Dict[str, Any] = None, estimated: bool = False) -> int:
+        """Contar los productos que cumplen los filtros (estimated=True ignora los filtros)"""
+        try:
+            return await self._read(self._count, filters, estimated)
+
+        except Exception as e:
+            print(f"❌ Error counting products: {e}")
+            return 0
+
+    async def find_products(
+        self,
+        filters: Dict[str, Any] = None,
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        count: str = 'exact',
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> ProductPage:
+        """Obtener una página de productos, el total y el cursor de la página siguiente"""
+        if cursor:
+            decode_cursor(cursor, sort)  # ValueError antes de consultar si el cursor es inválido
+
+        def page(connection):
+            rows = self._select(connection, filters, sort, cursor, skip, limit + 1 if limit else 0)
+            total = None if count == 'none' else self._count(connection, filters, estimated=count == 'estimated')
+            return rows, total
+
+        try:
+            rows, total = await self._read(page)
+        except sqlite3.Error as e:
+            print(f"❌ Error getting products: {e}")
+            rows, total = [], None if count == 'none' else 0
+
+        products = [_loads(doc) for _, doc in rows]
+        next_cursor = None
+        if limit and len(products) > limit:
+            products = products[:limit]
+            if sort != 'relevance':
+                field = SORT_OPTIONS.get(sort, DEFAULT_SORT)[0]
+                next_cursor = encode_cursor(sort, products[-1].get(field) if field != '_id' else None, rows[limit - 1][0])
+        return ProductPage([_project(product, fields) for product in products], total, next_cursor)
+
+    async def get_product_facets(self, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Conteo por valor de cada faceta, en una sola lectura"""
+        def facets(connection):
+            join, clauses, params = _where(filters)
+            result = {'total': self._count(connection, filters), 'facets': {}}
+            for field in FACET_FIELDS:
+                where = ' AND '.join([*clauses, f'{_column(field)} IS NOT NULL'])
+                rows = connection.execute(
+                    f'SELECT {_column(field)}, count(*) FROM products p {join} WHERE {where} GROUP BY 1', params
+                ).fetchall()
+                result['facets'][field] = sorted_counts(dict(rows))
+            return result
+
+        try:
+            return await self._read(facets)
+
+        except Exception as e:
+            print(f"❌ Error getting product facets: {e}")
+            return {'total': 0, 'facets': {field: {} for field in FACET_FIELDS}}
+
+    async def iter_products(
+        self,
+        filters: Dict[str, Any] = None,
+        batch_size: int = 1000,
+        include_oid: bool = False,
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Recorrer los productos en orden de inserción y en lotes, sin cargar toda la tabla"""
+        after_oid = None
+        while True:
+            rows = await self._read(self._select, filters, None, None, 0, batch_size, after_oid)
+            for oid, doc in rows:
+                product = _project(_loads(doc), fields)
+                if include_oid:
+                    product['_id'] = ObjectId(oid)
+                yield product
+            if len(rows) < batch_size:
+                return
+            after_oid = rows[-1][0]
+
+    async def get_product(
+        self,
+        product_id: str,
+        fields: Optional[Tuple[str, ...]] = None,
+        include_oid: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """Obtener un producto por ID, opcionalmente solo con `fields`; include_oid=True agrega `_id`"""
+        try:
+            row = await self._read(
+                lambda connection: connection.execute('SELECT oid, doc FROM products WHERE "id" = ?', (product_id,)).fetchone()
+            )
+            if row is None:
+                return None
+            product = _project(_loads(row[1]), fields)
+            if include_oid:
+                product['_id'] = ObjectId(row[0])
+            return product
+
+        except Exception as e:
+            print(f"❌ Error getting product {product_id}: {e}")
+            return None
+
+    async def get_products_by_ids(self, product_ids: List[str], fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Dict[str, Any]]:
+        """Obtener varios productos por ID en una sola consulta IN, indexados por ID"""
+        try:
+            ids = list(set(product_ids))
+            if not ids:
+                return {}
+            rows = await self._read(lambda connection: connection.execute(
+                f"SELECT doc FROM products WHERE \"id\" IN ({', '.join('?' * len(ids))})", ids
+            ).fetchall())
+            products = (_loads(doc) for doc, in rows)
+            return {product['id']: _project(product, fields) for product in products}
+
+        except Exception as e:
+            print(f"❌ Error getting products by id: {e}")
+            return {}
+
+    # Productos: escrituras (siempre dentro de una transacción del thread escritor)
+
+    @staticmethod
+    def _insert(connection: sqlite3.Connection, product: Dict[str, Any]) -> str:
+        """Insertar un documento; DuplicateKeyError si el ID ya existe, como en MongoDB"""
+        oid = str(ObjectId())
+        try:
+            cursor = connection.execute('INSERT INTO products (oid, doc) VALUES (?, ?)', (oid, _dumps(product)))
+        except sqlite3.IntegrityError:
+            raise DuplicateKeyError(f"E11000 duplicate key error index: id_unique dup key: {{ id: \"{product.get('id')}\" }}")
+        connection.execute(
+            f"INSERT INTO products_fts (rowid, {', '.join(FIELD_WEIGHTS)}) VALUES (?, {', '.join('?' * len(FIELD_WEIGHTS))})",
+            (cursor.lastrowid, *_fts_text(product))
+        )
+        return oid
+
+    @staticmethod
+    def _replace(connection: sqlite3.Connection, rowid: int, product: Dict[str, Any]):
+        connection.execute('UPDATE products SET doc = ? WHERE rowid = ?', (_dumps(product), rowid))
+        connection.execute('DELETE FROM products_fts WHERE rowid = ?', (rowid,))
+        connection.execute(
+            f"INSERT INTO products_fts (rowid, {', '.join(FIELD_WEIGHTS)}) VALUES (?, {', '.join('?' * len(FIELD_WEIGHTS))})",
+            (rowid, *_fts_text(product))
+        )
+
+    @staticmethod
+    def _remove(connection: sqlite3.Connection, product_id: str) -> bool:
+        row = connection.execute('SELECT rowid FROM products WHERE "id" = ?', (product_id,)).fetchone()
+        if row is None:
+            return False
+        connection.execute('DELETE FROM products_fts WHERE rowid = ?', row)
+        connection.execute('DELETE FROM products WHERE rowid = ?', row)
+        return True
+
+    def _merge(self, connection: sqlite3.Connection, product_id: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Aplicar `changes` sobre el documento (como $set) y devolverlo actualizado"""
+        row = connection.execute('SELECT rowid, doc FROM products WHERE "id" = ?', (product_id,)).fetchone()
+        if row is None:
+            return None
+        product = {**_loads(row[1]), **changes}
+        self._replace(connection, row[0], product)
+        return product
+
+    async def create_product(self, product_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Crear un nuevo producto"""
+        try:
+            new_product = {
+                "id": product_data.get('id', f"product_{datetime.now().timestamp()}"),
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc),
+                **product_data
+            }
+            new_product['_id'] = await self._write(self._insert, new_product)
+            return new_product
+
+        except DuplicateKeyError:
+            print(f"❌ Product with ID {product_data.get('id')} already exists")
+            raise
+        except Exception as e:
+            print(f"❌ Error creating product: {e}")
+            return None
+
+    async def update_product(self, product_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Actualizar un producto"""
+        try:
+            update_data['updated_at'] = datetime.now(timezone.utc)
+            return await self._write(self._merge, product_id, update_data)
+
+        except Exception as e:
+            print(f"❌ Error updating product {product_id}: {e}")
+            return None
+
+    async def delete_product(self, product_id: str) -> bool:
+        """Eliminar un producto"""
+        try:
+            return await self._write(self._remove, product_id)
+
+        except Exception as e:
+            print(f"❌ Error deleting product {product_id}: {e}")
+            return False
+
+    async def bulk_write_products(
+        self,
+        operations: List[Dict[str, Any]],
+        ordered: bool = True,
+        batch_size: int = 500
+    ) -> List[Dict[str, Any]]:
+        """Aplicar operaciones insert/update/delete en transacciones de `batch_size`
+
+        Mismo contrato que MongoDBDatabase.bulk_write_products: un resultado por operación.
+        """
+        now = datetime.now(timezone.utc)
+        results: List[Dict[str, Any]] = []
+
+        def apply(connection, batch):
+            stopped = False
+            for index, operation in batch:
+                op = operation['op']
+                product_id = operation.get('id')
+                result = {'index': index, 'op': op, 'id': product_id, 'status': 'ok'}
+                results.append(result)
+                if stopped:
+                    result['status'] = 'skipped'
+                    continue
+                try:
+                    if op == 'insert':
+                        product = {'id': str(uuid.uuid4()), 'created_at': now, 'updated_at': now, **operation['product']}
+                        result['id'] = product['id']
+                        self._insert(connection, product)
+                    elif op == 'update':
+                        if self._merge(connection, product_id, {**operation['changes'], 'updated_at': now}) is None:
+                            result['status'] = 'not_found'
+                    elif not self._remove(connection, product_id):
+                        result['status'] = 'not_found'
+                except (DuplicateKeyError, sqlite3.Error) as e:
+                    result['status'] = 'error'
+                    result['error'] = str(e)
+                    stopped = ordered
+            return stopped
+
+        indexed = list(enumerate(operations))
+        for start in range(0, len(indexed), batch_size):
+            batch = indexed[start:start + batch_size]
+            if ordered and any(result['status'] == 'error' for result in results):
+                results.extend({'index': index, 'op': operation['op'], 'id': operation.get('id'), 'status': 'skipped'} for index, operation in batch)
+                continue
+            try:
+                await self._write(apply, batch)
+            except Exception as e:
+                print(f"❌ Error in products bulk write: {e}")
+                del results[start:]
+                results.extend(
+                    {'index': index, 'op': operation['op'], 'id': operation.get('id'), 'status': 'error', 'error': str(e)}
+                    for index, operation in batch
+                )
+        return results
+
+    async def upsert_products_by_key(
+        self,
+        products: List[Dict[str, Any]],
+        key_fields: Sequence[str],
+        defaults: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Upsert por clave natural en una sola transacción
+
+        `defaults` completa los campos ausentes solo al insertar; filas repetidas del mismo
+        lote se colapsan en la última, como en MongoDB.
+        """
+        defaults = defaults or {}
+        now = datetime.now(timezone.utc)
+        by_key = {tuple(product.get(field) for field in key_fields): product for product in products}
+        summary = {'inserted': 0, 'updated': 0, 'duplicates': len(products) - len(by_key), 'errors': []}
+        condition = ' AND '.join(f'{_column(field)} IS ?' for field in key_fields)
+
+        def upsert(connection):
+            for key, product in by_key.items():
+                row = connection.execute(f'SELECT p.rowid, p.doc FROM products p WHERE {condition} LIMIT 1', key).fetchone()
+                try:
+                    if row is None:
+                        self._insert(connection, {**defaults, **product, 'updated_at': now, 'id': str(uuid.uuid4()), 'created_at': now})
+                        summary['inserted'] += 1
+                    else:
+                        self._replace(connection, row[0], {**_loads(row[1]), **product, 'updated_at': now})
+                        summary['updated'] += 1
+                except (DuplicateKeyError, sqlite3.Error) as e:
+                    summary['errors'].append(str(e))
+
+        await self._write(upsert)
+        return summary
+
+    # Tasas de cambio
+
+    async def get_exchange_rates(self) -> Optional[Dict[str, Any]]:
+        """Obtener tasas de cambio actuales"""
+        try:
+            row = await self._read(lambda connection: connection.execute(
+                'SELECT rates, last_updated, source FROM exchange_rates WHERE singleton = 1'
+            ).fetchone())
+            if row is None:
+                return None
+            return {'rates': json.loads(row[0]), 'last_updated': _parse_timestamp(row[1]), 'source': row[2]}
+
+        except Exception as e:
+            print(f"❌ Error getting exchange rates: {e}")
+            return None
+
+    async def update_exchange_rates(self, rates_data: Dict[str, Any]) -> bool:
+        """Actualizar tasas de cambio y agregarlas al historial, en una transacción"""
+        try:
+            now = datetime.now(timezone.utc)
+
+            def update(connection):
+                connection.execute(
+                    'INSERT INTO exchange_rates (singleton, rates, last_updated, source) VALUES (1, ?, ?, ?) '
+                    'ON CONFLICT (singleton) DO UPDATE SET rates = excluded.rates, '
+                    'last_updated = excluded.last_updated, source = excluded.source',
+                    (json.dumps(rates_data), _timestamp(now), 'api')
+                )
+                self._append_rate_history(connection, rates_data, now)
+
+            await self._write(update)
+            return True
+
+        except Exception as e:
+            print(f"❌ Error updating exchange rates: {e}")
+            return False
+
+    @staticmethod
+    def _append_rate_history(connection: sqlite3.Connection, rates_data: Dict[str, Any], moment: datetime):
+        """Muestra cruda, acumulación en buckets y descarte de lo vencido (lo que en MongoDB hacen los TTL)"""
+        rates = {currency: float(value) for currency, value in rates_data.items()}
+        for tier in TIERS.values():
+            if tier.bucket is None:
+                connection.executemany(
+                    f'INSERT INTO {tier.collection} (ts, currency, value) VALUES (?, ?, ?)',
+                    [(_timestamp(moment), currency, value) for currency, value in rates.items()]
+                )
+            else:
+                connection.executemany(
+                    f'INSERT INTO {tier.collection} (bucket, currency, "min", "max", "sum", "count", "close") '
+                    'VALUES (?, ?, ?, ?, ?, 1, ?) ON CONFLICT (currency, bucket) DO UPDATE SET '
+                    '"min" = min("min", excluded."min"), "max" = max("max", excluded."max"), '
+                    '"sum" = "sum" + excluded."sum", "count" = "count" + 1, "close" = excluded."close"',
+                    [
+                        (_timestamp(bucket_start(moment, tier.bucket)), currency, value, value, value, value)
+                        for currency, value in rates.items()
+                    ]
+                )
+            if tier.retention is not None:
+                time_column = 'ts' if tier.bucket is None else 'bucket'
+                connection.execute(
+                    f'DELETE FROM {tier.collection} WHERE {time_column} < ?', (_timestamp(moment - tier.retention),)
+                )
+
+    async def get_rate_history(self, currency: str, start: datetime, end: datetime, resolution: str) -> List[Dict[str, Any]]:
+        """Serie de una moneda entre start y end leyendo solo la resolución indicada"""
+        try:
+            tier = TIERS[resolution]
+            if tier.bucket is None:
+                sql = f'SELECT ts, value FROM {tier.collection} WHERE currency = ? AND ts BETWEEN ? AND ? ORDER BY ts DESC LIMIT ?'
+            else:
+                start = bucket_start(start, tier.bucket)  # incluir el bucket que contiene a start
+                sql = (
+                    f'SELECT bucket, "min", "max", "sum", "count", "close" FROM {tier.collection} '
+                    'WHERE currency = ? AND bucket BETWEEN ? AND ? ORDER BY bucket DESC LIMIT ?'
+                )
+            rows = await self._read(lambda connection: connection.execute(
+                sql, (currency, _timestamp(start), _timestamp(end), MAX_HISTORY_POINTS)
+            ).fetchall())
+
+            # Mismos documentos que en MongoDB, para compartir history_point
+            if tier.bucket is None:
+                documents = [{'ts': _parse_timestamp(ts), 'rates': {currency: value}} for ts, value in rows]
+            else:
+                documents = [
+                    {'bucket': _parse_timestamp(bucket), 'rates': {currency: {'min': low, 'max': high, 'sum': total, 'count': count, 'close': close}}}
+                    for bucket, low, high, total, count, close in rows
+                ]
+            return [history_point(document, currency) for document in reversed(documents)]
+
+        except Exception as e:
+            print(f"❌ Error getting exchange rate history: {e}")
+            return []
+
+    # Status checks y leases
+
+    async def add_status_check(self, status_check: Dict[str, Any]):
+        await self._write(lambda connection: connection.execute(
+            'INSERT INTO status_checks (doc) VALUES (?)', (_dumps(status_check),)
+        ))
+
+    async def get_status_checks(self, limit: int = 1000) -> List[Dict[str, Any]]:
+        rows = await self._read(lambda connection: connection.execute(
+            'SELECT doc FROM status_checks ORDER BY rowid LIMIT ?', (limit,)
+        ).fetchall())
+        return [json.loads(doc) for doc, in rows]
+
+    async def get_users(self) -> List[Dict[str, Any]]:
+        """Usuarios del panel (doc JSON con username y password_hash, como en MongoDB); los errores se propagan"""
+        rows = await self._read(lambda connection: connection.execute('SELECT doc FROM users ORDER BY username').fetchall())
+        return [json.loads(doc) for doc, in rows]
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Tomar o renovar el lease `name`; False si otro dueño lo tiene vigente"""
+        def acquire(connection):
+            now = time.time()
+            connection.execute(
+                'INSERT INTO leases (name, owner, expires_at, renewed_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, '
+                'renewed_at = excluded.renewed_at WHERE leases.owner = excluded.owner OR leases.expires_at < excluded.renewed_at',
+                (name, owner, now + ttl, now)
+            )
+            row = connection.execute('SELECT owner FROM leases WHERE name = ?', (name,)).fetchone()
+            return row is not None and row[0] == owner
+
+        return await self._write(acquire)
+
+    async def release_lease(self, name: str, owner: str):
+        await self._write(lambda connection: connection.execute(
+            'DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner)
+        ))
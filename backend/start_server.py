@@ -11,7 +11,8 @@ cmd = [
     sys.executable, '-m', 'uvicorn', 'server:app',
     '--host', '0.0.0.0',
     '--port', port,
-    '--workers', '1'
+    # Las tareas periódicas corren en un solo worker (leader.py), así que se puede escalar
+    '--workers', os.environ.get('WEB_CONCURRENCY', '1')
 ]
 
 print(f"Starting server with command: {' '.join(cmd)}")
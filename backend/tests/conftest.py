@@ -0,0 +1,37 @@
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+
+import pytest
+
+# Los módulos del backend se importan por nombre (from repository import db), como en server.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'mongo: necesita un MongoDB real en MONGO_URL')
+
+
+@pytest.fixture
+def mongo_database(monkeypatch):
+    """`async with mongo_database() as database`: MongoDBDatabase sobre una base descartable
+
+    Se conecta dentro del asyncio.run del test, porque el cliente de Motor queda atado a su loop.
+    """
+    if not os.environ.get('MONGO_URL'):
+        pytest.skip('MONGO_URL no está definida')
+    monkeypatch.setenv('DB_NAME', f'mathi_phone_test_{uuid.uuid4().hex[:8]}')
+
+    @asynccontextmanager
+    async def connect():
+        from mongodb_database import MongoDBDatabase
+        database = MongoDBDatabase()
+        await database.connect()
+        try:
+            yield database
+        finally:
+            await database.client.drop_database(database.db.name)
+            await database.disconnect()
+
+    return connect
@@ -0,0 +1,186 @@
+"""
+Pruebas de ExchangeRatesService contra un servidor HTTP local que reemplaza a CoinGecko y
+ExchangeRate-API: fetch en paralelo, reintentos, circuit breaker y últimas tasas buenas
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import exchange_rates_service
+from exchange_rates_service import ExchangeRatesService
+
+CRYPTO_BODY = {'bitcoin': {'usd': 50000}, 'ethereum': {'usd': 2500}, 'tether': {'usd': 1.0}}
+ARS_BODY = {'rates': {'ARS': 1250.0}}
+
+
+class StandIn:
+    """Servidor local: cada ruta responde según una lista de (status, cuerpo, demora)"""
+
+    def __init__(self):
+        self.scripts = {}
+        self.hits = {}
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.hits[self.path] = stand_in.hits.get(self.path, 0) + 1
+                    script = stand_in.scripts.get(self.path, [(404, {}, 0)])
+                    # La última respuesta se repite indefinidamente
+                    status, body, delay = script.pop(0) if len(script) > 1 else script[0]
+                time.sleep(delay)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def respond(self, path, *responses):
+        with self.lock:
+            self.scripts[path] = list(responses)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    server.thread.start()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def service(stand_in, monkeypatch):
+    monkeypatch.setattr(exchange_rates_service, 'backoff_delay', lambda attempt: 0)
+    service = ExchangeRatesService()
+    service.crypto_provider.url = f"{stand_in.base_url}/crypto"
+    service.ars_provider.url = f"{stand_in.base_url}/ars"
+    for provider in (service.crypto_provider, service.ars_provider):
+        provider.timeout = 2.0
+    return service
+
+
+def run(service, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await service.aclose()
+    return asyncio.run(main())
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.stored = None
+
+    async def get_exchange_rates(self):
+        return self.stored
+
+    async def update_exchange_rates(self, rates_data):
+        self.stored = dict(rates_data)
+        return True
+
+
+def test_providers_are_fetched_concurrently(stand_in, service, monkeypatch):
+    stand_in.respond('/crypto', (200, CRYPTO_BODY, 0.5))
+    stand_in.respond('/ars', (200, ARS_BODY, 0.5))
+    database = FakeDatabase()
+    monkeypatch.setattr(exchange_rates_service, 'db', database)
+    monkeypatch.setattr(exchange_rates_service.rates_cache, 'rates', None)
+    monkeypatch.setattr(exchange_rates_service.rates_cache, '_updated_at', 0.0)
+
+    started = time.monotonic()
+    assert run(service, service.update_exchange_rates()) is True
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 0.9  # en serie serían al menos 1 s
+    assert database.stored['ARS'] == 1250.0
+    assert database.stored['BTC'] == pytest.approx(1 / 50000)
+    assert database.stored['USD'] == 1.0
+
+
+def test_transient_errors_are_retried(stand_in, service):
+    stand_in.respond('/ars', (503, {}, 0), (500, {}, 0), (200, ARS_BODY, 0))
+
+    assert run(service, service.fetch_ars_rate()) == 1250.0
+    assert stand_in.hits['/ars'] == 3
+    assert service.ars_provider.breaker.state == 'closed'
+
+
+def test_retries_stop_after_max_attempts(stand_in, service):
+    stand_in.respond('/ars', (500, {}, 0))
+
+    assert run(service, service.fetch_ars_rate()) is None
+    assert stand_in.hits['/ars'] == service.max_attempts
+    assert service.ars_provider.breaker.failures == 1
+
+
+def test_last_good_rates_survive_a_failing_provider(stand_in, service):
+    stand_in.respond('/crypto', (200, CRYPTO_BODY, 0), (500, {}, 0))
+
+    async def fetch_twice():
+        first = await service.fetch_crypto_rates()
+        second = await service.fetch_crypto_rates()
+        return first, second
+
+    first, second = run(service, fetch_twice())
+    assert first['ETH'] == pytest.approx(1 / 2500)
+    assert second == first
+    assert stand_in.hits['/crypto'] == 1 + service.max_attempts
+
+
+def test_breaker_opens_and_skips_the_provider(stand_in, service):
+    stand_in.respond('/crypto', (200, CRYPTO_BODY, 0), (500, {}, 0))
+    breaker = service.crypto_provider.breaker
+
+    async def fetch(times):
+        return [await service.fetch_crypto_rates() for _ in range(times)]
+
+    results = run(service, fetch(1 + breaker.failure_threshold + 2))
+    assert breaker.state == 'open'
+    # Con el circuito abierto no se llama al proveedor y se devuelven las últimas tasas buenas
+    assert stand_in.hits['/crypto'] == 1 + breaker.failure_threshold * service.max_attempts
+    assert all(result == results[0] for result in results)
+
+
+def test_half_open_probe_closes_or_reopens_the_breaker(stand_in, service):
+    stand_in.respond('/ars', (500, {}, 0))
+    breaker = service.ars_provider.breaker
+    breaker.reset_timeout = 0.2
+
+    async def scenario():
+        for _ in range(breaker.failure_threshold):
+            await service.fetch_ars_rate()
+        assert breaker.state == 'open'
+
+        # Falla el intento de prueba: el circuito se vuelve a abrir enseguida
+        await asyncio.sleep(0.25)
+        assert breaker.state == 'half-open'
+        hits = stand_in.hits['/ars']
+        assert await service.fetch_ars_rate() is None
+        assert stand_in.hits['/ars'] == hits + service.max_attempts
+        assert breaker.state == 'open'
+
+        # El intento de prueba funciona: el circuito se cierra
+        stand_in.respond('/ars', (200, ARS_BODY, 0))
+        await asyncio.sleep(0.25)
+        assert await service.fetch_ars_rate() == 1250.0
+        assert breaker.state == 'closed'
+
+    run(service, scenario())
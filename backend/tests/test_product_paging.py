@@ -0,0 +1,100 @@
+"""
+Paginación por cursor de find_products en cada backend, con productos sin la clave de orden
+Los tests de MongoDB necesitan un servidor real: se saltean si no hay MONGO_URL.
+"""
+import asyncio
+
+import pytest
+
+from catalog import CatalogSnapshot
+from sqlite_database import SQLiteDatabase
+
+
+def product(index, **fields):
+    document = {
+        'id': f'paging-{index}', 'name': f'iPhone {index}', 'model': str(index), 'type': 'pro',
+        'storage': '128GB', 'color': 'Negro', 'condition': 'sealed', 'battery_health': 90,
+        'price_ars': 1000.0 * index, 'price_usd': 100.0 * index, 'screen_size': '6.1',
+        'chip': 'A15', 'camera': '12MP', 'features': ['5G'], 'available': True,
+        'category': 'iphone',
+    }
+    document.update(fields)
+    return document
+
+
+# Sin precio en dólares entre productos con precio: el cursor pasa por la clave nula
+PRODUCTS = [product(3), product(1), product(4, price_usd=None), product(2), product(5)]
+for document in PRODUCTS:
+    if document['price_usd'] is None:
+        del document['price_usd']
+
+
+async def walk(find, sort, limit=1):
+    """Todos los IDs en el orden de las páginas, siguiendo next_cursor"""
+    ids, cursor = [], None
+    while True:
+        page = await find(limit=limit, sort=sort, cursor=cursor)
+        ids.extend(document['id'] for document in page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            return ids
+
+
+def priced(ids):
+    return [int(product_id.split('-')[1]) for product_id in ids if product_id != 'paging-4']
+
+
+def check_pages(ids, sort):
+    # Cada producto una sola vez, incluido el que no tiene precio, y los demás en orden
+    assert sorted(ids) == sorted(document['id'] for document in PRODUCTS)
+    assert priced(ids) == sorted(priced(ids), reverse=sort.startswith('-'))
+
+
+async def fill(database):
+    for document in PRODUCTS:
+        await database.create_product(dict(document))
+
+
+@pytest.mark.parametrize('sort', ['price_usd', '-price_usd'])
+def test_sqlite_cursor_pages_past_a_missing_price(tmp_path, sort):
+    async def scenario():
+        database = SQLiteDatabase(str(tmp_path / 'paging.db'))
+        await database.connect()
+        try:
+            await fill(database)
+            return await walk(database.find_products, sort)
+        finally:
+            await database.disconnect()
+
+    check_pages(asyncio.run(scenario()), sort)
+
+
+@pytest.mark.parametrize('sort', ['price_usd', '-price_usd'])
+def test_catalog_cursor_pages_past_a_missing_price(tmp_path, sort):
+    async def scenario():
+        database = SQLiteDatabase(str(tmp_path / 'paging.db'))
+        await database.connect()
+        try:
+            await fill(database)
+            catalog = CatalogSnapshot()
+            await catalog.load(database)
+
+            async def query(**arguments):
+                return catalog.query(**arguments)
+
+            return await walk(query, sort)
+        finally:
+            await database.disconnect()
+
+    check_pages(asyncio.run(scenario()), sort)
+
+
+@pytest.mark.mongo
+@pytest.mark.parametrize('sort', ['price_usd', '-price_usd'])
+def test_mongo_cursor_pages_past_a_missing_price(mongo_database, sort):
+    async def scenario():
+        async with mongo_database() as database:
+            await fill(database)
+            return await walk(database.find_products, sort)
+
+    check_pages(asyncio.run(scenario()), sort)
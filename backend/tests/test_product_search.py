@@ -0,0 +1,70 @@
+"""
+Búsqueda de productos en MongoDB: consulta $text + prefijo y orden por relevancia
+Los tests marcados mongo necesitan un servidor real: se saltean si no hay MONGO_URL.
+"""
+import asyncio
+
+import pytest
+
+from product_query import build_search_query, has_text_score
+
+
+def product(product_id, name, description=''):
+    return {
+        'id': product_id, 'name': name, 'model': '15', 'type': 'pro', 'storage': '128GB',
+        'color': 'Negro', 'condition': 'sealed', 'battery_health': 100, 'price_ars': 1000.0,
+        'price_usd': 1000.0, 'screen_size': '6.1', 'chip': 'A17', 'camera': '48MP',
+        'features': ['5G'], 'available': True, 'category': 'iphone', 'description': description,
+    }
+
+
+# Los dos contienen "iphone pro" en el nombre; "max" está en el nombre de uno solo
+PRODUCTS = [
+    product('plain', 'iPhone 15 Pro', 'Pantalla max brillo'),
+    product('max', 'iPhone 15 Pro Max'),
+]
+
+
+def test_last_term_scores_without_filtering():
+    # Las frases filtran; el último término sin comillas solo suma al textScore
+    query = build_search_query('iphone pro max')
+    assert query['$text']['$search'].startswith('"')
+    assert query['$text']['$search'].endswith(' max')
+    assert has_text_score({'search': 'iphone pro max'})
+
+
+def test_single_term_has_no_text_score():
+    assert '$text' not in build_search_query('ip')
+    assert not has_text_score({'search': 'ip'})
+
+
+async def search(database, query):
+    page = await database.find_products({'search': query}, sort='relevance')
+    return [document['id'] for document in page.items]
+
+
+@pytest.mark.mongo
+def test_mongo_relevance_weighs_the_last_term(mongo_database):
+    async def scenario():
+        async with mongo_database() as database:
+            for document in PRODUCTS:
+                await database.create_product(dict(document))
+            return await search(database, 'iphone pro max'), await search(database, 'iphone pro ma')
+
+    complete, prefix = asyncio.run(scenario())
+    # "max" en el nombre (peso 3) le gana a "max" en la descripción (peso 1)
+    assert complete == ['max', 'plain']
+    # Un prefijo no está en $text: filtra por regex, el orden entre ambos no está garantizado
+    assert sorted(prefix) == ['max', 'plain']
+
+
+@pytest.mark.mongo
+def test_mongo_single_term_finds_prefixes(mongo_database):
+    async def scenario():
+        async with mongo_database() as database:
+            for document in PRODUCTS:
+                await database.create_product(dict(document))
+            return await search(database, 'ip'), await search(database, 'iphone')
+
+    # Sin $text (ver has_text_score) sort=relevance queda en orden de inserción
+    assert asyncio.run(scenario()) == (['plain', 'max'], ['plain', 'max'])
@@ -0,0 +1,186 @@
+"""
+Directorio de usuarios del panel de administración de Mathi Phone
+Los usuarios se cargan de una fuente intercambiable (JSON remoto, archivo local o MongoDB)
+a un diccionario en memoria que se refresca en segundo plano. Las contraseñas en texto plano
+se pasan a bcrypt al cargar, así todo login cuesta una verificación bcrypt, que corre en un
+pool de threads para no bloquear el event loop
+"""
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import bcrypt
+import httpx
+from repository import db
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = 12
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+
+class RemoteJSONSource:
+    """Lista de usuarios en una URL (p. ej. GitHub raw), pedida de forma condicional"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+
+    async def fetch(self) -> Optional[List[Dict[str, Any]]]:
+        """Usuarios, o None si no cambiaron desde la última carga (304)"""
+        headers = {}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(self.url, headers=headers)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        self._etag = response.headers.get('etag')
+        self._last_modified = response.headers.get('last-modified')
+        return response.json()
+
+
+class FileSource:
+    """Lista de usuarios en un archivo JSON local; se relee solo si cambió la fecha de modificación"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._mtime: Optional[float] = None
+
+    async def fetch(self) -> Optional[List[Dict[str, Any]]]:
+        mtime = self.path.stat().st_mtime
+        if mtime == self._mtime:
+            return None
+        users = await asyncio.to_thread(lambda: json.loads(self.path.read_text(encoding='utf-8')))
+        self._mtime = mtime
+        return users
+
+
+class DatabaseSource:
+    """Usuarios guardados en el backend configurado (colección o tabla users)"""
+
+    def __init__(self, database):
+        self.database = database
+
+    async def fetch(self) -> Optional[List[Dict[str, Any]]]:
+        return await self.database.get_users()
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    """Hash contra el que se compara cuando el usuario no existe, para que tarde lo mismo"""
+    return hash_password('mathi-phone')
+
+
+def check_password(password: str, stored: Optional[str]) -> bool:
+    """Verificar contra un hash bcrypt; sin hash se compara igual contra el dummy y falla"""
+    valid = bcrypt.checkpw(password.encode(), (stored or _dummy_hash()).encode())
+    return valid and stored is not None
+
+
+class UserDirectory:
+    def __init__(self, source, refresh_interval: float = 300.0, verify_workers: int = 4):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.users: Optional[Dict[str, Dict[str, Any]]] = None
+        self._executor = ThreadPoolExecutor(max_workers=verify_workers, thread_name_prefix='bcrypt')
+        # (usuario, contraseña en texto plano) -> hash, para no rehashear en cada refresco
+        self._hashed: Dict[Tuple[str, str], str] = {}
+        self._load_lock = asyncio.Lock()
+        # Una carga a la vez: la fuente ya marcó la versión como leída mientras se hashea
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> bool:
+        """Recargar desde la fuente; False si falló (se conservan los usuarios anteriores)"""
+        async with self._refresh_lock:
+            try:
+                users = await self.source.fetch()
+            except Exception as e:
+                logger.error(f"Error loading user directory: {e}")
+                return False
+            if users is not None:
+                users = {user['username']: user for user in users if user.get('username')}
+                loop = asyncio.get_running_loop()
+                self.users = await loop.run_in_executor(self._executor, self._hash_passwords, users)
+                logger.info(f"👤 Directorio de usuarios cargado: {len(self.users)} usuarios")
+            return True
+
+    def _hash_passwords(self, users: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Copia de los usuarios con `password_hash` bcrypt y sin la contraseña en texto plano"""
+        _dummy_hash()
+        hashed = {}
+        for username, user in users.items():
+            stored = user.get('password_hash') or user.get('password')
+            if stored and not stored.startswith(BCRYPT_PREFIXES):
+                key = (username, stored)
+                hashed[key] = self._hashed.get(key) or hash_password(stored)
+                stored = hashed[key]
+            user = {field: value for field, value in user.items() if field != 'password'}
+            user['password_hash'] = stored
+            users[username] = user
+        self._hashed = hashed
+        return users
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop(), name='user-directory')
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def get(self, username: str) -> Optional[Dict[str, Any]]:
+        if self.users is None:
+            # Arranque en frío: el primer login espera una carga (compartida entre requests)
+            async with self._load_lock:
+                if self.users is None and not await self.refresh():
+                    raise RuntimeError("User directory unavailable")
+        return self.users.get(username)
+
+    async def authenticate(self, username: str, password: str) -> Optional[Dict[str, Any]]:
+        """Usuario si la contraseña es correcta, None si no (con o sin usuario existente)"""
+        user = await self.get(username)
+        stored = user.get('password_hash') if user else None
+        loop = asyncio.get_running_loop()
+        valid = await loop.run_in_executor(self._executor, check_password, password, stored)
+        return user if valid and user else None
+
+
+USERS_URL = os.environ.get('USERS_URL', "https://raw.githubusercontent.com/kysrn-ww/mog/main/users.json")
+
+
+def directory_from_env(database) -> UserDirectory:
+    """USER_DIRECTORY=remote (USERS_URL), file (USERS_FILE) o database (users del backend; "mongo" es el nombre anterior)"""
+    kind = os.environ.get('USER_DIRECTORY', 'remote')
+    if kind == 'file':
+        source = FileSource(os.environ.get('USERS_FILE', 'users.json'))
+    elif kind in ('database', 'mongo'):
+        source = DatabaseSource(database)
+    else:
+        source = RemoteJSONSource(USERS_URL)
+    return UserDirectory(source, refresh_interval=float(os.environ.get('USERS_REFRESH_INTERVAL', 300)))
+
+
+# Instancia global: cada worker mantiene su propia copia del directorio
+user_directory = directory_from_env(db)
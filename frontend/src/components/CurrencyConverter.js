@@ -9,8 +9,8 @@ const CurrencyConverter = ({ basePrice }) => {
 
   useEffect(() => {
     fetchRates();
-    const interval = setInterval(fetchRates, 300000); // Update every 5 minutes
-    return () => clearInterval(interval);
+    // El servidor avisa cuando cambian las tasas; resync = se perdieron eventos
+    return api.subscribeEvents({ 'rates.updated': fetchRates, resync: fetchRates });
   }, []);
 
   const fetchRates = async () => {
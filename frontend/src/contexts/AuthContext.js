@@ -1,4 +1,5 @@
 import React, { createContext, useState, useContext, useEffect } from 'react';
+import api from '../utils/api';
 
 const AuthContext = createContext(null);
 
@@ -21,6 +22,8 @@ export const AuthProvider = ({ children }) => {
     };
 
     const logout = () => {
+        // Sin esperar la respuesta: el token se descarta localmente de todos modos
+        if (token) api.logout(token).catch(() => {});
         setToken(null);
     };
 
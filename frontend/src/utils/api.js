@@ -66,6 +66,35 @@ axiosInstance.interceptors.response.use(
   }
 );
 
+// Una sola conexión SSE por pestaña, compartida por todos los componentes suscritos
+let eventSource = null;
+const eventListeners = {};
+
+const subscribeEvents = (handlers) => {
+  if (!eventSource) {
+    eventSource = new EventSource(`${API}/events`);
+  }
+  Object.entries(handlers).forEach(([type, handler]) => {
+    if (!eventListeners[type]) {
+      eventListeners[type] = new Set();
+      eventSource.addEventListener(type, (event) => {
+        const data = event.data ? JSON.parse(event.data) : null;
+        eventListeners[type].forEach((listener) => listener(data));
+      });
+    }
+    eventListeners[type].add(handler);
+  });
+
+  return () => {
+    Object.entries(handlers).forEach(([type, handler]) => eventListeners[type].delete(handler));
+    if (Object.values(eventListeners).every((listeners) => listeners.size === 0)) {
+      eventSource.close();
+      eventSource = null;
+      Object.keys(eventListeners).forEach((type) => delete eventListeners[type]);
+    }
+  };
+};
+
 export const api = {
   // Products
   getProducts: async (filters = {}) => {
@@ -116,9 +145,18 @@ export const api = {
     return response.data;
   },
 
+  // Live events (SSE): devuelve la función para desuscribirse
+  subscribeEvents,
+
   login: async (username, password) => {
     const response = await axiosInstance.post('/login', { username, password });
     return response.data;
+  },
+
+  // Revoca el token actual en el backend
+  logout: async (token) => {
+    const response = await axiosInstance.post('/logout', null, { headers: { Authorization: `Bearer ${token}` } });
+    return response.data;
   }
 };
 